@@ -1,17 +1,37 @@
-from fastapi import FastAPI, HTTPException
-import yfinance as yf
-import quantstats as qs
+import time
+_import_started = time.perf_counter()
+
+import asyncio
+import os
+from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
 import pandas as pd
 import numpy as np
-from datetime import datetime, timedelta
-import seaborn as sns
-import matplotlib.pyplot as plt
-import io
-import base64
+from datetime import datetime
+from collections import defaultdict
 from pydantic import BaseModel, Field
-from typing import List, Dict, Any, Optional, Union
-import json
+from typing import List, Dict, Any, Optional
 from fastapi.middleware.cors import CORSMiddleware
+from providers import get_price_provider
+from quotes import quote_service
+from scheduler import scheduler
+from batch import weight_matrix, portfolio_returns_matrix
+from backtest import backtest, REBALANCE_SCHEDULES
+from metrics import risk_metrics, drawdown_series
+from drawdowns import drawdown_episodes, worst_episodes, episode_records
+from encoding import date_labels, float_list, series_rows, series_payload, encode_json
+from downsample import downsample_indices
+from correlation import pairwise_correlation, cluster_order, upper_triangle, top_pairs
+from state import AnalysisState, benchmark_returns_for
+from result_cache import result_cache, state_key
+from fastapi.responses import Response, PlainTextResponse, StreamingResponse
+from instrumentation import span, timed_call, server_timing, metrics_registry, profile_sampler
+from singleflight import AsyncSingleFlight
+import optimization
+from streaming import LivePortfolio, get_quote_source
+from pydantic import ValidationError
+import startup
+from contextlib import asynccontextmanager
+from functools import cached_property
 
 # Define Pydantic models for request validation
 class PortfolioRequest(BaseModel):
@@ -20,12 +40,66 @@ class PortfolioRequest(BaseModel):
     stocks: List[str] = Field(..., description="List of stock tickers")
     weights: List[float] = Field(..., description="List of weights for each stock (should sum to 1.0)")
     benchmark: str = Field("SPY", description="Benchmark ticker")
+    rolling_windows: Optional[List[int]] = Field(None, description="Extra rolling window lengths in trading days, e.g. [20, 60, 120, 252]")
+    response_format: str = Field("rows", description="'rows' for per-point objects, 'columnar' for one shared dates array plus one array per series")
+    max_points: Optional[int] = Field(None, description="Downsample chart series to at most this many points (the returns distribution to an evenly spaced sample of days, with its own dates in columnar mode); metrics still use every day")
+    downsample_method: str = Field("lttb", description="'lttb' (largest triangle three buckets) or 'minmax' bucketing")
+    correlation_format: str = Field("matrix", description="'matrix' for nested objects, 'compact' for a float32 upper triangle plus a ticker index")
+    correlation_order: str = Field("input", description="'input' keeps the request's ticker order, 'cluster' groups correlated tickers together")
+    correlation_top_k: Optional[int] = Field(None, description="Also list each ticker's k most correlated other tickers")
+    rebalance: str = Field("daily", description="Rebalancing schedule: 'daily', 'weekly', 'monthly', 'quarterly', 'annual', or 'none' for buy-and-hold")
+    drift_threshold: Optional[float] = Field(None, description="Rebalance only when a weight has drifted more than this from its target, e.g. 0.05; checked on the schedule's days, or daily with 'none'")
+    transaction_cost_bps: float = Field(0.0, description="Cost of each rebalance in basis points of the value traded")
+    sections: Optional[List[str]] = Field(None, description="Report sections to compute, in this order (default: all): live_market_data, cumulative_returns, key_metrics, rebalancing, monthly_returns, returns_distribution, rolling_metrics, risk_metrics, drawdowns, benchmark_analytics, correlation_matrix")
+
+class PortfolioWeights(BaseModel):
+    name: Optional[str] = Field(None, description="Optional label for this portfolio")
+    stocks: List[str] = Field(..., description="List of stock tickers")
+    weights: List[float] = Field(..., description="List of weights for each stock (should sum to 1.0)")
+
+class BatchPortfolioRequest(BaseModel):
+    start_date: str = Field(..., description="Start date in YYYY-MM-DD format")
+    end_date: str = Field(..., description="End date in YYYY-MM-DD format")
+    portfolios: List[PortfolioWeights] = Field(..., description="Portfolios to evaluate, each over the dates on which all of its stocks have returns")
+    benchmark: str = Field("SPY", description="Benchmark ticker")
+
+class OptimizeRequest(BaseModel):
+    start_date: str = Field(..., description="Start date in YYYY-MM-DD format")
+    end_date: str = Field(..., description="End date in YYYY-MM-DD format")
+    stocks: List[str] = Field(..., description="List of stock tickers to allocate between")
+    long_only: bool = Field(True, description="Restrict weights to [0, 1]; false allows short positions")
+    risk_free_rate: float = Field(0.0, description="Annual risk-free rate used in Sharpe ratios")
+    frontier_points: int = Field(25, description="Number of efficient-frontier portfolios to return")
+    samples: int = Field(0, description="Random portfolios to score in a Monte-Carlo sweep (0 skips the sweep)")
+    top_k: int = Field(10, description="Best sweep portfolios by Sharpe ratio to return")
+    cloud_points: int = Field(1000, description="Sweep portfolios to return as (volatility, return, sharpe) points for plotting")
+    seed: Optional[int] = Field(None, description="Seed for the Monte-Carlo sweep, for reproducible results")
+
+class StreamRequest(BaseModel):
+    start_date: str = Field(..., description="Start date of the history behind volatility, beta and drawdown, YYYY-MM-DD")
+    end_date: Optional[str] = Field(None, description="Last day of history in YYYY-MM-DD format; defaults to today")
+    stocks: List[str] = Field(..., description="List of stock tickers")
+    weights: List[float] = Field(..., description="List of weights for each stock (should sum to 1.0)")
+    benchmark: str = Field("SPY", description="Benchmark ticker")
+    initial_value: float = Field(1.0, description="Portfolio value at the start date; streamed values are scaled by it")
+
+@asynccontextmanager
+async def lifespan(app):
+    # Warm the analytics kernels before taking traffic, unless the pre-fork parent already did
+    if startup.timings["warmup_seconds"] is None and os.environ.get("APP_WARM_UP", "1") != "0":
+        startup.timings["warmup_seconds"] = startup.warm_up()
+    startup.check_budget()
+    yield
+    # Stop the analytics worker pools when the server shuts down
+    scheduler.shutdown()
+    optimization.shutdown()
 
 # Initialize FastAPI app
 app = FastAPI(
     title="Portfolio Analytics API",
     description="API for analyzing portfolio performance with comprehensive metrics and visualizations",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Add CORS middleware
@@ -37,137 +111,141 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Function to fetch data and calculate portfolio returns
-def get_portfolio_data(stocks, weights, start_date, end_date):
+# Parse and validate a request's date range, capping the end date at today
+def parse_date_range(start, end):
     try:
-        # Download data for all stocks at once
-        data = yf.download(stocks, start=start_date, end=end_date, progress=False)
-        
-        if data.empty:
-            raise HTTPException(status_code=404, detail="No data available for the selected stocks")
-            
-        # Handle data structure based on number of stocks
-        if len(stocks) == 1:
-            # For single stock, data structure is different
-            closes = pd.DataFrame(data['Close'], columns=stocks)
-        else:
-            # For multiple stocks, get all 'Close' prices
-            closes = data['Close']
+        start_date = datetime.strptime(start, '%Y-%m-%d').date()
+        end_date = datetime.strptime(end, '%Y-%m-%d').date()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
         
-        # Calculate returns
-        returns = closes.pct_change().dropna()  # Drop NaN values
-        portfolio_returns = (returns * weights).sum(axis=1)
+    # Validate dates
+    today = datetime.now().date()
+    if start_date >= end_date:
+        raise HTTPException(status_code=400, detail="End date must be after start date")
         
-        # Calculate cumulative returns for each stock
-        stock_cum_returns = (1 + returns).cumprod()
+    if end_date > today:
+        end_date = today
+    
+    return start_date, end_date
+
+# Validate that stocks and weights describe a fully invested portfolio
+def validate_weights(stocks, weights):
+    if len(stocks) != len(weights):
+        raise HTTPException(status_code=400, detail="Number of stocks must match number of weights")
         
-        return closes, returns, portfolio_returns, stock_cum_returns
+    if not stocks:
+        raise HTTPException(status_code=400, detail="Please provide at least one stock ticker")
         
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error fetching portfolio data: {str(e)}")
+    if abs(sum(weights) - 1.0) > 0.0001:
+        raise HTTPException(status_code=400, detail="Weights must sum to 1.0")
 
-# Function to get live price data
-def get_live_price(ticker):
+# Rebalancing settings of a request, as keyword arguments of backtest()
+def rebalancing_settings(request):
+    if request.rebalance not in REBALANCE_SCHEDULES:
+        raise HTTPException(status_code=400, detail=f"rebalance must be one of: {', '.join(REBALANCE_SCHEDULES)}")
+    if request.drift_threshold is not None and not 0 < request.drift_threshold < 1:
+        raise HTTPException(status_code=400, detail="drift_threshold must be between 0 and 1")
+    if request.transaction_cost_bps < 0:
+        raise HTTPException(status_code=400, detail="transaction_cost_bps must not be negative")
+    # None stands for the default rule, so equivalent requests share cached states
+    if request.rebalance == "daily" and request.drift_threshold is None and not request.transaction_cost_bps:
+        return None
+    return {"schedule": request.rebalance, "drift_threshold": request.drift_threshold,
+            "cost_bps": request.transaction_cost_bps}
+
+# Function to fetch data and calculate portfolio returns; rebalancing defaults to
+# daily rebalancing to fixed weights without costs
+def get_portfolio_data(stocks, weights, start_date, end_date, rebalancing=None):
     try:
-        stock = yf.Ticker(ticker)
-        info = stock.info
-        if not info:
-            return None
+        # Fetch closes for all stocks at once, one column per stock in request order
+        with span("download"):
+            closes = get_price_provider().get_closes(stocks, start_date, end_date)
+        
+        if closes.empty:
+            raise HTTPException(status_code=404, detail="No data available for the selected stocks")
+        
+        # Calculate returns
+        with span("returns"):
+            returns = closes.pct_change().dropna()  # Drop NaN values
+            
+            # Calculate cumulative returns for each stock
+            stock_cum_returns = (1 + returns).cumprod()
+        
+        # Portfolio returns under the rebalancing rule
+        with span("backtest"):
+            result = backtest(returns, weights, **(rebalancing or {}))
+            portfolio_returns = result.portfolio_returns
+            
+        return closes, returns, portfolio_returns, stock_cum_returns, result
         
-        return {
-            'price': info.get('regularMarketPrice', 0),
-            'change': info.get('regularMarketChangePercent', 0),
-            'volume': info.get('regularMarketVolume', 0),
-            'market_cap': info.get('marketCap', 0),
-            'pe_ratio': info.get('forwardPE', 0),
-            'dividend_yield': info.get('dividendYield', 0) if info.get('dividendYield') else 0
-        }
     except Exception as e:
-        return None
+        raise HTTPException(status_code=500, detail=f"Error fetching portfolio data: {str(e)}")
 
-def get_drawdown_details(returns):
+def get_drawdown_details(returns, top_k=None):
     """
     Returns simplified drawdown details with only the required fields:
-    start date, recovery date, drawdown magnitude, and underwater days.
+    start date, recovery date, drawdown magnitude, and underwater days,
+    worst first. With top_k only the worst top_k episodes are returned.
     """
     try:
-        # Calculate drawdown series using QuantStats
-        drawdown = qs.stats.to_drawdown_series(returns)
-        
-        # Get drawdown details DataFrame from QuantStats
-        dd_details = qs.stats.drawdown_details(drawdown)
-        
-        # Initialize the list to store processed drawdown records
-        data = []
-        
-        # Process each drawdown period
-        for _, row in dd_details.iterrows():
-            # Extract only start and end dates safely
-            start = row['start']
-            end = row['end']
-            
-            # Format dates as strings (handle NaT or non-datetime objects gracefully)
-            start_str = start.strftime('%Y-%m-%d') if pd.notna(start) and hasattr(start, 'strftime') else str(start)
-            recovery_str = end.strftime('%Y-%m-%d') if pd.notna(end) and hasattr(end, 'strftime') else str(end)
-            
-            # Ensure underwater days and max drawdown are properly processed
-            underwater = int(row['days']) if pd.notna(row['days']) else 0
-            max_dd = float(row['max drawdown']) if pd.notna(row['max drawdown']) else 0
-            max_dd = max_dd / 100.0  # Convert from percentage to decimal
-            
-            # Create simplified dictionary with only the required fields
-            drawdown_record = {
-                'start': start_str,
-                'recovery': recovery_str,
-                'drawdown': max_dd,
-                'underwater': underwater
-            }
-            
-            data.append(drawdown_record)
+        # Calculate drawdown series and find its episodes
+        drawdown = drawdown_series(returns)
+        episodes = drawdown_episodes(drawdown.to_numpy(), drawdown.index)
         
-        # Sort by worst drawdown (most negative first)
-        return sorted(data, key=lambda x: x['drawdown'])
+        # Select and order the worst drawdowns (most negative first)
+        positions = worst_episodes(episodes, top_k)
+        return episode_records(episodes, positions, drawdown.index.strftime('%Y-%m-%d').to_numpy())
     
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error calculating drawdown details: {str(e)}")
 
+# Pairwise correlations of the stocks' daily returns, either as nested {stock: {stock: value}}
+# dicts or, when compact, as a float32 upper triangle read against a ticker index.
+# Returns the matrix payload and, with top_k, each stock's most correlated peers
+def get_correlation_matrix(returns, stocks, compact=False, order="input", top_k=None):
+    corr = pairwise_correlation(returns[stocks].to_numpy())
+    
+    # Optionally reorder so that correlated tickers sit next to each other
+    positions = cluster_order(corr) if order == "cluster" else np.arange(len(stocks))
+    corr = corr[np.ix_(positions, positions)]
+    tickers = [stocks[i] for i in positions]
+    
+    if compact:
+        matrix_data = {"format": "upper_triangle", "tickers": tickers, "values": upper_triangle(corr)}
+    else:
+        matrix_data = {ticker: dict(zip(tickers, row)) for ticker, row in zip(tickers, float_list(corr))}
+    
+    top_pairs_data = None
+    if top_k:
+        peers, values = top_pairs(corr, top_k)
+        top_pairs_data = {
+            ticker: [{"ticker": tickers[peer], "correlation": value}
+                     for peer, value in zip(peer_row, value_row) if peer >= 0]
+            for ticker, peer_row, value_row in zip(tickers, peers.tolist(), values.tolist())
+        }
+    
+    return matrix_data, top_pairs_data
+
 # Function to calculate risk metrics
 def calculate_risk_metrics(returns, benchmark_returns=None):
     try:
         # Ensure returns and benchmark_returns have the same index
-        if benchmark_returns is not None:
+        if benchmark_returns is not None and not returns.index.equals(benchmark_returns.index):
             common_index = returns.index.intersection(benchmark_returns.index)
             if len(common_index) == 0:
                 raise HTTPException(status_code=400, detail="No overlapping dates between portfolio and benchmark returns")
                 
             # Sort the common index to ensure proper alignment
-            common_index = sorted(common_index)
-            returns = returns[common_index]
-            benchmark_returns = benchmark_returns[common_index]
-        
-        metrics = {
-            'Sharpe_Ratio': float(qs.stats.sharpe(returns)),
-            'Sortino_Ratio': float(qs.stats.sortino(returns)),
-            'Max_Drawdown': float(qs.stats.max_drawdown(returns)),
-            'CAGR': float(qs.stats.cagr(returns)),
-            'Volatility': float(qs.stats.volatility(returns)),
-            'Win_Rate': float(qs.stats.win_rate(returns)),
-            'Profit_Ratio': float(qs.stats.profit_ratio(returns)),
-            'Value_at_Risk': float(qs.stats.var(returns))
-        }
+            common_index = common_index.sort_values()
+            returns = returns.loc[common_index]
+            benchmark_returns = benchmark_returns.loc[common_index]
         
+        # All scalar metrics come from one pass over the return series
         if benchmark_returns is not None and not benchmark_returns.empty:
-            try:
-                # Get beta from greeks
-                greeks = qs.stats.greeks(returns, benchmark_returns)
-                metrics.update({
-                    'Beta': float(greeks.get('beta', 0)),
-                    'Alpha': float(greeks.get('alpha', 0)),
-                    'Information_Ratio': float(qs.stats.information_ratio(returns, benchmark_returns))
-                })
-            except Exception:
-                # If benchmark metrics fail, continue without them
-                pass
+            metrics = risk_metrics(returns.to_numpy(), benchmark_returns.to_numpy())
+        else:
+            metrics = risk_metrics(returns.to_numpy())
         
         return metrics
     except Exception as e:
@@ -175,50 +253,536 @@ def calculate_risk_metrics(returns, benchmark_returns=None):
             raise e
         raise HTTPException(status_code=500, detail=f"Error calculating risk metrics: {str(e)}")
 
-# Endpoint for portfolio analysis
-@app.post("/analyze_portfolio", response_model=Dict[str, Any])
-async def analyze_portfolio(request: PortfolioRequest):
+# Fetch the benchmark closes for a date range, or None when they are unavailable
+def fetch_benchmark_prices(benchmark_closes, benchmark):
     try:
-        # Parse dates
+        benchmark_data = benchmark_closes.result()
+        if benchmark_data.empty:
+            return None
+        benchmark_prices = benchmark_data[benchmark].dropna()
+        return benchmark_prices if not benchmark_prices.empty else None
+    except Exception:
+        return None
+
+# Build the analysis state for a portfolio from scratch
+def build_analysis_state(stocks, weights, start_date, end_date, benchmark, rebalancing=None):
+    # Download the benchmark concurrently with the portfolio prices
+    benchmark_closes = scheduler.run_io(get_price_provider().get_closes, [benchmark], start_date, end_date)
+    
+    closes, returns, portfolio_returns, stock_cum_returns, result = get_portfolio_data(
+        stocks, weights, start_date, end_date, rebalancing)
+    with span("benchmark_download"):
+        benchmark_prices = fetch_benchmark_prices(benchmark_closes, benchmark)
+    with span("state"):
+        return AnalysisState(stocks, weights, start_date, end_date, closes, returns, portfolio_returns,
+                             stock_cum_returns, benchmark, benchmark_prices, backtest=result)
+
+# Extend a cached state with the days between its end date and the new one
+def extend_analysis_state(state, end_date):
+    benchmark_closes = scheduler.run_io(get_price_provider().get_closes, [state.benchmark], state.end_date, end_date)
+    with span("download"):
+        new_closes = get_price_provider().get_closes(state.stocks, state.end_date, end_date)
+    with span("benchmark_download"):
+        benchmark_prices = fetch_benchmark_prices(benchmark_closes, state.benchmark)
+    with span("state"):
+        return state.extend(new_closes, benchmark_prices, end_date)
+
+# Look up the portfolio's state in the result cache; on a near miss where only the
+# end date moved forward, append the new days instead of recomputing the history
+def get_analysis_state(stocks, weights, start_date, end_date, benchmark, rebalancing=None):
+    key = state_key(stocks, weights, start_date, benchmark, rebalancing)
+    state = result_cache.get(key)
+    
+    if state is not None and state.end_date == end_date:
+        result_cache.record("hit")
+        return state
+    
+    if state is not None and state.end_date < end_date:
+        try:
+            state = extend_analysis_state(state, end_date)
+            result_cache.record("extension")
+        except Exception as e:
+            print(f"Error extending cached analysis, rebuilding: {str(e)}")
+            state = None
+    else:
+        state = None
+    
+    if state is None:
+        state = build_analysis_state(stocks, weights, start_date, end_date, benchmark, rebalancing)
+        result_cache.record("miss")
+    
+    result_cache.put(key, state)
+    return state
+
+# Report sections in their default order; `sections` on a request selects and orders them
+REPORT_SECTIONS = ("live_market_data", "cumulative_returns", "key_metrics", "rebalancing", "monthly_returns",
+                   "returns_distribution", "rolling_metrics", "risk_metrics", "drawdowns", "benchmark_analytics",
+                   "correlation_matrix")
+
+# Sections whose charts share the (possibly downsampled) dates
+CHART_SECTIONS = {"cumulative_returns", "returns_distribution", "rolling_metrics", "risk_metrics", "drawdowns",
+                  "benchmark_analytics"}
+
+# Sections that read the full analysis state: cumulative wealth, drawdowns, the
+# rolling engine or the backtest's trades. The others need only daily returns
+STATE_SECTIONS = {"cumulative_returns", "rebalancing", "rolling_metrics", "risk_metrics", "drawdowns",
+                  "benchmark_analytics"}
+
+# Validated inputs of one report and its shared intermediates, each computed on first
+# use: a report renders only the sections it asks for and builds only what they read.
+# One without historical sections downloads nothing, and one whose sections need only
+# daily returns skips the benchmark, rolling moments and drawdowns unless the full
+# state is already cached
+class ReportContext:
+    def __init__(self, request: PortfolioRequest):
+        # Parse and validate dates
+        self.start_date, self.end_date = parse_date_range(request.start_date, request.end_date)
+        
+        # Validate stocks and weights
+        self.stocks = request.stocks
+        self.weights = request.weights
+        validate_weights(self.stocks, self.weights)
+        
+        self.rolling_windows = list(dict.fromkeys(request.rolling_windows or []))
+        if any(window < 2 for window in self.rolling_windows):
+            raise HTTPException(status_code=400, detail="Rolling windows must be at least 2 days")
+        
+        if request.response_format not in ("rows", "columnar"):
+            raise HTTPException(status_code=400, detail="response_format must be 'rows' or 'columnar'")
+        self.columnar = request.response_format == "columnar"
+        
+        if request.max_points is not None and request.max_points < 10:
+            raise HTTPException(status_code=400, detail="max_points must be at least 10")
+        if request.downsample_method not in ("lttb", "minmax"):
+            raise HTTPException(status_code=400, detail="downsample_method must be 'lttb' or 'minmax'")
+        if request.correlation_format not in ("matrix", "compact"):
+            raise HTTPException(status_code=400, detail="correlation_format must be 'matrix' or 'compact'")
+        if request.correlation_order not in ("input", "cluster"):
+            raise HTTPException(status_code=400, detail="correlation_order must be 'input' or 'cluster'")
+        if request.correlation_top_k is not None and request.correlation_top_k < 1:
+            raise HTTPException(status_code=400, detail="correlation_top_k must be at least 1")
+        self.rebalancing = rebalancing_settings(request)
+        
+        self.sections = list(dict.fromkeys(request.sections)) if request.sections is not None else list(REPORT_SECTIONS)
+        unknown = [section for section in self.sections if section not in REPORT_SECTIONS]
+        if unknown or not self.sections:
+            raise HTTPException(status_code=400, detail=f"sections must be a non-empty list of: {', '.join(REPORT_SECTIONS)}")
+        
+        self.needs_state = any(section in STATE_SECTIONS for section in self.sections)
+        
+        self.request = request
+        self.benchmark = request.benchmark
+        self.live_quotes = None
+    
+    def start(self):
+        # Start fetching live market data so it overlaps with the historical download
+        if "live_market_data" in self.sections and self.live_quotes is None:
+            self.live_quotes = quote_service.submit(self.stocks)
+    
+    def settings(self):
+        return {
+            "stocks": [{"ticker": stock, "weight": weight} for stock, weight in zip(self.stocks, self.weights)],
+            "date_range": {
+                "start": self.start_date.strftime('%Y-%m-%d'),
+                "end": self.end_date.strftime('%Y-%m-%d')
+            },
+            "benchmark": self.benchmark,
+            "rebalancing": {
+                "schedule": self.request.rebalance,
+                "drift_threshold": self.request.drift_threshold,
+                "transaction_cost_bps": self.request.transaction_cost_bps
+            }
+        }
+    
+    @cached_property
+    def state(self):
+        # Reuse, extend or build the full-resolution intermediates for this portfolio
+        return get_analysis_state(self.stocks, self.weights, self.start_date, self.end_date, self.benchmark,
+                                  self.rebalancing)
+    
+    @cached_property
+    def uses_state(self):
+        # Whether daily returns are read from the full state: a section needs the
+        # state anyway, or it is already cached for these dates
+        if self.needs_state:
+            return True
+        cached = result_cache.get(state_key(self.stocks, self.weights, self.start_date, self.benchmark,
+                                            self.rebalancing))
+        return cached is not None and cached.end_date == self.end_date
+    
+    @cached_property
+    def history(self):
+        # Daily stock and portfolio returns, computed from the closes alone when the
+        # state is not used
+        if self.uses_state:
+            return self.state.returns, self.state.portfolio_returns
+        _, returns, portfolio_returns, _, _ = get_portfolio_data(
+            self.stocks, self.weights, self.start_date, self.end_date, self.rebalancing)
+        return returns, portfolio_returns
+    
+    @cached_property
+    def returns(self):
+        return self.history[0]
+    
+    @cached_property
+    def portfolio_returns(self):
+        return self.history[1]
+    
+    @cached_property
+    def benchmark_returns(self):
+        if self.uses_state:
+            return self.state.benchmark_returns
+        # Download the benchmark concurrently with the portfolio prices
+        benchmark_closes = scheduler.run_io(get_price_provider().get_closes, [self.benchmark],
+                                            self.start_date, self.end_date)
+        portfolio_returns = self.portfolio_returns
+        with span("benchmark_download"):
+            benchmark_prices = fetch_benchmark_prices(benchmark_closes, self.benchmark)
+        return benchmark_returns_for(benchmark_prices, portfolio_returns)
+    
+    @cached_property
+    def dates(self):
+        # Every time series shares the portfolio's dates
+        return date_labels(self.portfolio_returns.index)
+    
+    @cached_property
+    def keep(self):
+        # Optionally thin the chart series to one shared set of shape-preserving points;
+        # headline metrics and tables keep using every day
+        with span("downsample"):
+            max_points = self.request.max_points
+            if max_points is None or len(self.dates) <= max_points:
+                return None
+            state = self.state
+            return downsample_indices(
+                [state.portfolio_cum_return.to_numpy(), state.portfolio_drawdown.to_numpy(),
+                 state.rolling.sharpe(126), state.rolling.volatility(30)],
+                max_points, self.request.downsample_method
+            )
+    
+    @cached_property
+    def distribution_keep(self):
+        # The returns histogram needs an unbiased sample: shape-preserving selection
+        # favours the extreme days and would fatten its tails, so take every k-th day
+        max_points = self.request.max_points
+        if max_points is None or len(self.dates) <= max_points:
+            return None
+        return np.unique(np.linspace(0, len(self.dates) - 1, max_points).round().astype(np.intp))
+    
+    def thin(self, values):
+        values = np.asarray(values)
+        return values if self.keep is None else values[self.keep]
+    
+    @cached_property
+    def chart_dates(self):
+        return self.thin(self.dates)
+    
+    @cached_property
+    def metrics(self):
+        with span("risk_metrics"):
+            return calculate_risk_metrics(self.portfolio_returns, self.benchmark_returns)
+
+# Each section renderer returns the part of the response it fills in
+
+def render_live_market_data(report):
+    # Collect live market data
+    with span("quotes"):
+        return {"live_market_data": report.live_quotes.result()}
+
+# Portfolio Overview
+def render_cumulative_returns(report):
+    state, thin, stocks = report.state, report.thin, report.stocks
+    with span("cumulative_returns"):
         try:
-            start_date = datetime.strptime(request.start_date, '%Y-%m-%d').date()
-            end_date = datetime.strptime(request.end_date, '%Y-%m-%d').date()
-        except ValueError:
-            raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
+            # Prepare data for cumulative returns chart
+            if report.columnar:
+                cum_returns_data = {
+                    "portfolio": thin(state.portfolio_cum_return),
+                    "stocks": {stock: thin(state.stock_cum_returns[stock]) for stock in stocks}
+                }
+            else:
+                cum_returns_data = {
+                    "dates": report.chart_dates.tolist(),
+                    "portfolio": float_list(thin(state.portfolio_cum_return)),
+                    "stocks": {stock: float_list(thin(state.stock_cum_returns[stock])) for stock in stocks}
+                }
             
-        # Validate dates
-        today = datetime.now().date()
-        if start_date >= end_date:
-            raise HTTPException(status_code=400, detail="End date must be after start date")
+            # Add benchmark if available
+            benchmark_returns = state.benchmark_returns
+            if benchmark_returns is not None:
+                benchmark_cum_return = (1 + benchmark_returns).cumprod()
+                if report.columnar or report.keep is not None:
+                    # Align with the shared dates; days without a benchmark value become null
+                    benchmark_values = thin(benchmark_cum_return.reindex(state.portfolio_returns.index))
+                    if not report.columnar:
+                        benchmark_values = float_list(benchmark_values)
+                else:
+                    benchmark_values = float_list(benchmark_cum_return.to_numpy())
+                cum_returns_data["benchmark"] = {
+                    "ticker": report.benchmark,
+                    "values": benchmark_values
+                }
             
-        if end_date > today:
-            end_date = today
+            return {"portfolio_overview": {"cumulative_returns": cum_returns_data}}
+        except Exception as e:
+            print(f"Error creating cumulative returns data: {str(e)}")
+            return {"portfolio_overview": {"cumulative_returns": {"dates": [], "portfolio": [], "stocks": {}}}}
+
+# Calculate key metrics
+def render_key_metrics(report):
+    return {"portfolio_overview": {"key_metrics": report.metrics}} if report.metrics else {}
+
+# Trades implied by the rebalancing rule
+def render_rebalancing(report):
+    trades = report.state.backtest
+    if trades is None:
+        return {}
+    recent = slice(-12, None)
+    # A cached state keeps the ticker order of the request that built it
+    held = dict(zip(report.state.stocks, trades.final_weights))
+    return {"portfolio_overview": {"rebalancing": {
+        "rebalances": len(trades.rebalance_dates),
+        "total_turnover": float(trades.turnover.sum()),
+        "average_turnover": float(trades.turnover.mean()) if len(trades.turnover) else 0.0,
+        "transaction_costs": trades.cost_drag,
+        "current_weights": {stock: float(held[stock]) for stock in report.stocks},
+        "recent_rebalances": [
+            {"date": date, "turnover": float(turnover), "cost": float(cost)}
+            for date, turnover, cost in zip(date_labels(trades.rebalance_dates[recent]).tolist(),
+                                            trades.turnover[recent], trades.costs[recent])
+        ]
+    }}}
+
+# Returns Analysis
+# Monthly returns heatmap data
+def render_monthly_returns(report):
+    with span("monthly_returns"):
+        try:
+            monthly_returns = report.portfolio_returns.resample('M').apply(lambda x: (1 + x).prod() - 1)
+            heatmap_data = []
             
-        # Validate stocks and weights
-        stocks = request.stocks
-        weights = request.weights
-        
-        if len(stocks) != len(weights):
-            raise HTTPException(status_code=400, detail="Number of stocks must match number of weights")
+            for i, (date, value) in enumerate(monthly_returns.items()):
+                if not pd.isna(value):
+                    year = date.year
+                    month = date.month
+                    heatmap_data.append({
+                        "year": year,
+                        "month": month,
+                        "return": float(value)
+                    })
             
-        if not stocks:
-            raise HTTPException(status_code=400, detail="Please provide at least one stock ticker")
+            return {"returns_analysis": {"monthly_returns_heatmap": heatmap_data}}
+        except Exception as e:
+            print(f"Error creating monthly returns heatmap: {str(e)}")
+            return {"returns_analysis": {"monthly_returns_heatmap": []}}
+
+# Returns distribution data; when downsampled it is an evenly spaced sample of the
+# days, which in columnar mode carries its own dates instead of the shared ones
+def render_returns_distribution(report):
+    try:
+        dates, returns = report.dates, report.portfolio_returns.to_numpy()
+        keep = report.distribution_keep
+        if keep is None:
+            distribution = series_payload(dates, {"return": returns}, report.columnar, skip_missing=True)
+        elif report.columnar:
+            distribution = {"dates": dates[keep], "return": returns[keep]}
+        else:
+            distribution = series_rows(dates[keep], {"return": returns[keep]}, skip_missing=True)
+        return {"returns_analysis": {"returns_distribution": distribution}}
+    except Exception as e:
+        print(f"Error creating returns distribution: {str(e)}")
+        return {"returns_analysis": {"returns_distribution": []}}
+
+def render_rolling_metrics(report):
+    rolling, thin, chart_dates, columnar = report.state.rolling, report.thin, report.chart_dates, report.columnar
+    section = {}
+    with span("rolling_metrics"):
+        # Rolling metrics
+        try:
+            section["rolling_sharpe"] = series_payload(chart_dates, {"sharpe": thin(rolling.sharpe(126))}, columnar)
+        except Exception:
+            section["rolling_sharpe"] = []
+        
+        try:
+            section["rolling_sortino"] = series_payload(chart_dates, {"sortino": thin(rolling.sortino(126))}, columnar)
+        except Exception:
+            section["rolling_sortino"] = []
+        
+        # Rolling metrics for any extra windows the caller asked for
+        if report.rolling_windows:
+            try:
+                rolling_frame = rolling.frame(report.rolling_windows)
+                windows_data = {}
+                for window in report.rolling_windows:
+                    suffix = f"_{window}d"
+                    columns = {column[:-len(suffix)]: thin(rolling_frame[column])
+                               for column in rolling_frame.columns if column.endswith(suffix)}
+                    windows_data[str(window)] = columns if columnar else series_rows(chart_dates, columns)
+                section["rolling_metrics"] = windows_data
+            except Exception:
+                section["rolling_metrics"] = {}
+    return {"returns_analysis": section}
+
+# Risk Metrics
+def render_risk_metrics(report):
+    metrics = report.metrics
+    section = {}
+    if metrics:
+        section["ratios"] = {
+            "sharpe_ratio": metrics["Sharpe_Ratio"],
+            "sortino_ratio": metrics["Sortino_Ratio"],
+            "information_ratio": metrics.get("Information_Ratio", None)
+        }
+        
+        section["measures"] = {
+            "volatility": metrics["Volatility"],
+            "value_at_risk": metrics["Value_at_Risk"],
+            "max_drawdown": metrics["Max_Drawdown"]
+        }
+    
+    with span("rolling_metrics"):
+        # Rolling volatility data
+        try:
+            section["rolling_volatility"] = series_payload(
+                report.chart_dates, {"volatility": report.thin(report.state.rolling.volatility(30))},
+                report.columnar)  # Annualized
+        except Exception:
+            section["rolling_volatility"] = []
+    return {"risk_metrics": section}
+
+# Drawdown Analysis
+def render_drawdowns(report):
+    portfolio_drawdown = report.state.portfolio_drawdown
+    metrics = report.metrics
+    section = {}
+    with span("drawdowns"):
+        # Drawdown data
+        try:
+            section["drawdown_series"] = series_payload(
+                report.chart_dates, {"drawdown": report.thin(portfolio_drawdown)}, report.columnar, skip_missing=True)
+        except Exception as e:
+            section["drawdown_series"] = []
+            print(f"Error creating drawdown series: {str(e)}")
+        
+        # Drawdown table
+        try:
+            episodes = drawdown_episodes(portfolio_drawdown.to_numpy(), portfolio_drawdown.index)
+            if len(episodes["drawdown"]):
+                worst = worst_episodes(episodes, top_k=10)
+                section["worst_drawdowns"] = episode_records(episodes, worst, report.dates)  # Top 10
+                section["max_drawdown"] = metrics["Max_Drawdown"]
+                
+                # Calculate average drawdown length
+                section["avg_drawdown_length"] = int(episodes["days"].mean())
+                
+                # Drawdown distribution data (simplified)
+                dd_values = np.sort(episodes["drawdown"], kind="stable").tolist()
+                section["drawdown_distribution"] = dd_values
+        except Exception as e:
+            section["worst_drawdowns"] = []
+            section["max_drawdown"] = metrics["Max_Drawdown"] if metrics else None
+            section["drawdown_distribution"] = []
+            print(f"Error processing drawdown details: {str(e)}")
+    return {"drawdown_analysis": section}
+
+# Advanced Analytics
+def render_benchmark_analytics(report):
+    state, thin, chart_dates, columnar = report.state, report.thin, report.chart_dates, report.columnar
+    benchmark_returns = state.benchmark_returns
+    section = {}
+    with span("benchmark_analytics"):
+        if benchmark_returns is not None and not benchmark_returns.empty:
+            # Rolling Beta
+            try:
+                section["rolling_beta"] = series_payload(
+                    chart_dates, {"beta_30d": thin(state.rolling.beta(30)), "beta_90d": thin(state.rolling.beta(90))}, columnar)
+            except Exception:
+                section["rolling_beta"] = []
             
-        if abs(sum(weights) - 1.0) > 0.0001:
-            raise HTTPException(status_code=400, detail="Weights must sum to 1.0")
+            # Rolling Correlation
+            try:
+                section["rolling_correlation"] = series_payload(
+                    chart_dates, {"correlation": thin(state.rolling.correlation(30))}, columnar)
+            except Exception:
+                section["rolling_correlation"] = []
             
-        benchmark = request.benchmark
+            # Overall correlation
+            try:
+                corr = state.portfolio_returns.corr(benchmark_returns)
+                section["overall_correlation"] = float(corr)
+            except Exception:
+                section["overall_correlation"] = None
+    return {"advanced_analytics": section}
+
+# Correlation matrix for all assets
+def render_correlation_matrix(report):
+    request = report.request
+    section = {}
+    try:
+        with span("correlation_matrix"):
+            matrix_data, top_pairs_data = get_correlation_matrix(
+                report.returns, report.stocks, compact=request.correlation_format == "compact",
+                order=request.correlation_order, top_k=request.correlation_top_k)
+        section["correlation_matrix"] = matrix_data
+        if top_pairs_data is not None:
+            section["correlation_top_pairs"] = top_pairs_data
+    except Exception:
+        section["correlation_matrix"] = {}
+    return {"advanced_analytics": section}
+
+SECTION_RENDERERS = {
+    "live_market_data": render_live_market_data,
+    "cumulative_returns": render_cumulative_returns,
+    "key_metrics": render_key_metrics,
+    "rebalancing": render_rebalancing,
+    "monthly_returns": render_monthly_returns,
+    "returns_distribution": render_returns_distribution,
+    "rolling_metrics": render_rolling_metrics,
+    "risk_metrics": render_risk_metrics,
+    "drawdowns": render_drawdowns,
+    "benchmark_analytics": render_benchmark_analytics,
+    "correlation_matrix": render_correlation_matrix
+}
+
+# Blocking generator of (section, fragment) pairs in the requested order. Live
+# market data is fetched in the background and goes out as soon as it has arrived,
+# ahead of whichever section is next; in columnar mode the shared chart dates go
+# out just before the first chart
+def report_sections(report):
+    report.start()
+    live_pending = report.live_quotes is not None
+    dates_sent = False
+    for name in report.sections:
+        if live_pending and report.live_quotes.done():
+            yield "live_market_data", render_live_market_data(report)
+            live_pending = False
+        if name == "live_market_data":
+            continue
+        
+        if report.columnar and name in CHART_SECTIONS and not dates_sent:
+            yield "dates", {"dates": report.chart_dates.tolist()}
+            dates_sent = True
+        yield name, SECTION_RENDERERS[name](report)
+    
+    if live_pending:
+        yield "live_market_data", render_live_market_data(report)
+
+# Merge a section's fragment into the response, one level below the top-level groups
+def merge_fragment(response, fragment):
+    for key, value in fragment.items():
+        if isinstance(value, dict) and isinstance(response.get(key), dict):
+            response[key].update(value)
+        else:
+            response[key] = value
+
+# Blocking portfolio analysis, executed on the scheduler's worker pool
+def run_portfolio_analysis(request: PortfolioRequest):
+    try:
+        report = ReportContext(request)
         
         # Initialize response dictionary
         response = {
-            "portfolio_settings": {
-                "stocks": [{"ticker": stock, "weight": weight} for stock, weight in zip(stocks, weights)],
-                "date_range": {
-                    "start": start_date.strftime('%Y-%m-%d'),
-                    "end": end_date.strftime('%Y-%m-%d')
-                },
-                "benchmark": benchmark
-            },
+            "portfolio_settings": report.settings(),
             "live_market_data": {},
             "portfolio_overview": {},
             "returns_analysis": {},
@@ -227,281 +791,302 @@ async def analyze_portfolio(request: PortfolioRequest):
             "advanced_analytics": {}
         }
         
-        # Get live market data
-        for stock in stocks:
-            live_data = get_live_price(stock)
-            if live_data:
-                response["live_market_data"][stock] = live_data
+        for _, fragment in report_sections(report):
+            merge_fragment(response, fragment)
+        
+        return response
+        
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}")
+
+# Analysis plus JSON encoding, so serialization also happens on the worker pool
+def encoded_portfolio_analysis(request: PortfolioRequest):
+    response = run_portfolio_analysis(request)
+    with span("serialization"):
+        return encode_json(response)
+
+# Run fn on the worker pool with per-stage timing, recording stage metrics and
+# sampled profiles; returns fn's result and the Server-Timing header value
+async def run_instrumented(endpoint, fn, request):
+    started = time.perf_counter()
+    profile = profile_sampler.should_sample()
+    result, stages, total, report = await scheduler.run(timed_call, profile, fn, request)
+    
+    # Time spent waiting for a worker slot, outside the worker's own timer
+    stages["queue"] = max(time.perf_counter() - started - total, 0.0)
+    metrics_registry.observe_stages(endpoint, stages)
+    if report is not None:
+        profile_sampler.record(endpoint, total, report)
+    return result, server_timing(stages, total)
+
+# Identical requests that arrive while one is being computed wait for that one
+analysis_flights = AsyncSingleFlight()
+
+def request_key(endpoint, request):
+    return endpoint, encode_json(request.model_dump())
+
+# Run fn through the coalescing layer and record every caller's status and latency,
+# labelled coalesced when it joined an identical request already in flight
+async def run_coalesced(endpoint, fn, request):
+    key = request_key(endpoint, request)
+    coalesced = key in analysis_flights
+    started = time.perf_counter()
+    status = 500
+    try:
+        result = await analysis_flights.do(key, run_instrumented, endpoint, fn, request)
+        status = 200
+        return result
+    except HTTPException as e:
+        status = e.status_code
+        raise
+    except asyncio.CancelledError:
+        # The client went away; the shared computation carries on for the others
+        status = 499
+        raise
+    finally:
+        metrics_registry.observe_request(endpoint, status, time.perf_counter() - started, coalesced)
+
+# Endpoint for portfolio analysis
+@app.post("/analyze_portfolio", response_model=Dict[str, Any])
+async def analyze_portfolio(request: PortfolioRequest):
+    # Keep the event loop free while the analysis runs on the worker pool
+    content, timing = await run_coalesced("analyze_portfolio", encoded_portfolio_analysis, request)
+    return Response(content=content, media_type="application/json", headers={"Server-Timing": timing})
+
+# Report streamed section by section, each line or event carrying a fragment that
+# merges into the same JSON /analyze_portfolio returns: NDJSON by default, or
+# server-sent events with format=sse
+@app.post("/analyze_portfolio/stream")
+async def analyze_portfolio_stream(request: PortfolioRequest, format: str = "ndjson"):
+    if format not in ("ndjson", "sse"):
+        raise HTTPException(status_code=400, detail="format must be 'ndjson' or 'sse'")
+    # Invalid requests get a normal HTTP error before the stream starts
+    report = ReportContext(request)
+    
+    def encode(section, data):
+        message = encode_json({"section": section, "data": data})
+        if format == "sse":
+            return b"event: " + section.encode() + b"\ndata: " + message + b"\n\n"
+        return message + b"\n"
+    
+    async def messages():
+        started = time.perf_counter()
+        status = 200
+        try:
+            # Settings need no data, so the first line goes out immediately
+            yield encode("portfolio_settings", {"portfolio_settings": report.settings()})
+            async for section, fragment in scheduler.stream(report_sections, report):
+                yield encode(section, fragment)
+            yield encode("complete", {})
+        except HTTPException as e:
+            status = e.status_code
+            yield encode("error", {"status_code": e.status_code, "detail": e.detail})
+        except Exception as e:
+            status = 500
+            yield encode("error", {"status_code": 500, "detail": f"An unexpected error occurred: {str(e)}"})
+        finally:
+            metrics_registry.observe_request("analyze_portfolio_stream", status, time.perf_counter() - started)
+    
+    media_type = "text/event-stream" if format == "sse" else "application/x-ndjson"
+    return StreamingResponse(messages(), media_type=media_type, headers={"Cache-Control": "no-cache"})
+
+# Name a batch portfolio is reported under
+def portfolio_name(portfolio, i):
+    return portfolio.name if portfolio.name is not None else f"portfolio_{i + 1}"
+
+# Blocking batch analysis: one download for all portfolios and one matrix product per set of held tickers
+def run_batch_analysis(request: BatchPortfolioRequest):
+    try:
+        start_date, end_date = parse_date_range(request.start_date, request.end_date)
+        
+        if not request.portfolios:
+            raise HTTPException(status_code=400, detail="Please provide at least one portfolio")
+        for portfolio in request.portfolios:
+            validate_weights(portfolio.stocks, portfolio.weights)
+        
+        benchmark = request.benchmark
+        tickers = list(dict.fromkeys(stock for portfolio in request.portfolios for stock in portfolio.stocks))
+        
+        # Fetch the union of tickers and the benchmark together
+        with span("download"):
+            closes = get_price_provider().get_closes(tickers + [benchmark], start_date, end_date)
+        if closes[tickers].dropna(how='all').empty:
+            raise HTTPException(status_code=404, detail="No data available for the selected stocks")
+        
+        # Each portfolio is evaluated over the dates on which every ticker it holds has a
+        # return, as /analyze_portfolio does; portfolios holding the same tickers share
+        # one returns frame and one matrix product
+        groups = defaultdict(list)
+        for i, portfolio in enumerate(request.portfolios):
+            groups[tuple(sorted(set(portfolio.stocks)))].append(i)
         
-        # Get historical data
-        result = get_portfolio_data(stocks, weights, start_date, end_date)
+        benchmark_series = None
+        if benchmark in closes.columns:
+            benchmark_series = closes[benchmark].dropna().pct_change().dropna()
         
-        if result is not None:
-            closes, returns, portfolio_returns, stock_cum_returns = result
+        results = [None] * len(request.portfolios)
+        benchmark_used = False
+        for held, members in groups.items():
+            held = list(held)
+            returns = closes[held].dropna(how='all').pct_change().dropna()
+            weights = weight_matrix(held, [(request.portfolios[i].stocks, request.portfolios[i].weights) for i in members])
+            portfolio_returns = portfolio_returns_matrix(returns, weights)
             
-            # Get benchmark data
-            try:
-                benchmark_data = yf.download(benchmark, start=start_date, end=end_date, progress=False)
-                benchmark_returns = None
-                
-                if not benchmark_data.empty:
-                    # Handle MultiIndex columns from yfinance
-                    if isinstance(benchmark_data.columns, pd.MultiIndex):
-                        # Get the 'Close' price for the benchmark
-                        benchmark_prices = benchmark_data[('Close', benchmark)]
-                    else:
-                        # Single-level columns
-                        if 'Close' in benchmark_data.columns:
-                            benchmark_prices = benchmark_data['Close']
-                    
-                    # Calculate returns if we have prices
-                    if 'benchmark_prices' in locals():
-                        benchmark_returns = benchmark_prices.pct_change().dropna()
-                        
-                        # Ensure benchmark returns align with portfolio returns
-                        common_index = portfolio_returns.index.intersection(benchmark_returns.index)
-                        
-                        if len(common_index) > 0:
-                            # Sort the common index to ensure proper alignment
-                            common_index = sorted(common_index)
-                            portfolio_returns_aligned = portfolio_returns[common_index]
-                            benchmark_returns_aligned = benchmark_returns[common_index]
-                            
-                            benchmark_returns = benchmark_returns_aligned
-                
-            except Exception:
-                benchmark_returns = None
+            if len(portfolio_returns) < 2:
+                names = ", ".join(portfolio_name(request.portfolios[i], i) for i in members)
+                raise HTTPException(status_code=404, detail=f"Not enough overlapping data to analyze {names}")
             
-            # Portfolio Overview
-            # Calculate portfolio cumulative return
-            try:
-                portfolio_cum_return = (1 + portfolio_returns).cumprod()
-                
-                # Prepare data for cumulative returns chart
-                cum_returns_data = {
-                    "dates": [date.strftime('%Y-%m-%d') if hasattr(date, 'strftime') else str(date) for date in portfolio_cum_return.index],
-                    "portfolio": [float(val) if not pd.isna(val) else None for val in portfolio_cum_return.tolist()],
-                    "stocks": {}
-                }
-                
-                for stock in stocks:
-                    stock_values = [float(val) if not pd.isna(val) else None for val in stock_cum_returns[stock].tolist()]
-                    cum_returns_data["stocks"][stock] = stock_values
-                
-                # Add benchmark if available
-                if benchmark_returns is not None:
-                    benchmark_cum_return = (1 + benchmark_returns).cumprod()
-                    benchmark_values = [float(val) if not pd.isna(val) else None for val in benchmark_cum_return.tolist()]
-                    cum_returns_data["benchmark"] = {
-                        "ticker": benchmark,
-                        "values": benchmark_values
-                    }
-                
-                response["portfolio_overview"]["cumulative_returns"] = cum_returns_data
-            except Exception as e:
-                response["portfolio_overview"]["cumulative_returns"] = {"dates": [], "portfolio": [], "stocks": {}}
-                print(f"Error creating cumulative returns data: {str(e)}")
+            # Metrics align with the benchmark the same way calculate_risk_metrics does
+            aligned_returns, benchmark_returns = portfolio_returns, None
+            if benchmark_series is not None:
+                common_index = portfolio_returns.index.intersection(benchmark_series.index)
+                if len(common_index) > 0:
+                    aligned_returns = portfolio_returns.loc[common_index]
+                    benchmark_returns = benchmark_series.loc[common_index]
+                    benchmark_used = True
             
-            # Calculate key metrics
-            metrics = calculate_risk_metrics(portfolio_returns, benchmark_returns)
-            if metrics:
-                response["portfolio_overview"]["key_metrics"] = metrics
+            with span("risk_metrics"):
+                metrics = risk_metrics(aligned_returns.to_numpy(), benchmark_returns)
             
-            # Returns Analysis
-            # Monthly returns heatmap data
-            try:
-                monthly_returns = portfolio_returns.resample('M').apply(lambda x: (1 + x).prod() - 1)
-                heatmap_data = []
-                
-                for i, (date, value) in enumerate(monthly_returns.items()):
-                    if not pd.isna(value):
-                        year = date.year
-                        month = date.month
-                        heatmap_data.append({
-                            "year": year,
-                            "month": month,
-                            "return": float(value)
-                        })
-                
-                response["returns_analysis"]["monthly_returns_heatmap"] = heatmap_data
-            except Exception as e:
-                response["returns_analysis"]["monthly_returns_heatmap"] = []
-                print(f"Error creating monthly returns heatmap: {str(e)}")
+            # Drawdown episodes over all of the portfolio's days, for every portfolio of the
+            # group at once, keeping the worst 5 of each
+            with span("drawdowns"):
+                drawdowns = drawdown_series(portfolio_returns.to_numpy())
+                episodes = drawdown_episodes(drawdowns, portfolio_returns.index)
+                worst = worst_episodes(episodes, top_k=5)
+            worst_by_portfolio = np.split(worst, np.searchsorted(episodes["series"][worst], np.arange(1, len(members))))
+            labels = portfolio_returns.index.strftime('%Y-%m-%d').to_numpy()
             
-            # Returns distribution data
-            try:
-                returns_distribution = []
-                for date, value in portfolio_returns.items():
-                    if not pd.isna(value):
-                        returns_distribution.append({
-                            "date": date.strftime('%Y-%m-%d') if hasattr(date, 'strftime') else str(date),
-                            "return": float(value)
-                        })
+            for column, i in enumerate(members):
+                portfolio = request.portfolios[i]
+                key_metrics = {}
+                for name, values in metrics.items():
+                    value = float(values[column])
+                    key_metrics[name] = value if np.isfinite(value) else None
                 
-                response["returns_analysis"]["returns_distribution"] = returns_distribution
-            except Exception as e:
-                response["returns_analysis"]["returns_distribution"] = []
-                print(f"Error creating returns distribution: {str(e)}")
-            
-            # Rolling metrics
-            try:
-                rolling_sharpe = qs.stats.rolling_sharpe(portfolio_returns)
-                sharpe_data = []
-                for date, value in rolling_sharpe.items():
-                    sharpe_data.append({
-                        "date": date.strftime('%Y-%m-%d'),
-                        "sharpe": float(value) if not np.isnan(value) else None
-                    })
-                response["returns_analysis"]["rolling_sharpe"] = sharpe_data
-            except Exception:
-                response["returns_analysis"]["rolling_sharpe"] = []
-            
-            try:
-                rolling_sortino = qs.stats.rolling_sortino(portfolio_returns)
-                sortino_data = []
-                for date, value in rolling_sortino.items():
-                    sortino_data.append({
-                        "date": date.strftime('%Y-%m-%d'),
-                        "sortino": float(value) if not np.isnan(value) else None
-                    })
-                response["returns_analysis"]["rolling_sortino"] = sortino_data
-            except Exception:
-                response["returns_analysis"]["rolling_sortino"] = []
-            
-            # Risk Metrics
-            if metrics:
-                response["risk_metrics"]["ratios"] = {
-                    "sharpe_ratio": metrics["Sharpe_Ratio"],
-                    "sortino_ratio": metrics["Sortino_Ratio"],
-                    "information_ratio": metrics.get("Information_Ratio", None)
+                results[i] = {
+                    "name": portfolio_name(portfolio, i),
+                    "stocks": [{"ticker": stock, "weight": weight} for stock, weight in zip(portfolio.stocks, portfolio.weights)],
+                    "observations": len(portfolio_returns),
+                    "key_metrics": key_metrics,
+                    "worst_drawdowns": episode_records(episodes, worst_by_portfolio[column], labels)
                 }
-                
-                response["risk_metrics"]["measures"] = {
-                    "volatility": metrics["Volatility"],
-                    "value_at_risk": metrics["Value_at_Risk"],
-                    "max_drawdown": metrics["Max_Drawdown"]
+        
+        return {
+            "date_range": {
+                "start": start_date.strftime('%Y-%m-%d'),
+                "end": end_date.strftime('%Y-%m-%d')
+            },
+            "benchmark": benchmark if benchmark_used else None,
+            "tickers": tickers,
+            "observations": max(result["observations"] for result in results),
+            "portfolios": results
+        }
+        
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}")
+
+# Endpoint for analyzing many portfolios over the same dates in one request
+@app.post("/analyze_portfolios", response_model=Dict[str, Any])
+async def analyze_portfolios(request: BatchPortfolioRequest, response: Response):
+    result, timing = await run_coalesced("analyze_portfolios", run_batch_analysis, request)
+    response.headers["Server-Timing"] = timing
+    return result
+
+# Summary of one optimized portfolio: its weights by ticker and its annualized statistics
+def allocation(stocks, weights, mean, cov, risk_free_rate):
+    expected, volatility, sharpe = optimization.portfolio_stats(weights, mean, cov, risk_free_rate)
+    return {
+        "weights": {stock: float(weight) for stock, weight in zip(stocks, weights)},
+        "expected_return": float(expected[0]),
+        "volatility": float(volatility[0]),
+        "sharpe_ratio": float(sharpe[0]) if np.isfinite(sharpe[0]) else None
+    }
+
+# Blocking optimization: mean-variance portfolios from the annualized moments of daily returns
+def run_optimization(request: OptimizeRequest):
+    try:
+        start_date, end_date = parse_date_range(request.start_date, request.end_date)
+        
+        stocks = list(dict.fromkeys(request.stocks))
+        if len(stocks) < 2:
+            raise HTTPException(status_code=400, detail="Please provide at least two distinct stock tickers")
+        if not 2 <= request.frontier_points <= 200:
+            raise HTTPException(status_code=400, detail="frontier_points must be between 2 and 200")
+        if not 0 <= request.samples <= optimization.MAX_SAMPLES:
+            raise HTTPException(status_code=400, detail=f"samples must be between 0 and {optimization.MAX_SAMPLES}")
+        if request.top_k < 0 or request.cloud_points < 0:
+            raise HTTPException(status_code=400, detail="top_k and cloud_points must not be negative")
+        
+        # Only the per-stock returns matrix is used, so no portfolio is backtested
+        with span("download"):
+            closes = get_price_provider().get_closes(stocks, start_date, end_date)
+        if closes.empty:
+            raise HTTPException(status_code=404, detail="No data available for the selected stocks")
+        with span("returns"):
+            returns = closes.pct_change().dropna()
+        if len(returns) <= len(stocks):
+            raise HTTPException(status_code=404, detail="Not enough overlapping data to estimate the covariance matrix")
+        
+        with span("moments"):
+            mean, cov = optimization.annualized_moments(returns[stocks].to_numpy())
+        if not np.all(np.isfinite(cov)) or np.linalg.matrix_rank(cov) < len(stocks):
+            raise HTTPException(status_code=400, detail="The covariance matrix is singular; remove duplicate or constant tickers")
+        
+        rf = request.risk_free_rate
+        long_only = request.long_only
+        with span("optimization"):
+            max_sharpe = optimization.max_sharpe_weights(mean, cov, rf, long_only=long_only)
+            min_volatility = optimization.min_volatility_weights(mean, cov, long_only=long_only)
+            risk_parity = optimization.risk_parity_weights(cov)
+            frontier = optimization.efficient_frontier(mean, cov, request.frontier_points, rf, long_only=long_only)
+        
+        frontier_returns, frontier_vols, frontier_sharpes = optimization.portfolio_stats(frontier, mean, cov, rf)
+        response = {
+            "date_range": {
+                "start": start_date.strftime('%Y-%m-%d'),
+                "end": end_date.strftime('%Y-%m-%d')
+            },
+            "observations": len(returns),
+            "assets": {
+                stock: {"expected_return": float(mean[i]), "volatility": float(np.sqrt(cov[i, i]))}
+                for i, stock in enumerate(stocks)
+            },
+            "max_sharpe": allocation(stocks, max_sharpe, mean, cov, rf),
+            "min_volatility": allocation(stocks, min_volatility, mean, cov, rf),
+            "risk_parity": allocation(stocks, risk_parity, mean, cov, rf),
+            "efficient_frontier": [
+                {
+                    "expected_return": float(frontier_returns[i]),
+                    "volatility": float(frontier_vols[i]),
+                    "sharpe_ratio": float(frontier_sharpes[i]) if np.isfinite(frontier_sharpes[i]) else None,
+                    "weights": {stock: float(weight) for stock, weight in zip(stocks, frontier[i])}
                 }
-            
-            # Rolling volatility data
-            try:
-                rolling_vol = portfolio_returns.rolling(window=30).std() * (252 ** 0.5)  # Annualized
-                vol_data = []
-                for date, value in rolling_vol.items():
-                    vol_data.append({
-                        "date": date.strftime('%Y-%m-%d'),
-                        "volatility": float(value) if not np.isnan(value) else None
-                    })
-                response["risk_metrics"]["rolling_volatility"] = vol_data
-            except Exception:
-                response["risk_metrics"]["rolling_volatility"] = []
-            
-            # Drawdown Analysis
-            # Drawdown data
-            try:
-                drawdown_series = qs.stats.to_drawdown_series(portfolio_returns)
-                drawdown_data = []
-                for date, value in drawdown_series.items():
-                    if not pd.isna(value):
-                        drawdown_data.append({
-                            "date": date.strftime('%Y-%m-%d') if hasattr(date, 'strftime') else str(date),
-                            "drawdown": float(value)
-                        })
-                
-                response["drawdown_analysis"]["drawdown_series"] = drawdown_data
-            except Exception as e:
-                response["drawdown_analysis"]["drawdown_series"] = []
-                print(f"Error creating drawdown series: {str(e)}")
-            
-            # Drawdown table
-            try:
-                drawdown_details = get_drawdown_details(portfolio_returns)
-                if drawdown_details:
-                    response["drawdown_analysis"]["worst_drawdowns"] = drawdown_details[:10]  # Top 10
-                    response["drawdown_analysis"]["max_drawdown"] = metrics["Max_Drawdown"]
-                    
-                    # Calculate average drawdown length
-                    if drawdown_details:
-                        avg_length = sum(item["underwater"] for item in drawdown_details) / len(drawdown_details)
-                        response["drawdown_analysis"]["avg_drawdown_length"] = int(avg_length)
-                    
-                    # Drawdown distribution data (simplified)
-                    dd_values = [item["drawdown"] for item in drawdown_details]
-                    response["drawdown_analysis"]["drawdown_distribution"] = dd_values
-            except Exception as e:
-                response["drawdown_analysis"]["worst_drawdowns"] = []
-                response["drawdown_analysis"]["max_drawdown"] = metrics["Max_Drawdown"] if metrics else None
-                response["drawdown_analysis"]["drawdown_distribution"] = []
-                print(f"Error processing drawdown details: {str(e)}")
-            
-            # Advanced Analytics
-            if benchmark_returns is not None and not benchmark_returns.empty:
-                # Rolling Beta
-                try:
-                    rolling_beta = pd.DataFrame()
-                    rolling_beta['30d'] = qs.stats.rolling_greeks(portfolio_returns, benchmark_returns, window=30)['beta']
-                    rolling_beta['90d'] = qs.stats.rolling_greeks(portfolio_returns, benchmark_returns, window=90)['beta']
-                    
-                    beta_data = []
-                    for date, row in rolling_beta.iterrows():
-                        beta_data.append({
-                            "date": date.strftime('%Y-%m-%d'),
-                            "beta_30d": float(row['30d']) if not np.isnan(row['30d']) else None,
-                            "beta_90d": float(row['90d']) if not np.isnan(row['90d']) else None
-                        })
-                    response["advanced_analytics"]["rolling_beta"] = beta_data
-                except Exception:
-                    response["advanced_analytics"]["rolling_beta"] = []
-                
-                # Rolling Correlation
-                try:
-                    rolling_corr = portfolio_returns.rolling(window=30).corr(benchmark_returns)
-                    corr_data = []
-                    for date, value in rolling_corr.items():
-                        corr_data.append({
-                            "date": date.strftime('%Y-%m-%d'),
-                            "correlation": float(value) if not np.isnan(value) else None
-                        })
-                    response["advanced_analytics"]["rolling_correlation"] = corr_data
-                except Exception:
-                    response["advanced_analytics"]["rolling_correlation"] = []
-                
-                # Overall correlation
-                try:
-                    corr = portfolio_returns.corr(benchmark_returns)
-                    response["advanced_analytics"]["overall_correlation"] = float(corr)
-                except Exception:
-                    response["advanced_analytics"]["overall_correlation"] = None
-            
-            # Correlation matrix for all assets
-            try:
-                corr_matrix = returns.corr()
-                matrix_data = {}
-                
-                for stock1 in stocks:
-                    matrix_data[stock1] = {}
-                    for stock2 in stocks:
-                        matrix_data[stock1][stock2] = float(corr_matrix.loc[stock1, stock2])
-                
-                response["advanced_analytics"]["correlation_matrix"] = matrix_data
-            except Exception:
-                response["advanced_analytics"]["correlation_matrix"] = {}
-        
-        # Ensure all numerical values are JSON serializable
-        def convert_to_serializable(obj):
-            if isinstance(obj, (np.integer, np.floating)):
-                return float(obj)
-            elif isinstance(obj, np.ndarray):
-                return obj.tolist()
-            elif isinstance(obj, (datetime, pd.Timestamp)):
-                return obj.strftime('%Y-%m-%d')
-            elif isinstance(obj, dict):
-                return {k: convert_to_serializable(v) for k, v in obj.items()}
-            elif isinstance(obj, list):
-                return [convert_to_serializable(i) for i in obj]
-            else:
-                return obj
+                for i in range(len(frontier))
+            ]
+        }
+        
+        # Monte-Carlo sweep: every candidate scored by one matrix product per block
+        if request.samples > 0:
+            with span("monte_carlo"):
+                best, expected, volatility, sharpe = optimization.monte_carlo_sweep(
+                    mean, cov, request.samples, long_only=long_only, seed=request.seed,
+                    risk_free_rate=rf, top_k=request.top_k)
+            keep = np.unique(np.linspace(0, request.samples - 1, min(request.cloud_points, request.samples)).astype(int))
+            response["monte_carlo"] = {
+                "samples": request.samples,
+                "best": [allocation(stocks, weights, mean, cov, rf) for weights in best],
+                "cloud": {
+                    "volatility": float_list(volatility[keep]),
+                    "expected_return": float_list(expected[keep]),
+                    "sharpe_ratio": float_list(sharpe[keep])
+                }
+            }
         
-        response = convert_to_serializable(response)
         return response
         
     except HTTPException as e:
@@ -509,6 +1094,132 @@ async def analyze_portfolio(request: PortfolioRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}")
 
+# Endpoint for efficient-frontier, max-Sharpe, min-volatility and risk-parity weights
+@app.post("/optimize_portfolio", response_model=Dict[str, Any])
+async def optimize_portfolio(request: OptimizeRequest, response: Response):
+    result, timing = await run_coalesced("optimize_portfolio", run_optimization, request)
+    response.headers["Server-Timing"] = timing
+    return result
+
+# Build the intraday state of a streamed portfolio from its (cached) daily analysis state
+def build_live_portfolio(request: StreamRequest):
+    try:
+        end = request.end_date or datetime.now().strftime('%Y-%m-%d')
+        start_date, end_date = parse_date_range(request.start_date, end)
+        validate_weights(request.stocks, request.weights)
+        
+        state = get_analysis_state(request.stocks, request.weights, start_date, end_date, request.benchmark)
+        if state is None or state.portfolio_returns.empty:
+            raise HTTPException(status_code=404, detail="No data available for the selected stocks")
+        return LivePortfolio.from_state(state, request.initial_value)
+        
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}")
+
+# Number of WebSocket and SSE streams currently open
+active_streams = 0
+
+# Messages of one portfolio stream: a full snapshot, then one delta per quote that
+# moved the portfolio, then 'end' if the quote source runs out
+async def live_updates(live):
+    global active_streams
+    active_streams += 1
+    try:
+        yield {"type": "snapshot", "stocks": live.stocks, "benchmark": live.benchmark, **live.snapshot()}
+        seq = 0
+        async for tick in get_quote_source().ticks(live.tickers):
+            changes = live.update(tick.ticker, tick.price)
+            if changes:
+                seq += 1
+                yield {"type": "update", "seq": seq, "time": tick.time, "ticker": tick.ticker,
+                       "price": tick.price, "changes": changes}
+        yield {"type": "end"}
+    finally:
+        active_streams -= 1
+
+# WebSocket stream: the client sends one StreamRequest as JSON, then receives messages
+@app.websocket("/ws/portfolio")
+async def stream_portfolio_ws(websocket: WebSocket):
+    await websocket.accept()
+    try:
+        request = StreamRequest.model_validate(await websocket.receive_json())
+        live = await scheduler.run(build_live_portfolio, request)
+    except ValidationError as e:
+        await websocket.send_json({"type": "error", "detail": e.errors(include_url=False)})
+        await websocket.close(code=1008)
+        return
+    except HTTPException as e:
+        await websocket.send_json({"type": "error", "status_code": e.status_code, "detail": e.detail})
+        await websocket.close(code=1008 if e.status_code < 500 else 1011)
+        return
+    except WebSocketDisconnect:
+        return
+    
+    try:
+        async for message in live_updates(live):
+            await websocket.send_text(encode_json(message).decode())
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
+
+# Server-sent events stream of the same messages, for clients without WebSockets
+@app.post("/stream_portfolio")
+async def stream_portfolio(request: StreamRequest):
+    # Errors surface as a normal HTTP status before the stream starts
+    live = await scheduler.run(build_live_portfolio, request)
+    
+    async def events():
+        async for message in live_updates(live):
+            yield b"event: " + message["type"].encode() + b"\ndata: " + encode_json(message) + b"\n\n"
+    
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+# Counters and gauges owned by the caches, the provider and the scheduler
+def service_metrics():
+    # Follow the provider's wrappers (store, coalescing) down to the upstream source
+    layers = [get_price_provider()]
+    while getattr(layers[-1], "upstream", None) is not None:
+        layers.append(layers[-1].upstream)
+    upstream = layers[-1]
+    return [
+        ("portfolio_in_flight_requests", "gauge", "Analyses running on the worker pool", scheduler.in_flight),
+        ("portfolio_queued_requests", "gauge", "Analyses waiting for a worker slot", scheduler.queued),
+        ("quote_cache_requests_total", "counter", "Live quote lookups by cache outcome",
+         {'result="hit"': quote_service.hits, 'result="miss"': quote_service.misses}),
+        ("result_cache_requests_total", "counter", "Analysis state lookups by cache outcome",
+         {'result="hit"': result_cache.hits, 'result="extension"': result_cache.extensions,
+          'result="miss"': result_cache.misses}),
+        ("result_cache_entries", "gauge", "Analysis states held in the result cache", len(result_cache)),
+        ("result_cache_bytes", "gauge", "Approximate memory held by the result cache", result_cache.nbytes),
+        ("upstream_price_fetches_total", "counter", "Price downloads sent to the upstream provider",
+         getattr(upstream, "fetch_count", 0)),
+        ("coalesced_requests_total", "counter", "Calls that waited for an identical call already in flight",
+         {'layer="analysis"': analysis_flights.coalesced,
+          'layer="download"': sum(getattr(layer, "coalesced", 0) for layer in layers),
+          'layer="quote"': quote_service.coalesced}),
+        ("portfolio_active_streams", "gauge", "Open WebSocket and SSE portfolio streams", active_streams),
+        ("portfolio_startup_seconds", "gauge", "Time spent importing the app and warming its kernels",
+         {f'phase="{name[:-len("_seconds")]}"': value or 0 for name, value in startup.timings.items()}),
+        ("portfolio_startup_budget_seconds", "gauge", "Configured startup-time budget", startup.STARTUP_BUDGET_SECONDS)
+    ]
+
+metrics_registry.add_collector(service_metrics)
+
+# Prometheus scrape endpoint
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    return PlainTextResponse(metrics_registry.render(), media_type="text/plain; version=0.0.4")
+
+# Most recent cProfile reports of sampled slow requests (PROFILE_SAMPLE_RATE > 0)
+@app.get("/debug/profiles")
+async def debug_profiles():
+    return {"sample_rate": profile_sampler.sample_rate, "slow_seconds": profile_sampler.slow_seconds,
+            "profiles": profile_sampler.recent()}
+
+startup.timings["import_seconds"] = time.perf_counter() - _import_started
+
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    # WEB_WORKERS > 1 warms up once, then forks workers that share the socket
+    startup.serve(app, host="0.0.0.0", port=8000, workers=int(os.environ.get("WEB_WORKERS", "1")))
\ No newline at end of file
@@ -0,0 +1,201 @@
+import numpy as np
+import pandas as pd
+
+# Calendar schedules; 'none' never rebalances on a schedule (buy-and-hold, or drift-only with a threshold)
+REBALANCE_SCHEDULES = ("none", "daily", "weekly", "monthly", "quarterly", "annual")
+
+# First window scanned for a drift-threshold breach; it doubles until one is found
+_DRIFT_WINDOW = 64
+
+
+def _period_keys(dates, schedule):
+    # One integer per calendar period, so a new period starts wherever the key changes
+    days = np.asarray(dates, dtype="datetime64[D]").astype(np.int64)
+    if schedule == "daily":
+        return days
+    if schedule == "weekly":
+        return (days + 3) // 7  # weeks starting on Monday; 1970-01-01 was a Thursday
+    months = np.asarray(dates, dtype="datetime64[M]").astype(np.int64)
+    if schedule == "monthly":
+        return months
+    if schedule == "quarterly":
+        return months // 3
+    if schedule == "annual":
+        return months // 12
+    raise ValueError(f"Unknown rebalance schedule '{schedule}'")
+
+
+def schedule_mask(index, schedule, drift_threshold=None, previous_date=None):
+    """
+    Days on which a rebalance may happen: the first trading day of each period of
+    the schedule. Trades happen at the previous close, so that day's return already
+    uses the new weights. The first day opens a period unless previous_date (the
+    last day before index) falls in the same one. With schedule 'none' a drift
+    threshold may trigger on any day, and without one nothing is ever rebalanced.
+    """
+    if schedule == "none":
+        return np.full(len(index), drift_threshold is not None)
+    keys = _period_keys(index, schedule)
+    if previous_date is not None:
+        previous = _period_keys(pd.DatetimeIndex([previous_date]), schedule)[0]
+    else:
+        previous = keys[0] - 1 if len(keys) else 0
+    return np.diff(keys, prepend=previous) != 0
+
+
+class BacktestResult:
+    """
+    Daily returns of a portfolio traded under a rebalancing rule, net of costs,
+    with the dates, turnover (sum of absolute weight changes) and cost of each
+    rebalance and the drifted weights after the last close.
+    """
+
+    def __init__(self, portfolio_returns, weights, settings, rebalance_dates, turnover, costs, final_weights):
+        self.portfolio_returns = portfolio_returns
+        self.weights = weights
+        self.settings = settings
+        self.rebalance_dates = rebalance_dates
+        self.turnover = turnover
+        self.costs = costs
+        self.final_weights = final_weights
+
+    @property
+    def cost_drag(self):
+        """Fraction of the portfolio's value paid in transaction costs."""
+        return float(1 - np.prod(1 - self.costs))
+
+    def extend(self, new_returns):
+        """
+        Continues the backtest over the days in new_returns, from the drifted
+        weights and schedule position this one ended with, and returns the
+        combined result.
+        """
+        if new_returns.empty:
+            return self
+        later = backtest(new_returns, self.weights, initial_weights=self.final_weights,
+                         previous_date=self.portfolio_returns.index[-1], **self.settings)
+        return BacktestResult(pd.concat([self.portfolio_returns, later.portfolio_returns]), self.weights,
+                              self.settings, self.rebalance_dates.append(later.rebalance_dates),
+                              np.concatenate([self.turnover, later.turnover]),
+                              np.concatenate([self.costs, later.costs]), later.final_weights)
+
+
+def _drift_segments(growth, start_weights, weights, candidates, drift_threshold):
+    """
+    Splits the days into holding periods ending where some weight drifts more than
+    drift_threshold from its target, on a day the schedule allows. Each period is
+    scanned with a cumulative product over a window that doubles until the breach
+    is found, so the work stays proportional to the days held, not per-day Python.
+    Returns the segment start positions and the growth of every holding since its
+    segment started.
+    """
+    n_days = len(growth)
+    segment_growth = np.empty_like(growth)
+    starts = []
+    start = 0
+    held = start_weights
+    while start < n_days:
+        starts.append(start)
+        window = _DRIFT_WINDOW
+        while True:
+            end = min(start + window, n_days)
+            cumulative = np.cumprod(growth[start:end], axis=0)
+            drifted = held * cumulative / (cumulative @ held)[:, None]
+            breached = np.abs(drifted - weights).max(axis=1) > drift_threshold
+            # A breach at the close of day t rebalances before day t + 1, if the schedule allows that day
+            allowed = candidates[start + 1:end + 1]
+            hits = np.flatnonzero(breached[:len(allowed)] & allowed)
+            if len(hits) or end == n_days:
+                break
+            window *= 2
+        stop = start + hits[0] + 1 if len(hits) else n_days
+        segment_growth[start:stop] = cumulative[:stop - start]
+        start = stop
+        held = weights
+    return np.asarray(starts), segment_growth
+
+
+def backtest(returns, weights, schedule="daily", drift_threshold=None, cost_bps=0.0,
+             initial_weights=None, previous_date=None):
+    """
+    Backtests fixed target weights over a (dates x stocks) DataFrame of daily
+    returns without NaNs (every return above -100%).
+
+    The portfolio is rebalanced to the target weights on the schedule's days
+    (see schedule_mask), and only where some weight has drifted more than
+    drift_threshold from its target when one is given. Each rebalance pays
+    cost_bps basis points of the value traded. Positions start in cash, which
+    counts as buying the targets on the first day, or from initial_weights.
+
+    Between rebalances the holdings simply compound, so each holding period is one
+    cumulative product: on a fixed schedule the growth since the period's start is
+    a ratio of one cumulative product over all days, with no loop at all, and
+    drift-triggered periods are found with a few vectorized scans each.
+    """
+    weights = np.asarray(weights, dtype=float)
+    values = returns.to_numpy(dtype=float)
+    n_days, n_stocks = values.shape
+    index = returns.index
+    cost_rate = cost_bps / 10_000
+    settings = {"schedule": schedule, "drift_threshold": drift_threshold, "cost_bps": cost_bps}
+
+    if n_days == 0:
+        final = weights if initial_weights is None else np.asarray(initial_weights, dtype=float)
+        return BacktestResult(pd.Series([], index=index, dtype=float), weights, settings,
+                              index[:0], np.empty(0), np.empty(0), final)
+
+    candidates = schedule_mask(index, schedule, drift_threshold, previous_date)
+    held = np.zeros(n_stocks) if initial_weights is None else np.asarray(initial_weights, dtype=float)
+    rebalance_first = initial_weights is None or (
+        candidates[0] and (drift_threshold is None or np.abs(held - weights).max() > drift_threshold))
+    first_weights = weights if rebalance_first else held
+
+    growth = 1 + values
+    if drift_threshold is None:
+        opens = candidates.copy()
+        opens[0] = True
+        starts = np.flatnonzero(opens)
+        segment = np.cumsum(opens) - 1
+        if len(starts) == n_days:
+            # Rebalanced every day: each segment's growth is just that day's
+            segment_growth = growth
+        else:
+            # Growth since the segment's start: cumulative product up to today over the one before it started
+            cumulative = np.cumprod(growth, axis=0)
+            before = np.ones((len(starts), n_stocks))
+            before[1:] = cumulative[starts[1:] - 1]
+            segment_growth = cumulative / before[segment]
+    else:
+        starts, segment_growth = _drift_segments(growth, first_weights, weights, candidates, drift_threshold)
+        segment = np.repeat(np.arange(len(starts)), np.diff(np.append(starts, n_days)))
+
+    # Weights each segment starts with (the targets, except a first segment that was not
+    # rebalanced), and its value relative to that start
+    start_weights = np.tile(weights, (len(starts), 1))
+    start_weights[0] = first_weights
+    relative = segment_growth @ weights
+    if not rebalance_first:
+        first = slice(0, starts[1] if len(starts) > 1 else n_days)
+        relative[first] = segment_growth[first] @ first_weights
+
+    # Drifted weights at each segment's last close, and the trades that restore the targets
+    ends = np.append(starts[1:], n_days) - 1
+    drifted = start_weights * segment_growth[ends] / relative[ends][:, None]
+    turnover = np.abs(start_weights - np.vstack([held, drifted[:-1]])).sum(axis=1)
+    if not rebalance_first:
+        turnover[0] = 0.0
+    costs = cost_rate * turnover
+
+    # Value at each segment's start, after paying for its trades
+    start_values = np.cumprod(np.concatenate(([1.0], relative[ends][:-1]))) * np.cumprod(1 - costs)
+    wealth = start_values[segment] * relative
+
+    if schedule == "daily" and drift_threshold is None and rebalance_first and not cost_rate:
+        # Every day starts from the target weights: the plain weighted sum, computed exactly
+        portfolio_returns = (returns * weights).sum(axis=1)
+    else:
+        portfolio_returns = pd.Series(wealth / np.concatenate(([1.0], wealth[:-1])) - 1, index=index)
+
+    rebalanced = slice(0 if rebalance_first else 1, None)
+    return BacktestResult(portfolio_returns, weights, settings, index[starts[rebalanced]],
+                          turnover[rebalanced], costs[rebalanced], drifted[-1])
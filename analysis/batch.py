@@ -0,0 +1,21 @@
+import numpy as np
+import pandas as pd
+
+
+def weight_matrix(tickers, portfolios):
+    """
+    Builds an (n_tickers x n_portfolios) weight matrix from (stocks, weights) pairs,
+    with zeros for tickers a portfolio does not hold.
+    """
+    position = {ticker: i for i, ticker in enumerate(tickers)}
+    matrix = np.zeros((len(tickers), len(portfolios)))
+    for column, (stocks, weights) in enumerate(portfolios):
+        for stock, weight in zip(stocks, weights):
+            matrix[position[stock], column] += weight
+    return matrix
+
+
+def portfolio_returns_matrix(returns, weights):
+    """Returns every portfolio's daily return series as one (dates x portfolios) matrix product."""
+    return pd.DataFrame(returns.to_numpy() @ weights, index=returns.index)
+
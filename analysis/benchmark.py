@@ -0,0 +1,314 @@
+"""
+Offline benchmark for the portfolio analysis service.
+
+Runs analyze_portfolio against the deterministic SyntheticPriceProvider, so no
+network access is needed and every run sees the same prices. Reports:
+  - latency of each pipeline stage (median and p95 over --repeat runs)
+  - peak traced Python memory and the process's max RSS for one cold analysis
+  - end-to-end requests per second at each --concurrency level
+  - cold start: app import and kernel warm-up time in fresh interpreters, checked
+    against STARTUP_BUDGET_SECONDS
+
+Needs the development requirements (pip install -r requirements-dev.txt).
+Results can be saved as a named baseline and later runs compared against it:
+
+    python benchmark.py --tickers 20 --years 10 --save-baseline
+    python benchmark.py --tickers 20 --years 10 --compare
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import date
+
+import httpx
+
+from providers import build_price_provider, set_price_provider
+from quotes import quote_service
+from result_cache import result_cache
+from rolling import RollingEngine
+from scheduler import scheduler
+import app as service
+import startup
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks", "baselines.json")
+END_DATE = date(2024, 12, 31)
+
+# Metrics where a larger value is an improvement; every other metric is a latency or size
+HIGHER_IS_BETTER = ("requests_per_second",)
+
+
+def scenario_name(args):
+    return (f"{args.tickers}t-{args.years}y-missing{args.missing_rate:g}-gaps{args.gap_rate:g}"
+            f"-late{args.late_listing_rate:g}")
+
+
+def portfolio_request(args, variant=0):
+    """A request over the synthetic tickers; each variant has different weights, so a new cache key."""
+    stocks = [f"SYN{i:03d}" for i in range(args.tickers)]
+    raw = [1.0 + ((i + variant) % 7) for i in range(args.tickers)]
+    weights = [value / sum(raw) for value in raw]
+    weights[-1] = 1.0 - sum(weights[:-1])
+    return service.PortfolioRequest(
+        start_date=date(END_DATE.year - args.years, END_DATE.month, END_DATE.day).isoformat(),
+        end_date=END_DATE.isoformat(),
+        stocks=stocks,
+        weights=weights,
+        benchmark="SYNIDX",
+        rolling_windows=args.rolling_windows
+    )
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def run_stages(request):
+    """Runs each pipeline stage once, in pipeline order, and returns {stage: milliseconds}."""
+    start_date, end_date = service.parse_date_range(request.start_date, request.end_date)
+    stocks, weights = request.stocks, request.weights
+    provider = service.get_price_provider()
+    timings = {}
+
+    benchmark_data, timings["download"] = timed(provider.get_closes, [request.benchmark], start_date, end_date)
+    (_, returns, portfolio_returns, _, _), timings["get_portfolio_data"] = timed(
+        service.get_portfolio_data, stocks, weights, start_date, end_date)
+    # Monthly rebalancing with a drift band and costs, on top of the daily rule above
+    _, timings["backtest_monthly_drift"] = timed(service.backtest, returns, weights, "monthly", 0.05, 10.0)
+    benchmark_returns = benchmark_data[request.benchmark].dropna().pct_change().dropna()
+
+    _, timings["calculate_risk_metrics"] = timed(service.calculate_risk_metrics, portfolio_returns, benchmark_returns)
+
+    def rolling_metrics():
+        rolling = RollingEngine(portfolio_returns, benchmark_returns)
+        rolling.sharpe(126), rolling.sortino(126), rolling.volatility(30)
+        rolling.beta(30), rolling.beta(90), rolling.correlation(30)
+        if request.rolling_windows:
+            rolling.frame(request.rolling_windows)
+
+    _, timings["rolling_metrics"] = timed(rolling_metrics)
+    _, timings["get_drawdown_details"] = timed(service.get_drawdown_details, portfolio_returns)
+    _, timings["correlation_matrix"] = timed(service.get_correlation_matrix, returns, stocks)
+
+    # Full analysis from an empty result cache, then its serialization on its own
+    result_cache.clear()
+    response, timings["analysis_cold"] = timed(service.run_portfolio_analysis, request)
+    _, timings["analysis_cached"] = timed(service.run_portfolio_analysis, request)
+    _, timings["serialization"] = timed(service.encode_json, response)
+    return timings
+
+
+def measure_stages(request, repeat):
+    run_stages(request)  # warm up imports, caches and the worker pools
+    samples = [run_stages(request) for _ in range(repeat)]
+    report = {}
+    for stage in samples[0]:
+        values = sorted(sample[stage] for sample in samples)
+        report[stage] = {
+            "median_ms": round(statistics.median(values), 3),
+            "p95_ms": round(values[min(len(values) - 1, int(round(0.95 * (len(values) - 1))))], 3)
+        }
+    return report
+
+
+def measure_memory(request):
+    result_cache.clear()
+    tracemalloc.start()
+    service.encoded_portfolio_analysis(request)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != "darwin":
+        max_rss *= 1024
+    return {"peak_traced_mb": round(peak / 2 ** 20, 2), "max_rss_mb": round(max_rss / 2 ** 20, 2)}
+
+
+async def measure_throughput(args, concurrency):
+    """Sends args.requests distinct analyses through the ASGI app with at most `concurrency` in flight."""
+    result_cache.clear()
+    transport = httpx.ASGITransport(app=service.app)
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    failures = 0
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+        async def send(variant):
+            nonlocal failures
+            body = portfolio_request(args, variant).model_dump()
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.post("/analyze_portfolio", json=body)
+                latencies.append((time.perf_counter() - start) * 1000)
+                if response.status_code != 200:
+                    failures += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(send(variant) for variant in range(args.requests)))
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "requests_per_second": round(args.requests / elapsed, 2),
+        "median_ms": round(statistics.median(latencies), 3),
+        "p95_ms": round(latencies[int(round(0.95 * (len(latencies) - 1)))], 3),
+        "failures": failures
+    }
+
+
+def measure_startup(runs):
+    """Median import and warm-up seconds of the app, each run in a fresh interpreter."""
+    script = ("import json, time; started = time.perf_counter(); import app, startup; "
+              "imported = time.perf_counter() - started; "
+              "print(json.dumps({'import_seconds': imported, 'warmup_seconds': startup.warm_up()}))")
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", script], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True, check=True).stdout
+        samples.append(json.loads(output.strip().splitlines()[-1]))
+
+    report = {name: round(statistics.median(sample[name] for sample in samples), 3) for name in samples[0]}
+    report["total_seconds"] = round(report["import_seconds"] + report["warmup_seconds"], 3)
+    return report
+
+
+async def measure_all_throughput(args):
+    # One event loop for every level, since the scheduler's admission semaphore is bound to it
+    return {f"c{concurrency}": await measure_throughput(args, concurrency) for concurrency in args.concurrency}
+
+
+def flatten(report, prefix=""):
+    # {"stages": {"download": {"median_ms": 1}}} -> {"stages.download.median_ms": 1}
+    flat = {}
+    for key, value in report.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, name + "."))
+        elif isinstance(value, (int, float)):
+            flat[name] = value
+    return flat
+
+
+def compare(report, baseline, tolerance):
+    """Prints every metric next to its baseline and returns the names of the regressions."""
+    current, reference = flatten(report["results"]), flatten(baseline["results"])
+    regressions = []
+    print(f"\n{'metric':<52}{'baseline':>12}{'current':>12}{'change':>10}")
+    for name, value in current.items():
+        if name not in reference or name.endswith("failures"):
+            continue
+        base = reference[name]
+        change = (value - base) / base if base else 0.0
+        worse = -change if name.endswith(HIGHER_IS_BETTER) else change
+        flag = ""
+        if worse > tolerance:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print(f"{name:<52}{base:>12.3f}{value:>12.3f}{change:>+10.1%}{flag}")
+    return regressions
+
+
+def load_baselines():
+    if not os.path.exists(BASELINE_PATH):
+        return {}
+    with open(BASELINE_PATH) as f:
+        return json.load(f)
+
+
+def save_baseline(name, report):
+    baselines = load_baselines()
+    baselines[name] = report
+    os.makedirs(os.path.dirname(BASELINE_PATH), exist_ok=True)
+    with open(BASELINE_PATH, "w") as f:
+        json.dump(baselines, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tickers", type=int, default=20, help="number of stocks in the portfolio")
+    parser.add_argument("--years", type=int, default=10, help="years of daily history")
+    parser.add_argument("--missing-rate", type=float, default=0.0, help="probability of a missing close per day")
+    parser.add_argument("--gap-rate", type=float, default=0.0, help="probability of a multi-week gap per ticker")
+    parser.add_argument("--late-listing-rate", type=float, default=0.0,
+                        help="probability that a ticker starts trading part-way through")
+    parser.add_argument("--latency", type=float, default=0.0, help="simulated provider latency in seconds")
+    parser.add_argument("--rolling-windows", type=int, nargs="*", default=[20, 60, 252])
+    parser.add_argument("--repeat", type=int, default=10, help="runs per stage measurement")
+    parser.add_argument("--concurrency", type=int, nargs="*", default=[1, 4, 16])
+    parser.add_argument("--requests", type=int, default=32, help="requests per concurrency level")
+    parser.add_argument("--startup-runs", type=int, default=3, help="fresh interpreters timed for cold start (0 skips)")
+    parser.add_argument("--name", help="baseline name (defaults to one derived from the scenario)")
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the named baseline")
+    parser.add_argument("--compare", action="store_true", help="compare against the named baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="relative slowdown reported as a regression (default 0.25)")
+    parser.add_argument("--output", help="also write the report to this JSON file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    name = args.name or scenario_name(args)
+    # Through the environment, so process-pool workers build the same provider
+    os.environ.update({
+        "PRICE_PROVIDER": "synthetic",
+        "SYNTHETIC_MISSING_RATE": str(args.missing_rate),
+        "SYNTHETIC_GAP_RATE": str(args.gap_rate),
+        "SYNTHETIC_LATE_LISTING_RATE": str(args.late_listing_rate),
+        "SYNTHETIC_LATENCY": str(args.latency)
+    })
+    set_price_provider(build_price_provider())
+    quote_service.clear()
+
+    request = portfolio_request(args)
+    results = {"stages": measure_stages(request, args.repeat), "memory": measure_memory(request)}
+    results["throughput"] = asyncio.run(measure_all_throughput(args))
+    scheduler.shutdown()
+    if args.startup_runs:
+        results["startup"] = measure_startup(args.startup_runs)
+
+    report = {
+        "scenario": name,
+        "environment": {"python": platform.python_version(), "machine": platform.machine(),
+                        "cpus": os.cpu_count(), "executor": scheduler.executor_kind},
+        "results": results
+    }
+    print(json.dumps(report, indent=2))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    exit_code = 0
+    if "startup" in results and results["startup"]["total_seconds"] > startup.STARTUP_BUDGET_SECONDS:
+        print(f"\nCold start took {results['startup']['total_seconds']:.2f}s, "
+              f"over the {startup.STARTUP_BUDGET_SECONDS:.2f}s budget")
+        exit_code = 1
+
+    if args.compare:
+        baseline = load_baselines().get(name)
+        if baseline is None:
+            print(f"\nNo stored baseline named '{name}'")
+            exit_code = 1
+        elif compare(report, baseline, args.tolerance):
+            exit_code = 1
+
+    if args.save_baseline:
+        save_baseline(name, report)
+        print(f"\nSaved baseline '{name}' to {BASELINE_PATH}")
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
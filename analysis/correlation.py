@@ -0,0 +1,105 @@
+import numpy as np
+
+
+def pairwise_correlation(values, min_periods=2):
+    """
+    Pearson correlations between the columns of a (dates x tickers) array, using for
+    each pair only the dates on which both have a value, as DataFrame.corr() does.
+    Pairs with fewer than min_periods shared dates are NaN.
+
+    Every pairwise sum comes out of a few matrix products over the validity mask, so
+    missing values never require a per-pair loop or a pandas round trip.
+    """
+    values = np.asarray(values, dtype=float)
+    valid = np.isfinite(values)
+
+    # Centre each column first so the sums of products stay well conditioned
+    counts = valid.sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        centre = np.where(counts > 0, np.where(valid, values, 0).sum(axis=0) / counts, 0.0)
+    x = np.where(valid, values - centre, 0.0)
+
+    if valid.all():
+        # Every pair shares every date, so the per-pair sums are per-column sums
+        n_columns = x.shape[1]
+        pairs = np.full((n_columns, n_columns), float(len(x)))
+        sx = np.broadcast_to(x.sum(axis=0)[:, None], pairs.shape)
+        sxx = np.broadcast_to((x * x).sum(axis=0)[:, None], pairs.shape)
+    else:
+        mask = valid.astype(float)
+        pairs = mask.T @ mask    # dates shared by each pair
+        sx = x.T @ mask          # [i, j]: sum of column i over the dates it shares with j
+        sxx = (x * x).T @ mask
+    sxy = x.T @ x
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        covariance = sxy - sx * sx.T / pairs
+        variance = sxx - sx * sx / pairs
+        corr = covariance / np.sqrt(variance * variance.T)
+    corr = np.clip(corr, -1.0, 1.0)
+    corr[pairs < min_periods] = np.nan
+
+    # A column with any variance correlates perfectly with itself
+    diagonal = np.diag(corr).copy()
+    diagonal[np.isfinite(diagonal)] = 1.0
+    np.fill_diagonal(corr, diagonal)
+    return corr
+
+
+def cluster_order(corr):
+    """
+    Ticker order that places correlated tickers next to each other: the leaves of an
+    average-linkage clustering on the distance sqrt((1 - corr) / 2). Without scipy,
+    tickers are ordered along the matrix's leading eigenvector instead.
+    """
+    n = len(corr)
+    if n < 3:
+        return np.arange(n)
+    filled = np.where(np.isfinite(corr), corr, 0.0)
+    np.fill_diagonal(filled, 1.0)
+
+    # scipy is imported on first use; it is slow to import and only clustering needs it
+    try:
+        from scipy.cluster.hierarchy import leaves_list, linkage
+        from scipy.spatial.distance import squareform
+    except ImportError:  # pragma: no cover - spectral ordering fallback
+        _, vectors = np.linalg.eigh(filled)
+        return np.argsort(vectors[:, -1], kind="stable")
+
+    distance = np.sqrt(np.clip((1.0 - filled) / 2.0, 0.0, 1.0))
+    np.fill_diagonal(distance, 0.0)
+    condensed = squareform((distance + distance.T) / 2, checks=False)
+    return leaves_list(linkage(condensed, method="average", optimal_ordering=n <= 1000))
+
+
+def upper_triangle(corr, dtype=np.float32):
+    """The entries above the diagonal, row by row, as one flat array of n * (n - 1) / 2 values."""
+    rows, columns = np.triu_indices(len(corr), k=1)
+    return corr[rows, columns].astype(dtype)
+
+
+def top_pairs(corr, k):
+    """
+    For every ticker, the positions and values of its k most correlated other
+    tickers, highest first. Missing correlations are never selected, so rows may
+    end with fewer than k entries; those slots hold position -1 and NaN.
+    """
+    n = len(corr)
+    k = min(k, n - 1)
+    if k <= 0:
+        return np.empty((n, 0), dtype=int), np.empty((n, 0))
+
+    scores = np.where(np.isfinite(corr), corr, -np.inf)
+    np.fill_diagonal(scores, -np.inf)
+
+    # Partial selection per row, then sort only the k survivors
+    candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+    order = np.argsort(-candidate_scores, axis=1, kind="stable")
+    positions = np.take_along_axis(candidates, order, axis=1)
+    values = np.take_along_axis(candidate_scores, order, axis=1)
+
+    missing = ~np.isfinite(values)
+    positions[missing] = -1
+    values[missing] = np.nan
+    return positions, values
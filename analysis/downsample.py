@@ -0,0 +1,85 @@
+import numpy as np
+
+
+def lttb_indices(x, y, n_out):
+    """
+    Largest-Triangle-Three-Buckets: keeps the first and last points and, from each
+    of n_out - 2 equal buckets in between, the point forming the largest triangle
+    with the previously kept point and the average of the next bucket.
+    """
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    averages_x = np.add.reduceat(x[1:n - 1], edges[:-1] - 1) / np.diff(edges)
+    averages_y = np.add.reduceat(y[1:n - 1], edges[:-1] - 1) / np.diff(edges)
+
+    selected = np.empty(n_out, dtype=int)
+    selected[0] = 0
+    selected[-1] = n - 1
+    previous = 0
+    for bucket in range(n_out - 2):
+        lo, hi = edges[bucket], edges[bucket + 1]
+        if bucket + 1 < n_out - 2:
+            next_x, next_y = averages_x[bucket + 1], averages_y[bucket + 1]
+        else:
+            next_x, next_y = x[n - 1], y[n - 1]
+        ax, ay = x[previous], y[previous]
+        area = np.abs((ax - next_x) * (y[lo:hi] - ay) - (ax - x[lo:hi]) * (next_y - ay))
+        previous = lo + int(np.argmax(area))
+        selected[bucket + 1] = previous
+    return selected
+
+
+def minmax_indices(y, n_out):
+    """Keeps the first and last points plus the minimum and maximum of each of n_out // 2 buckets."""
+    n = len(y)
+    if n_out >= n or n_out < 4:
+        return np.arange(n)
+
+    n_buckets = (n_out - 2) // 2
+    edges = np.linspace(1, n - 1, n_buckets + 1).astype(int)
+    starts, ends = edges[:-1], edges[1:]
+    valid = ends > starts
+    starts, ends = starts[valid], ends[valid]
+
+    # Buckets are contiguous, so one lexsort by (bucket, value) orders every bucket at once
+    bucket_of = np.repeat(np.arange(len(starts)), ends - starts)
+    positions = np.arange(starts[0], ends[-1])
+    order = np.lexsort((y[positions], bucket_of))
+    sorted_positions = positions[order]
+    offsets = np.concatenate(([0], np.cumsum(ends - starts)))
+    lows = sorted_positions[offsets[:-1]]
+    highs = sorted_positions[offsets[1:] - 1]
+    return np.unique(np.concatenate(([0, n - 1], lows, highs)))
+
+
+def downsample_indices(series, max_points, method="lttb"):
+    """
+    Picks one shared set of at most max_points positions for several aligned series,
+    so every downsampled chart keeps the same dates. Each series gets an equal share
+    of the budget, missing values are skipped, and the first and last positions are
+    always kept. Returns sorted positions into the original series.
+    """
+    series = [np.asarray(values, dtype=float) for values in series]
+    n = len(series[0]) if series else 0
+    if n <= max_points:
+        return np.arange(n)
+
+    budget = max(max_points // len(series), 4)
+    keep = [np.array([0, n - 1])]
+    for values in series:
+        finite = np.flatnonzero(np.isfinite(values))
+        if len(finite) <= budget:
+            keep.append(finite)
+        elif method == "minmax":
+            keep.append(finite[minmax_indices(values[finite], budget)])
+        else:
+            keep.append(finite[lttb_indices(finite.astype(float), values[finite], budget)])
+
+    selected = np.unique(np.concatenate(keep))
+    if len(selected) > max_points:
+        # Rounding in the per-series budgets can overshoot slightly; thin evenly
+        selected = selected[np.linspace(0, len(selected) - 1, max_points).astype(int)]
+    return selected
@@ -0,0 +1,101 @@
+import numpy as np
+
+
+def drawdown_episodes(drawdowns, dates):
+    """
+    Finds every drawdown episode with array operations.
+
+    drawdowns is a 1-D drawdown series or a (dates x series) matrix of them, and
+    dates the matching DatetimeIndex. An episode runs from the first underwater
+    day to the last one before recovery (or the final day if it never recovers),
+    which is how qs.stats.drawdown_details reports 'start' and 'end'.
+
+    Returns a dict of equal-length arrays, ordered by series then start date:
+      series    column the episode belongs to
+      start     position of the first underwater day
+      valley    position of the deepest point
+      end       position of the last underwater day
+      days      calendar days from start to end, inclusive
+      drawdown  depth of the valley (negative fraction)
+    """
+    values = np.asarray(drawdowns, dtype=float)
+    if values.ndim == 1:
+        values = values.reshape(-1, 1)
+    n_dates, n_series = values.shape
+
+    # Lay the series end to end and stop episodes from running across the seams
+    flat = values.T.reshape(-1)
+    underwater = flat < 0
+    first_row = np.zeros(flat.shape, dtype=bool)
+    first_row[::n_dates] = True
+    last_row = np.zeros(flat.shape, dtype=bool)
+    last_row[n_dates - 1::n_dates] = True
+
+    previous = np.concatenate(([False], underwater[:-1])) & ~first_row
+    following = np.concatenate((underwater[1:], [False])) & ~last_row
+    starts = np.flatnonzero(underwater & ~previous)
+    ends = np.flatnonzero(underwater & ~following)
+
+    if len(starts) == 0:
+        empty = np.array([], dtype=int)
+        return {'series': empty, 'start': empty, 'valley': empty, 'end': empty,
+                'days': empty, 'drawdown': np.array([], dtype=float)}
+
+    # Days between episodes are exactly 0, so each segment's minimum is its episode's valley
+    depth = np.minimum.reduceat(flat, starts)
+
+    # First position within each episode that reaches the valley depth
+    episode = np.cumsum(underwater & ~previous) - 1
+    at_valley = underwater & (flat == depth[np.maximum(episode, 0)])
+    _, first = np.unique(episode[at_valley], return_index=True)
+    valley = np.flatnonzero(at_valley)[first]
+
+    day_numbers = np.asarray(dates, dtype="datetime64[D]").astype(np.int64)
+    start_rows = starts % n_dates
+    end_rows = ends % n_dates
+
+    return {
+        'series': starts // n_dates,
+        'start': start_rows,
+        'valley': valley % n_dates,
+        'end': end_rows,
+        'days': day_numbers[end_rows] - day_numbers[start_rows] + 1,
+        'drawdown': depth
+    }
+
+
+def worst_episodes(episodes, top_k=None):
+    """
+    Positions of the worst episodes, most negative first, with ties kept in
+    chronological order. With top_k only that many are selected per series, using
+    a partial selection instead of sorting every episode.
+    """
+    depth = episodes['drawdown']
+    series = episodes['series']
+    if len(depth) == 0:
+        return np.array([], dtype=int)
+
+    # Episodes are grouped by series, so each series is one contiguous slice
+    boundaries = np.flatnonzero(np.diff(series)) + 1
+    selected = []
+    for offset, group in zip(np.concatenate(([0], boundaries)), np.split(depth, boundaries)):
+        if top_k is not None and top_k < len(group):
+            candidates = np.argpartition(group, top_k - 1)[:top_k]
+        else:
+            candidates = np.arange(len(group))
+        order = np.lexsort((candidates, group[candidates]))
+        selected.append(candidates[order] + offset)
+    return np.concatenate(selected)
+
+
+def episode_records(episodes, positions, date_labels):
+    """Builds the {'start', 'recovery', 'drawdown', 'underwater'} dicts used in responses."""
+    starts = date_labels[episodes['start'][positions]]
+    recoveries = date_labels[episodes['end'][positions]]
+    return [
+        {'start': start, 'recovery': recovery, 'drawdown': drawdown, 'underwater': underwater}
+        for start, recovery, drawdown, underwater in zip(
+            starts.tolist(), recoveries.tolist(),
+            episodes['drawdown'][positions].tolist(), episodes['days'][positions].tolist()
+        )
+    ]
@@ -0,0 +1,77 @@
+import json
+
+import numpy as np
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - stdlib fallback
+    orjson = None
+
+
+def date_labels(index):
+    """Formats a DatetimeIndex as 'YYYY-MM-DD' strings in one vectorized call."""
+    return np.datetime_as_string(np.asarray(index, dtype="datetime64[D]"), unit="D")
+
+
+def float_list(values):
+    """Converts a float array to a list, with None wherever the value is NaN or infinite."""
+    values = np.asarray(values, dtype=float)
+    finite = np.isfinite(values)
+    if finite.all():
+        return values.tolist()
+    converted = values.astype(object)
+    converted[~finite] = None
+    return converted.tolist()
+
+
+def series_rows(dates, columns, skip_missing=False):
+    """
+    Builds the row-of-dicts shape, [{"date": ..., name: value, ...}, ...], from a
+    shared date array and one float array per column. With skip_missing, rows
+    whose values are all missing are left out.
+    """
+    names = list(columns)
+    values = [np.asarray(columns[name], dtype=float) for name in names]
+    labels = np.asarray(dates)
+
+    if skip_missing:
+        keep = np.isfinite(np.vstack(values)).any(axis=0)
+        if not keep.all():
+            labels = labels[keep]
+            values = [column[keep] for column in values]
+
+    keys = ("date", *names)
+    return [dict(zip(keys, row)) for row in zip(labels.tolist(), *(float_list(column) for column in values))]
+
+
+def series_payload(dates, columns, columnar, skip_missing=False):
+    """
+    Series in either response shape: a list of row dicts, or in columnar mode the
+    float arrays themselves (a single array when there is only one column), to be
+    read against the response's shared 'dates' array.
+    """
+    if not columnar:
+        return series_rows(dates, columns, skip_missing)
+    if len(columns) == 1:
+        return next(iter(columns.values()))
+    return dict(columns)
+
+
+def _default(obj):
+    # Fallback encoder hook for values the stdlib json module does not know
+    if isinstance(obj, np.ndarray):
+        return float_list(obj) if obj.dtype.kind == "f" else obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def encode_json(payload):
+    """
+    Serializes a response to JSON bytes. NumPy arrays are written directly and NaN
+    becomes null; orjson is used when installed, the stdlib json module otherwise.
+    """
+    if orjson is not None:
+        # orjson hands arrays it cannot write directly (not C-contiguous) to _default
+        return orjson.dumps(payload, default=_default, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(payload, default=_default, separators=(",", ":")).encode()
@@ -0,0 +1,226 @@
+import contextvars
+import cProfile
+import io
+import os
+import pstats
+import random
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+# Histogram bucket upper bounds in seconds, from sub-millisecond stages to slow downloads
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_current_timer = contextvars.ContextVar("stage_timer", default=None)
+
+
+class StageTimer:
+    """
+    Collects the time spent in each named stage of one request. Time in a stage
+    that is entered several times is summed, and spans may be nested.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = defaultdict(float)
+
+    def add(self, stage, seconds):
+        self.stages[stage] += seconds
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+
+@contextmanager
+def span(stage):
+    """Times the enclosed block as `stage` on the current request's timer, if there is one."""
+    timer = _current_timer.get()
+    if timer is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer.add(stage, time.perf_counter() - start)
+
+
+class ProfileSampler:
+    """
+    Runs a random sample of requests under cProfile and keeps the report of the
+    ones slower than slow_seconds. sample_rate 0 disables profiling.
+    """
+
+    def __init__(self, sample_rate=0.0, slow_seconds=1.0, keep=20):
+        self.sample_rate = sample_rate
+        self.slow_seconds = slow_seconds
+        self.reports = deque(maxlen=keep)
+        self._lock = threading.Lock()
+
+    def should_sample(self):
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def report(self, profile, limit=40):
+        stream = io.StringIO()
+        pstats.Stats(profile, stream=stream).sort_stats("cumulative").print_stats(limit)
+        return stream.getvalue()
+
+    def record(self, name, seconds, report):
+        with self._lock:
+            self.reports.append({"name": name, "seconds": round(seconds, 4), "time": time.time(),
+                                 "profile": report})
+
+    def recent(self):
+        with self._lock:
+            return list(self.reports)
+
+
+# Held while a call runs under cProfile
+_profiling = threading.Lock()
+
+
+def timed_call(profile, fn, *args):
+    """
+    Calls fn(*args) under a fresh StageTimer, and under cProfile when profile is true.
+    Returns (result, stages, total seconds, profile report or None); the report is
+    only kept when the call was slower than the sampler's threshold. This runs inside
+    the worker, so the timings travel back with the result even from another process.
+    """
+    timer = StageTimer()
+    token = _current_timer.set(timer)
+    # Only one profiler may run per process (Python 3.12+ raises otherwise), so a
+    # sampled call that finds another one running is simply not profiled
+    profiler = None
+    if profile and _profiling.acquire(blocking=False):
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except Exception:
+            profiler = None
+            _profiling.release()
+    try:
+        result = fn(*args)
+    finally:
+        if profiler is not None:
+            try:
+                profiler.disable()
+            except Exception:
+                profiler = None
+            finally:
+                _profiling.release()
+        _current_timer.reset(token)
+
+    total = timer.elapsed
+    report = None
+    if profiler is not None and total >= profile_sampler.slow_seconds:
+        try:
+            report = profile_sampler.report(profiler)
+        except Exception:
+            report = None
+    return result, dict(timer.stages), total, report
+
+
+def server_timing(stages, total):
+    """Formats stage durations as a Server-Timing header value, in milliseconds."""
+    entries = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in stages.items()]
+    entries.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(entries)
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def lines(self, name, labels):
+        # Prometheus buckets are cumulative
+        cumulative = 0
+        lines = []
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound:g}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {self.count}')
+        lines.append(f"{name}_sum{{{labels}}} {self.sum:.6f}")
+        lines.append(f"{name}_count{{{labels}}} {self.count}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Process-wide request and stage metrics, rendered in the Prometheus text format.
+    Gauges and counters owned by other components (caches, scheduler, provider) are
+    read through collectors registered with add_collector.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stage_histograms = defaultdict(Histogram)
+        self._request_histograms = defaultdict(Histogram)
+        self._requests = defaultdict(int)
+        self._collectors = []
+
+    def observe_stages(self, endpoint, stages):
+        with self._lock:
+            for stage, seconds in stages.items():
+                self._stage_histograms[(endpoint, stage)].observe(seconds)
+
+    def observe_request(self, endpoint, status, seconds, coalesced=False):
+        """Records one request; coalesced ones shared another identical request's computation."""
+        with self._lock:
+            self._request_histograms[(endpoint, coalesced)].observe(seconds)
+            self._requests[(endpoint, status, coalesced)] += 1
+
+    def add_collector(self, collector):
+        """collector() returns [(name, type, help, value or {labels: value})]."""
+        self._collectors.append(collector)
+
+    def render(self):
+        lines = []
+        with self._lock:
+            lines += ["# HELP portfolio_stage_duration_seconds Time spent in each stage of an analysis",
+                      "# TYPE portfolio_stage_duration_seconds histogram"]
+            for (endpoint, stage), histogram in sorted(self._stage_histograms.items()):
+                lines += histogram.lines("portfolio_stage_duration_seconds", f'endpoint="{endpoint}",stage="{stage}"')
+
+            lines += ["# HELP portfolio_request_duration_seconds End-to-end request latency",
+                      "# TYPE portfolio_request_duration_seconds histogram"]
+            for (endpoint, coalesced), histogram in sorted(self._request_histograms.items()):
+                lines += histogram.lines("portfolio_request_duration_seconds",
+                                         f'endpoint="{endpoint}",coalesced="{str(coalesced).lower()}"')
+
+            lines += ["# HELP portfolio_requests_total Requests by endpoint, status code and whether they were coalesced",
+                      "# TYPE portfolio_requests_total counter"]
+            for (endpoint, status, coalesced), count in sorted(self._requests.items()):
+                lines.append(f'portfolio_requests_total{{endpoint="{endpoint}",status="{status}",'
+                             f'coalesced="{str(coalesced).lower()}"}} {count}')
+
+        for collector in self._collectors:
+            for name, kind, help_text, value in collector():
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+                if isinstance(value, dict):
+                    for labels, labelled_value in value.items():
+                        lines.append(f"{name}{{{labels}}} {labelled_value}")
+                else:
+                    lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+metrics_registry = MetricsRegistry()
+
+profile_sampler = ProfileSampler(
+    sample_rate=float(os.environ.get("PROFILE_SAMPLE_RATE", "0")),
+    slow_seconds=float(os.environ.get("PROFILE_SLOW_SECONDS", "1.0"))
+)
@@ -0,0 +1,170 @@
+from statistics import NormalDist
+
+import numpy as np
+import pandas as pd
+
+# 5% quantile of the standard normal, used for the parametric 95% VaR
+VAR_95_Z = NormalDist().inv_cdf(0.05)
+
+
+def _as_matrix(returns):
+    # Work on (dates x series) float arrays; a 1-D input becomes a single column
+    values = np.asarray(returns, dtype=float)
+    return values.reshape(-1, 1) if values.ndim == 1 else values
+
+
+def wealth_and_peak(returns):
+    """
+    Cumulative wealth and its running maximum for a (dates x series) return matrix.
+    Wealth starts from an implicit 1.0 before the first day, as in quantstats, so a
+    loss on the very first day still counts as a drawdown.
+    """
+    wealth = np.cumprod(1 + returns, axis=0)
+    peak = np.maximum(np.maximum.accumulate(wealth, axis=0), 1.0)
+    return wealth, peak
+
+
+def drawdown_series(returns):
+    """
+    Drawdown from the running peak for each day, matching qs.stats.to_drawdown_series.
+    Accepts a Series, DataFrame or array and returns the same kind.
+    """
+    values = _as_matrix(returns)
+    wealth, peak = wealth_and_peak(values)
+    drawdown = wealth / peak - 1
+    drawdown[~np.isfinite(drawdown)] = 0.0
+    drawdown += 0.0  # turns -0.0 into 0.0
+
+    if isinstance(returns, pd.Series):
+        return pd.Series(drawdown[:, 0], index=returns.index, name=returns.name)
+    if isinstance(returns, pd.DataFrame):
+        return pd.DataFrame(drawdown, index=returns.index, columns=returns.columns)
+    return drawdown[:, 0] if np.ndim(returns) == 1 else drawdown
+
+
+def risk_metrics(returns, benchmark_returns=None, periods=252):
+    """
+    Computes the key portfolio metrics in one pass from shared intermediates
+    (mean, standard deviation, downside deviation, wealth and running peak),
+    following the quantstats definitions of each metric.
+
+    returns is a 1-D series or a (dates x portfolios) matrix without NaNs, and
+    benchmark_returns, when given, must cover the same dates. A 1-D input yields
+    {metric: float}, a matrix yields {metric: array with one value per column}.
+    """
+    single = np.ndim(returns) == 1
+    x = _as_matrix(returns)
+    n = x.shape[0]
+    annualize = np.sqrt(periods)
+
+    mean = x.mean(axis=0)
+    centered = x - mean
+    std = np.sqrt((centered * centered).sum(axis=0) / (n - 1))
+
+    gains = x >= 0
+    losses = ~gains
+    negatives = np.where(losses, x, 0.0)
+    downside = np.sqrt((negatives * negatives).sum(axis=0) / n)
+
+    wealth, peak = wealth_and_peak(x)
+    max_drawdown = np.minimum((wealth / peak).min(axis=0) - 1, 0)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        final = wealth[-1]
+        cagr = np.where(final < 0, np.nan, np.abs(final) ** (periods / n) - 1)
+
+        wins = (x > 0).sum(axis=0)
+        non_zero = wins + (x < 0).sum(axis=0)
+        win_rate = np.where(non_zero > 0, wins / non_zero, 0.0)
+
+        gain_count = gains.sum(axis=0)
+        loss_count = n - gain_count
+        gain_sum = x.sum(axis=0) - negatives.sum(axis=0)
+        win_ratio = np.abs(gain_sum / gain_count / gain_count)
+        loss_ratio = np.abs(negatives.sum(axis=0) / loss_count / loss_count)
+        profit_ratio = np.where(gain_count == 0, 0.0,
+                                np.where((loss_count == 0) | (loss_ratio == 0), np.nan, win_ratio / loss_ratio))
+
+        metrics = {
+            'Sharpe_Ratio': mean / std * annualize,
+            'Sortino_Ratio': np.where(downside == 0, np.nan, mean / downside * annualize),
+            'Max_Drawdown': max_drawdown,
+            'CAGR': cagr,
+            'Volatility': std * annualize,
+            'Win_Rate': win_rate,
+            'Profit_Ratio': profit_ratio,
+            'Value_at_Risk': mean + VAR_95_Z * std
+        }
+
+        if benchmark_returns is not None and len(benchmark_returns) == n and n > 1:
+            benchmark = np.asarray(benchmark_returns, dtype=float)
+            benchmark_mean = benchmark.mean()
+            benchmark_centered = benchmark - benchmark_mean
+            benchmark_var = benchmark_centered @ benchmark_centered / (n - 1)
+
+            # Missing greeks are reported as 0, like qs.stats.greeks
+            beta = benchmark_centered @ centered / (n - 1) / benchmark_var
+            alpha = np.nan_to_num((mean - beta * benchmark_mean) * periods)
+            beta = np.nan_to_num(beta)
+
+            active = x - benchmark[:, None]
+            active_mean = mean - benchmark_mean
+            active_centered = active - active_mean
+            active_std = np.sqrt((active_centered * active_centered).sum(axis=0) / (n - 1))
+            information_ratio = np.where(active_std != 0, active_mean / active_std, 0.0)
+
+            metrics.update({
+                'Beta': beta,
+                'Alpha': alpha,
+                'Information_Ratio': information_ratio
+            })
+
+    if single:
+        return {name: float(values[0]) for name, values in metrics.items()}
+    return metrics
+
+
+if __name__ == "__main__":
+    # Parity and speed check against quantstats: python metrics.py [n_days]
+    import sys
+    import time
+
+    import quantstats as qs
+
+    n_days = int(sys.argv[1]) if len(sys.argv) > 1 else 252 * 25
+    rng = np.random.default_rng(7)
+    index = pd.bdate_range("2000-01-03", periods=n_days)
+    returns = pd.Series(rng.normal(0.0004, 0.012, n_days), index=index)
+    benchmark = pd.Series(0.6 * returns.to_numpy() + rng.normal(0.0003, 0.008, n_days), index=index)
+
+    started = time.perf_counter()
+    greeks = qs.stats.greeks(returns, benchmark)
+    expected = {
+        'Sharpe_Ratio': qs.stats.sharpe(returns),
+        'Sortino_Ratio': qs.stats.sortino(returns),
+        'Max_Drawdown': qs.stats.max_drawdown(returns),
+        'CAGR': qs.stats.cagr(returns),
+        'Volatility': qs.stats.volatility(returns),
+        'Win_Rate': qs.stats.win_rate(returns),
+        'Profit_Ratio': qs.stats.profit_ratio(returns),
+        'Value_at_Risk': qs.stats.var(returns),
+        'Beta': greeks['beta'],
+        'Alpha': greeks['alpha'],
+        'Information_Ratio': qs.stats.information_ratio(returns, benchmark)
+    }
+    quantstats_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    actual = risk_metrics(returns.to_numpy(), benchmark.to_numpy())
+    kernel_time = time.perf_counter() - started
+
+    worst = 0.0
+    for name, value in expected.items():
+        error = abs(float(value) - actual[name])
+        worst = max(worst, error)
+        print(f"{name:<18} quantstats={float(value):+.12f} kernel={actual[name]:+.12f} abs_err={error:.2e}")
+
+    dd_error = np.abs(qs.stats.to_drawdown_series(returns) - drawdown_series(returns)).max()
+    print(f"{'drawdown_series':<18} max abs_err={dd_error:.2e}")
+    print(f"quantstats: {quantstats_time * 1000:.1f} ms, kernel: {kernel_time * 1000:.2f} ms over {n_days} days")
+    sys.exit(0 if max(worst, dd_error) < 1e-9 else 1)
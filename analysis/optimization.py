@@ -0,0 +1,248 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# Candidates are scored in blocks of this many rows to bound the temporary matrices
+SWEEP_CHUNK = 50_000
+# Processes that score sweep blocks in parallel; 1 scores them in the calling process
+SWEEP_WORKERS = int(os.environ.get("OPTIMIZE_SWEEP_WORKERS", "1"))
+# Largest Monte-Carlo sweep a single request may ask for
+MAX_SAMPLES = int(os.environ.get("OPTIMIZE_MAX_SAMPLES", "1000000"))
+
+_sweep_pool = None
+
+
+def annualized_moments(returns, periods=252):
+    """Annualized mean vector and covariance matrix of a (dates x assets) return array."""
+    values = np.asarray(returns, dtype=float)
+    return values.mean(axis=0) * periods, np.cov(values, rowvar=False, ddof=1).reshape(values.shape[1], -1) * periods
+
+
+def portfolio_stats(weights, mean, cov, risk_free_rate=0.0):
+    """
+    Expected return, volatility and Sharpe ratio of every row of a (candidates x
+    assets) weight matrix, from one product with the covariance matrix.
+    """
+    weights = np.atleast_2d(weights)
+    expected = weights @ mean
+    volatility = np.sqrt(np.maximum(np.einsum("ij,ij->i", weights @ cov, weights), 0.0))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        sharpe = np.where(volatility > 0, (expected - risk_free_rate) / volatility, np.nan)
+    return expected, volatility, sharpe
+
+
+def project_to_simplex(points):
+    """Euclidean projection of each row onto {w : w >= 0, sum(w) = 1}, all rows at once."""
+    points = np.atleast_2d(points)
+    n = points.shape[1]
+    ordered = -np.sort(-points, axis=1)
+    partial = np.cumsum(ordered, axis=1) - 1.0
+    ranks = np.arange(1, n + 1)
+    # Last position where the sorted value still exceeds the running threshold
+    support = (ordered - partial / ranks) > 0
+    count = n - np.argmax(support[:, ::-1], axis=1)
+    threshold = partial[np.arange(len(points)), count - 1] / count
+    return np.maximum(points - threshold[:, None], 0.0)
+
+
+def solve_long_only(mean, cov, risk_aversion, iterations=5000, tolerance=1e-9):
+    """
+    Long-only mean-variance portfolios: for each risk aversion g, the weights on the
+    simplex maximizing mean . w - g / 2 * w' cov w. Every g is solved in the same
+    batch by accelerated projected gradient, so a whole frontier costs one matrix
+    product per iteration. g = inf gives the minimum-variance portfolio.
+    """
+    risk_aversion = np.asarray(risk_aversion, dtype=float)
+    n = len(mean)
+    finite = np.isfinite(risk_aversion)
+    scale = np.where(finite, risk_aversion, 1.0)[:, None]
+    linear = np.where(finite[:, None], mean[None, :], 0.0)
+
+    # Step 1/L with L the largest eigenvalue of the scaled covariance
+    lipschitz = scale[:, 0] * max(np.linalg.eigvalsh(cov)[-1], 1e-12)
+    step = (1.0 / lipschitz)[:, None]
+
+    weights = np.full((len(risk_aversion), n), 1.0 / n)
+    momentum = weights.copy()
+    t = np.ones((len(risk_aversion), 1))
+    for iteration in range(iterations):
+        gradient = scale * (momentum @ cov) - linear
+        updated = project_to_simplex(momentum - step * gradient)
+        difference = updated - weights
+        # Restart the momentum of any row that started moving uphill
+        uphill = np.einsum("ij,ij->i", momentum - updated, difference) > 0
+        t[uphill] = 1.0
+        t_next = (1 + np.sqrt(1 + 4 * t * t)) / 2
+        momentum = updated + ((t - 1) / t_next) * difference
+        weights, t = updated, t_next
+        if iteration % 10 == 0 and np.abs(difference).max() < tolerance:
+            break
+    return weights
+
+
+def min_volatility_weights(mean, cov, long_only=True):
+    if long_only:
+        return solve_long_only(mean, cov, [np.inf])[0]
+    inverse_ones = np.linalg.solve(cov, np.ones(len(mean)))
+    return inverse_ones / inverse_ones.sum()
+
+
+def _risk_aversion_grid(mean, cov, low, high, count):
+    # Risk aversions spanning the frontier, scaled to the assets' own return/variance ratio
+    base = max(np.abs(mean).mean(), 1e-6) / max(np.diag(cov).mean(), 1e-12)
+    return base * np.logspace(low, high, count)
+
+
+def max_sharpe_weights(mean, cov, risk_free_rate=0.0, long_only=True):
+    """
+    Tangency portfolio. Without the long-only constraint it is closed form; with it,
+    the Sharpe ratio along the long-only frontier is maximized by two rounds of
+    batched solves on a progressively finer grid of risk aversions.
+    """
+    excess = mean - risk_free_rate
+    if not long_only:
+        direction = np.linalg.solve(cov, excess)
+        if direction.sum() <= 0:
+            return min_volatility_weights(mean, cov, long_only=False)
+        return direction / direction.sum()
+
+    low, high = -3.0, 4.0
+    best = None
+    for _ in range(2):
+        grid = _risk_aversion_grid(excess, cov, low, high, 48)
+        candidates = solve_long_only(excess, cov, grid)
+        _, _, sharpe = portfolio_stats(candidates, mean, cov, risk_free_rate)
+        position = int(np.nanargmax(sharpe)) if np.isfinite(sharpe).any() else 0
+        best = candidates[position]
+        spacing = (high - low) / 47
+        centre = low + position * spacing
+        low, high = centre - spacing, centre + spacing
+    return best
+
+
+def risk_parity_weights(cov, budget=None, iterations=500, tolerance=1e-12):
+    """
+    Weights whose risk contributions w_i (cov w)_i match the budget (equal by
+    default), by cyclical coordinate descent on 1/2 y' cov y - sum(b log y).
+    """
+    n = len(cov)
+    budget = np.full(n, 1.0 / n) if budget is None else np.asarray(budget, dtype=float)
+    diagonal = np.maximum(np.diag(cov), 1e-16)
+    y = budget / np.sqrt(diagonal)
+    for _ in range(iterations):
+        previous = y.copy()
+        for i in range(n):
+            # Solve diagonal_i y_i^2 + c_i y_i - b_i = 0 for the positive root
+            c = cov[i] @ y - cov[i, i] * y[i]
+            y[i] = (-c + np.sqrt(c * c + 4 * diagonal[i] * budget[i])) / (2 * diagonal[i])
+        if np.abs(y - previous).max() < tolerance:
+            break
+    return y / y.sum()
+
+
+def efficient_frontier(mean, cov, points=25, risk_free_rate=0.0, long_only=True):
+    """
+    `points` frontier portfolios at evenly spaced returns from the minimum-variance
+    portfolio up to the highest attainable return, returned as a weight matrix
+    ordered by volatility.
+    """
+    if not long_only:
+        # Two-fund separation: every frontier portfolio mixes the min-variance and tangency portfolios
+        minimum = min_volatility_weights(mean, cov, long_only=False)
+        tangency = max_sharpe_weights(mean, cov, risk_free_rate, long_only=False)
+        low = minimum @ mean
+        high = max(tangency @ mean, mean.max())
+        span = tangency @ mean - low
+        targets = np.linspace(low, high, points)
+        mix = (targets - low) / span if abs(span) > 1e-12 else np.zeros(points)
+        return minimum[None, :] + mix[:, None] * (tangency - minimum)[None, :]
+
+    grid = np.concatenate(([np.inf], _risk_aversion_grid(mean, cov, 4, -3, max(points * 4, 100))))
+    candidates = solve_long_only(mean, cov, grid)
+    expected, volatility, _ = portfolio_stats(candidates, mean, cov)
+
+    order = np.argsort(volatility, kind="stable")
+    candidates, expected = candidates[order], expected[order]
+    efficient = expected >= np.maximum.accumulate(expected) - 1e-12
+    candidates, expected = candidates[efficient], np.maximum.accumulate(expected[efficient])
+    if len(candidates) == 1:
+        return np.repeat(candidates, points, axis=0)
+
+    # Hit each evenly spaced target return by mixing the two solved portfolios around
+    # it: long-only frontier weights are piecewise linear in the target return, so on
+    # this dense grid the mix stays on the frontier
+    targets = np.linspace(expected[0], expected[-1], points)
+    upper = np.searchsorted(expected, targets).clip(1, len(expected) - 1)
+    lower = upper - 1
+    gap = expected[upper] - expected[lower]
+    mix = np.divide(targets - expected[lower], gap, out=np.zeros(points), where=gap > 0).clip(0.0, 1.0)
+    return candidates[lower] + mix[:, None] * (candidates[upper] - candidates[lower])
+
+
+def random_weights(count, n_assets, long_only=True, seed=None):
+    """Uniform draws from the simplex (Dirichlet(1)), or normalized Gaussian weights when shorting is allowed."""
+    rng = np.random.default_rng(seed)
+    if long_only:
+        return rng.dirichlet(np.ones(n_assets), size=count)
+    raw = rng.standard_normal((count, n_assets))
+    sums = raw.sum(axis=1, keepdims=True)
+    sums[np.abs(sums) < 1e-3] = 1e-3
+    return raw / sums
+
+
+def _sweep_chunk(mean, cov, count, long_only, seed, risk_free_rate, keep):
+    # Scores one block of random candidates and keeps the weights of its best `keep`
+    weights = random_weights(count, len(mean), long_only, seed)
+    expected, volatility, sharpe = portfolio_stats(weights, mean, cov, risk_free_rate)
+    ranked = np.where(np.isfinite(sharpe), sharpe, -np.inf)
+    best = np.argpartition(-ranked, min(keep, count) - 1)[:keep] if count > keep else np.arange(count)
+    return weights[best], expected, volatility, sharpe
+
+
+def _pool(workers):
+    global _sweep_pool
+    if _sweep_pool is None or _sweep_pool._max_workers != workers:
+        if _sweep_pool is not None:
+            _sweep_pool.shutdown(wait=False)
+        _sweep_pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    return _sweep_pool
+
+
+def monte_carlo_sweep(mean, cov, samples, long_only=True, seed=None, risk_free_rate=0.0, top_k=10, workers=None):
+    """
+    Scores `samples` random portfolios, one matrix product per block of SWEEP_CHUNK
+    candidates. Blocks run on a process pool when workers (default SWEEP_WORKERS)
+    is above 1. Returns the top_k candidates by Sharpe ratio and the return,
+    volatility and Sharpe of every sample.
+    """
+    workers = SWEEP_WORKERS if workers is None else workers
+    counts = [SWEEP_CHUNK] * (samples // SWEEP_CHUNK)
+    if samples % SWEEP_CHUNK:
+        counts.append(samples % SWEEP_CHUNK)
+    seeds = np.random.SeedSequence(seed).spawn(len(counts))
+    jobs = [(mean, cov, count, long_only, chunk_seed, risk_free_rate, top_k) for count, chunk_seed in zip(counts, seeds)]
+
+    if workers > 1 and len(jobs) > 1:
+        results = list(_pool(workers).map(_sweep_chunk, *zip(*jobs)))
+    else:
+        results = [_sweep_chunk(*job) for job in jobs]
+
+    weights = np.concatenate([result[0] for result in results])
+    expected = np.concatenate([result[1] for result in results])
+    volatility = np.concatenate([result[2] for result in results])
+    sharpe = np.concatenate([result[3] for result in results])
+
+    # Sharpe ratios of the candidates each block kept, to rank them across blocks
+    _, _, kept_sharpe = portfolio_stats(weights, mean, cov, risk_free_rate)
+    ranked = np.where(np.isfinite(kept_sharpe), kept_sharpe, -np.inf)
+    order = np.argsort(-ranked, kind="stable")[:top_k]
+    return weights[order], expected, volatility, sharpe
+
+
+def shutdown():
+    global _sweep_pool
+    if _sweep_pool is not None:
+        _sweep_pool.shutdown(wait=False, cancel_futures=True)
+        _sweep_pool = None
@@ -0,0 +1,204 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - no cross-process locking on Windows
+    fcntl = None
+
+# Every ticker has one float32 slot per calendar day in [EPOCH, END); EPOCH reaches
+# back far enough for long index histories such as ^GSPC
+EPOCH = date(1900, 1, 1)
+END = date(2070, 1, 1)
+DAYS = (END - EPOCH).days
+ITEM_SIZE = np.dtype(np.float32).itemsize
+# Tickers are added to the file in blocks, so readers rarely need to remap it
+GROWTH = 64
+# Seconds before a row left behind by a replaced history is reused; readers hold a
+# row only while copying one slice out of it
+ROW_REUSE_SECONDS = 60.0
+
+
+def _day(value):
+    return pd.Timestamp(value).date().toordinal() - EPOCH.toordinal()
+
+
+class SharedPricePanel:
+    """
+    Close prices of every ticker in one memory-mapped float32 file, shared by all
+    worker processes on a host through the page cache instead of one DataFrame copy
+    per process.
+
+    The file is ticker-major: each ticker owns a contiguous row of DAYS float32
+    values indexed by calendar day, so one ticker's date range is a single slice.
+    A zero means no close (prices are never zero), which lets the file grow with
+    ftruncate and stay sparse on disk until days are written.
+
+    'panel.json' maps tickers to rows and records the date range [start, end)
+    fetched for each, like LocalPriceStore's sidecars, clipped to the days the
+    panel holds. It also records EPOCH; a panel written with another one is
+    discarded when opened. Writers hold an exclusive
+    lock on 'panel.lock', so one process at a time appends; they write the values
+    first and replace the header last, so a reader that sees a ticker in the header
+    also sees its prices. Readers take no lock. A replaced history is written to
+    another row and the header repointed, so readers never see a row cleared; the
+    old row is reused once ROW_REUSE_SECONDS have passed.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.data_path = os.path.join(directory, "panel.f32")
+        self.header_path = os.path.join(directory, "panel.json")
+        self.lock_path = os.path.join(directory, "panel.lock")
+        self._lock = threading.Lock()
+        self._header = self._empty_header()
+        self._header_stamp = None
+        self._map = None
+
+        if not os.path.exists(self.data_path):
+            open(self.data_path, "ab").close()
+        with self._writer() as header:
+            if header.get("epoch") != EPOCH.isoformat():
+                # Written with another day layout; it is only a cache, so start over
+                os.truncate(self.data_path, 0)
+                self._save_header(self._empty_header())
+
+    @staticmethod
+    def _empty_header():
+        return {"epoch": EPOCH.isoformat(), "rows": 0, "capacity": 0, "tickers": {}, "free": []}
+
+    # Header and mapping
+
+    def _load_header(self):
+        try:
+            stat = os.stat(self.header_path)
+        except FileNotFoundError:
+            return self._header
+        stamp = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if stamp != self._header_stamp:
+            with open(self.header_path) as f:
+                self._header = json.load(f)
+            self._header_stamp = stamp
+        return self._header
+
+    def _mapped(self, capacity):
+        # Remap only when the file has grown past what this process has mapped
+        if capacity == 0:
+            return None
+        if self._map is None or self._map.shape[0] < capacity:
+            self._map = np.memmap(self.data_path, dtype=np.float32, mode="r+", shape=(capacity, DAYS))
+        return self._map
+
+    @contextmanager
+    def _writer(self):
+        with self._lock, open(self.lock_path, "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                # Another process may have written since this one last looked
+                self._header_stamp = None
+                yield self._load_header()
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _save_header(self, header):
+        tmp_path = self.header_path + f".{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(header, f)
+        os.replace(tmp_path, self.header_path)
+        self._header_stamp = None
+
+    # Store interface shared with LocalPriceStore
+
+    def coverage(self, ticker):
+        with self._lock:
+            entry = self._load_header()["tickers"].get(ticker)
+        if entry is None:
+            return None
+        return date.fromisoformat(entry["start"]), date.fromisoformat(entry["end"])
+
+    def read_range(self, ticker, start, end):
+        """Closes in [start, end), or None for an unknown ticker. Only the range is copied out."""
+        with self._lock:
+            header = self._load_header()
+            entry = header["tickers"].get(ticker)
+            if entry is None:
+                return None
+            panel = self._mapped(header["capacity"])
+
+        lo, hi = max(_day(start), 0), min(_day(end), DAYS)
+        if hi <= lo:
+            return pd.Series([], index=pd.DatetimeIndex([], name="Date"), dtype=np.float64, name=ticker)
+
+        values = panel[entry["row"], lo:hi]
+        present = np.flatnonzero(values)
+        index = pd.DatetimeIndex(
+            (np.datetime64(EPOCH, "D") + lo + present).astype("datetime64[ns]"), name="Date")
+        # Stored as float32; returns are computed from float64 copies
+        return pd.Series(values[present].astype(np.float64), index=index, name=ticker)
+
+    def read(self, ticker):
+        return self.read_range(ticker, EPOCH, END)
+
+    def _allocate_row(self, header):
+        # Reuse a row freed long enough ago that no reader can still be copying from
+        # it, cleared before any header points at it; otherwise grow the file
+        free = header.setdefault("free", [])
+        for i, (row, freed_start, freed_end, freed_at) in enumerate(free):
+            if time.time() - freed_at >= ROW_REUSE_SECONDS:
+                del free[i]
+                panel = self._mapped(header["capacity"])
+                panel[row, max(_day(freed_start), 0):min(_day(freed_end), DAYS)] = 0
+                return row
+        row = header["rows"]
+        header["rows"] += 1
+        if header["rows"] > header["capacity"]:
+            header["capacity"] += GROWTH
+            os.truncate(self.data_path, header["capacity"] * DAYS * ITEM_SIZE)
+        return row
+
+    def write(self, ticker, new_values, start, end, replace=False):
+        """
+        Stores freshly fetched closes and widens the covered range, or with replace
+        swaps in a whole new history, as LocalPriceStore.write does.
+        """
+        # Days outside the panel cannot be stored, so they are never marked covered either
+        start, end = max(start, EPOCH), min(end, END)
+        if start >= end:
+            return
+        with self._writer() as header:
+            entry = header["tickers"].get(ticker)
+            if entry is None:
+                entry = {"row": self._allocate_row(header), "start": start.isoformat(), "end": end.isoformat()}
+            elif replace:
+                # The new history goes into another row and the header swap below
+                # repoints the ticker, so readers see either history whole
+                header.setdefault("free", []).append([entry["row"], entry["start"], entry["end"], time.time()])
+                entry = {"row": self._allocate_row(header), "start": start.isoformat(), "end": end.isoformat()}
+            else:
+                entry["start"] = min(date.fromisoformat(entry["start"]), start).isoformat()
+                entry["end"] = max(date.fromisoformat(entry["end"]), end).isoformat()
+
+            if new_values is not None:
+                new_values = new_values.dropna()
+                new_values = new_values[new_values > 0]
+            if new_values is not None and not new_values.empty:
+                days = (pd.DatetimeIndex(new_values.index).to_numpy().astype("datetime64[D]")
+                        - np.datetime64(EPOCH, "D")).astype(np.int64)
+                # Only days in [start, end) are stored, so a row never holds values outside its covered range
+                inside = (days >= _day(start)) & (days < _day(end))
+                panel = self._mapped(header["capacity"])
+                panel[entry["row"], days[inside]] = new_values.to_numpy(dtype=np.float32)[inside]
+                panel.flush()
+
+            header["tickers"][ticker] = entry
+            self._save_header(header)
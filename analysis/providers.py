@@ -0,0 +1,628 @@
+import json
+import os
+import threading
+import time
+import zlib
+from collections import defaultdict
+from concurrent.futures import Future
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from typing import Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - no cross-process locking on Windows
+    fcntl = None
+
+
+def _to_date(value):
+    # Accept date, datetime, Timestamp or YYYY-MM-DD strings
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return pd.Timestamp(value).date()
+
+
+def _normalize_index(frame):
+    # Daily bars are keyed by tz-naive midnight timestamps
+    index = pd.DatetimeIndex(frame.index)
+    if index.tz is not None:
+        index = index.tz_localize(None)
+    frame.index = index.normalize()
+    frame.index.name = "Date"
+    return frame
+
+
+def extract_closes(data, tickers):
+    """
+    Pulls the 'Close' prices out of a yf.download frame as one column per ticker,
+    whichever column layout yfinance returned.
+    """
+    if data is None or data.empty:
+        return pd.DataFrame(columns=tickers, dtype=float)
+
+    if isinstance(data.columns, pd.MultiIndex):
+        closes = data["Close"]
+        if isinstance(closes, pd.Series):
+            closes = closes.to_frame(tickers[0])
+    elif "Close" in data.columns:
+        closes = data[["Close"]].set_axis(tickers[:1], axis=1)
+    else:
+        closes = data
+
+    closes = closes.reindex(columns=tickers).astype(float)
+    return _normalize_index(closes)
+
+
+class PriceProvider:
+    """Source of daily close prices and live quotes for the analysis pipeline."""
+
+    def get_closes(self, tickers, start_date, end_date):
+        """Returns a DataFrame of closes in [start_date, end_date) with one column per ticker."""
+        raise NotImplementedError
+
+    def get_quote(self, ticker):
+        """Returns a live quote dict for ticker, or None when unavailable."""
+        return None
+
+
+class YahooPriceProvider(PriceProvider):
+    """Fetches prices and quotes from Yahoo Finance through yfinance."""
+
+    def __init__(self):
+        self.fetch_count = 0
+
+    def get_closes(self, tickers, start_date, end_date):
+        import yfinance as yf  # deferred: importing yfinance is slow and only Yahoo needs it
+
+        tickers = list(tickers)
+        self.fetch_count += 1
+        data = yf.download(tickers, start=start_date, end=end_date, progress=False)
+        return extract_closes(data, tickers)
+
+    def get_quote(self, ticker):
+        import yfinance as yf
+
+        try:
+            info = yf.Ticker(ticker).info
+            if not info:
+                return None
+
+            return {
+                'price': info.get('regularMarketPrice', 0),
+                'change': info.get('regularMarketChangePercent', 0),
+                'volume': info.get('regularMarketVolume', 0),
+                'market_cap': info.get('marketCap', 0),
+                'pe_ratio': info.get('forwardPE', 0),
+                'dividend_yield': info.get('dividendYield', 0) if info.get('dividendYield') else 0
+            }
+        except Exception:
+            return None
+
+
+class FixturePriceProvider(PriceProvider):
+    """
+    Serves prices from local files so the whole pipeline can run offline.
+
+    The directory holds one '<TICKER>.csv' (Date,Close) or '<TICKER>.parquet' file
+    per ticker, plus an optional 'quotes.json' mapping tickers to quote dicts.
+    Tickers without a quote entry get one derived from their last two closes.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._series = {}
+        self._quotes = None
+        self._lock = threading.Lock()
+
+    def _load(self, ticker):
+        with self._lock:
+            if ticker in self._series:
+                return self._series[ticker]
+
+            series = None
+            parquet_path = os.path.join(self.directory, f"{ticker}.parquet")
+            csv_path = os.path.join(self.directory, f"{ticker}.csv")
+            if os.path.exists(parquet_path):
+                frame = pd.read_parquet(parquet_path)
+            elif os.path.exists(csv_path):
+                frame = pd.read_csv(csv_path, index_col=0, parse_dates=True)
+            else:
+                frame = None
+
+            if frame is not None and not frame.empty:
+                column = "Close" if "Close" in frame.columns else frame.columns[0]
+                series = _normalize_index(frame[[column]].astype(float))[column].sort_index()
+                series.name = ticker
+
+            self._series[ticker] = series
+            return series
+
+    def get_closes(self, tickers, start_date, end_date):
+        tickers = list(tickers)
+        start = pd.Timestamp(_to_date(start_date))
+        end = pd.Timestamp(_to_date(end_date))
+
+        columns = {}
+        for ticker in tickers:
+            series = self._load(ticker)
+            if series is not None:
+                columns[ticker] = series[(series.index >= start) & (series.index < end)]
+
+        if not columns:
+            return pd.DataFrame(columns=tickers, dtype=float)
+        return pd.concat(columns, axis=1).sort_index().reindex(columns=tickers)
+
+    def get_quote(self, ticker):
+        if self._quotes is None:
+            path = os.path.join(self.directory, "quotes.json")
+            if os.path.exists(path):
+                with open(path) as f:
+                    self._quotes = json.load(f)
+            else:
+                self._quotes = {}
+
+        if ticker in self._quotes:
+            return self._quotes[ticker]
+
+        series = self._load(ticker)
+        if series is None or len(series) < 2:
+            return None
+
+        return {
+            'price': float(series.iloc[-1]),
+            'change': float((series.iloc[-1] / series.iloc[-2] - 1) * 100),
+            'volume': 0,
+            'market_cap': 0,
+            'pe_ratio': 0,
+            'dividend_yield': 0
+        }
+
+
+class SyntheticPriceProvider(PriceProvider):
+    """
+    Deterministic random-walk prices for benchmarks and offline runs.
+
+    Every ticker follows a geometric random walk driven by one shared market factor
+    plus its own noise, seeded from the ticker name, so the same ticker always has the
+    same history whatever else is requested with it. Business days from history_start
+    to history_end are generated. Missing data can be injected with:
+      missing_rate       probability that any single day has no close
+      gap_rate           probability that a ticker has one multi-week gap
+      late_listing_rate  probability that a ticker starts trading part-way through
+    latency adds a fixed delay to every call to mimic a remote source.
+    """
+
+    def __init__(self, seed=0, history_start="1990-01-01", history_end="2030-12-31", missing_rate=0.0,
+                 gap_rate=0.0, late_listing_rate=0.0, latency=0.0):
+        self.seed = seed
+        self.missing_rate = missing_rate
+        self.gap_rate = gap_rate
+        self.late_listing_rate = late_listing_rate
+        self.latency = latency
+        self.dates = pd.bdate_range(history_start, history_end, name="Date")
+        self.fetch_count = 0
+        self._series = {}
+        self._lock = threading.Lock()
+
+        rng = np.random.default_rng([seed, 0])
+        self._market = rng.normal(0.0004, 0.011, len(self.dates))
+
+    def _generate(self, ticker):
+        rng = np.random.default_rng([self.seed, zlib.crc32(ticker.encode()) + 1])
+        n = len(self.dates)
+        beta = rng.uniform(0.5, 1.5)
+        volatility = rng.uniform(0.008, 0.025)
+        returns = beta * self._market + rng.normal(0.0001, volatility, n)
+        closes = rng.uniform(10, 500) * np.cumprod(1 + np.clip(returns, -0.5, 0.5))
+
+        if self.late_listing_rate and rng.random() < self.late_listing_rate:
+            closes[:rng.integers(n // 10, n // 2)] = np.nan
+        if self.gap_rate and rng.random() < self.gap_rate:
+            gap_start = rng.integers(0, n - 30)
+            closes[gap_start:gap_start + rng.integers(10, 30)] = np.nan
+        if self.missing_rate:
+            closes[rng.random(n) < self.missing_rate] = np.nan
+
+        return pd.Series(closes, index=self.dates, name=ticker)
+
+    def _load(self, ticker):
+        with self._lock:
+            series = self._series.get(ticker)
+            if series is None:
+                series = self._series[ticker] = self._generate(ticker)
+            return series
+
+    def get_closes(self, tickers, start_date, end_date):
+        tickers = list(tickers)
+        if self.latency:
+            time.sleep(self.latency)
+        self.fetch_count += 1
+
+        start = self.dates.searchsorted(pd.Timestamp(_to_date(start_date)))
+        end = self.dates.searchsorted(pd.Timestamp(_to_date(end_date)))
+        closes = pd.DataFrame({ticker: self._load(ticker).to_numpy()[start:end] for ticker in tickers},
+                              index=self.dates[start:end], columns=tickers)
+        # Like yf.download, drop the days on which no requested ticker traded
+        return closes.dropna(how="all")
+
+    def get_quote(self, ticker):
+        if self.latency:
+            time.sleep(self.latency)
+        series = self._load(ticker)
+        series = series[series.index <= pd.Timestamp(datetime.now().date())].dropna()
+        if len(series) < 2:
+            return None
+
+        return {
+            'price': float(series.iloc[-1]),
+            'change': float((series.iloc[-1] / series.iloc[-2] - 1) * 100),
+            'volume': 0,
+            'market_cap': 0,
+            'pe_ratio': 0,
+            'dividend_yield': 0
+        }
+
+
+class CoalescingPriceProvider(PriceProvider):
+    """
+    Merges concurrent downloads: a ticker already being fetched for the same date
+    range is awaited instead of requested again, and every other ticker of the call
+    goes upstream together in one batched fetch. Wraps the upstream source, so a
+    burst of requests sharing a benchmark like SPY costs one download of it.
+    """
+
+    def __init__(self, upstream):
+        self.upstream = upstream
+        self._pending = {}
+        self._lock = threading.Lock()
+        self.coalesced = 0
+
+    @property
+    def fetch_count(self):
+        return getattr(self.upstream, "fetch_count", 0)
+
+    def get_closes(self, tickers, start_date, end_date):
+        tickers = list(tickers)
+        start, end = _to_date(start_date), _to_date(end_date)
+
+        waiting = {}
+        leading = {}
+        with self._lock:
+            for ticker in dict.fromkeys(tickers):
+                key = (ticker, start, end)
+                if key in self._pending:
+                    waiting[ticker] = self._pending[key]
+                    self.coalesced += 1
+                else:
+                    leading[ticker] = self._pending[key] = Future()
+
+        columns = {}
+        if leading:
+            try:
+                fetched = self.upstream.get_closes(list(leading), start, end)
+            except BaseException as e:
+                self._finish(leading, start, end, error=e)
+                raise
+            for ticker in leading:
+                columns[ticker] = fetched[ticker] if ticker in fetched.columns else None
+            self._finish(leading, start, end, results=columns)
+
+        for ticker, future in waiting.items():
+            columns[ticker] = future.result()
+
+        columns = {ticker: series for ticker, series in columns.items() if series is not None}
+        if not columns:
+            return pd.DataFrame(columns=tickers, dtype=float)
+        closes = pd.concat(columns, axis=1).sort_index().reindex(columns=tickers)
+        return closes.dropna(how="all")
+
+    def _finish(self, futures, start, end, results=None, error=None):
+        with self._lock:
+            for ticker in futures:
+                del self._pending[(ticker, start, end)]
+        for ticker, future in futures.items():
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(results[ticker])
+
+    def get_quote(self, ticker):
+        return self.upstream.get_quote(ticker)
+
+
+# Days each fetched segment reaches into the stored range, to detect restated history
+OVERLAP_DAYS = timedelta(days=7)
+# Largest relative difference between a stored and a re-fetched close that is not a restatement
+RESTATEMENT_TOLERANCE = 1e-5
+
+
+class LocalPriceStore:
+    """
+    On-disk columnar store with one Parquet file per ticker.
+
+    Alongside each '<TICKER>.parquet' a small '<TICKER>.json' records the date range
+    [start, end) that has been fetched from upstream, so weekends and holidays at the
+    edges of a request are not mistaken for missing data.
+
+    Several worker processes may share the directory. A writer holds an exclusive
+    lock on '<TICKER>.lock' for its whole read-merge-write, like SharedPricePanel's
+    writers, and replaces the data before the sidecar, so a covered range never
+    claims rows another writer dropped. Readers take no lock.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._memory = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def _base(self, ticker):
+        # Tickers like 'BRK/B' must not escape the store directory
+        safe = ticker.replace(os.sep, "_").replace("/", "_")
+        return os.path.join(self.directory, safe)
+
+    def _paths(self, ticker):
+        base = self._base(ticker)
+        return base + ".parquet", base + ".json"
+
+    @contextmanager
+    def _writer(self, ticker):
+        with self._write_lock, open(self._base(ticker) + ".lock", "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def coverage(self, ticker) -> Optional[Tuple[date, date]]:
+        _, meta_path = self._paths(ticker)
+        if not os.path.exists(meta_path):
+            return None
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            return _to_date(meta["start"]), _to_date(meta["end"])
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def read(self, ticker):
+        data_path, _ = self._paths(ticker)
+        with self._lock:
+            cached = self._memory.get(ticker)
+            stamp = self._stamp(data_path)
+            if cached is not None and cached[0] == stamp:
+                return cached[1]
+
+        if stamp is None:
+            return None
+
+        series = pd.read_parquet(data_path)["close"]
+        series.name = ticker
+        with self._lock:
+            self._memory[ticker] = (stamp, series)
+        return series
+
+    @staticmethod
+    def _stamp(path):
+        # Every write replaces the file, so its inode tells versions apart even within one mtime tick
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def read_range(self, ticker, start, end):
+        """Closes in [start, end), or None for an unknown ticker."""
+        series = self.read(ticker)
+        if series is None:
+            return None
+        return series[(series.index >= pd.Timestamp(start)) & (series.index < pd.Timestamp(end))]
+
+    def write(self, ticker, new_values, start, end, replace=False):
+        """
+        Merges freshly fetched closes into the store and widens the covered range.
+        With replace, they become the ticker's whole history and [start, end) its
+        covered range.
+        """
+        data_path, meta_path = self._paths(ticker)
+        if new_values is not None:
+            new_values = new_values.dropna()
+
+        with self._writer(ticker):
+            # Read under the lock, so rows another process just wrote are merged too
+            existing = None if replace else self.read(ticker)
+            covered = None if replace else self.coverage(ticker)
+
+            if existing is not None and new_values is not None and not new_values.empty:
+                merged = pd.concat([existing, new_values])
+                merged = merged[~merged.index.duplicated(keep="last")].sort_index()
+            elif new_values is not None and not new_values.empty:
+                merged = new_values.sort_index()
+            else:
+                merged = existing
+
+            if covered is not None:
+                start, end = min(start, covered[0]), max(end, covered[1])
+
+            # Write to temporary files first so concurrent readers never see a partial file
+            suffix = f".{os.getpid()}.tmp"
+            if merged is not None:
+                merged.rename("close").to_frame().to_parquet(data_path + suffix)
+                os.replace(data_path + suffix, data_path)
+                with self._lock:
+                    self._memory[ticker] = (self._stamp(data_path), merged.rename(ticker))
+
+            with open(meta_path + suffix, "w") as f:
+                json.dump({"start": start.isoformat(), "end": end.isoformat()}, f)
+            os.replace(meta_path + suffix, meta_path)
+
+
+def _missing_segments(covered, start, end):
+    # Only the head and tail outside the covered range need to be fetched. Each one
+    # runs up to the covered range even when the request stops short of it, because
+    # the store records one range per ticker: any gap in between would be marked
+    # covered without ever being downloaded. Each also reaches OVERLAP_DAYS into the
+    # covered range, so the stored closes can be checked against the fetched ones.
+    if covered is None:
+        return [(start, end)]
+
+    segments = []
+    covered_start, covered_end = covered
+    if start < covered_start:
+        segments.append((start, min(covered_start + OVERLAP_DAYS, covered_end)))
+    if end > covered_end:
+        segments.append((max(covered_end - OVERLAP_DAYS, covered_start), end))
+    return segments
+
+
+def _restated(stored, fetched):
+    # True when closes fetched again for stored days no longer match them
+    if stored is None or fetched is None:
+        return False
+    common = stored.index.intersection(fetched.dropna().index)
+    if common.empty:
+        return False
+    return not np.allclose(fetched[common].to_numpy(dtype=float), stored[common].to_numpy(dtype=float),
+                           rtol=RESTATEMENT_TOLERANCE, atol=0.0)
+
+
+class CachedPriceProvider(PriceProvider):
+    """
+    Serves closes from a LocalPriceStore (or a SharedPricePanel) and only asks the
+    upstream provider for the head/tail segments that are not cached yet. Tickers
+    missing the same segment are fetched together in one upstream call.
+
+    Yahoo's closes are adjusted for splits and dividends, so every new corporate
+    action rescales a ticker's whole history upstream. Each segment therefore
+    overlaps the stored range by a few days, and a ticker whose overlapping closes
+    changed is downloaded again in full instead of joining new rows to stale ones.
+    """
+
+    def __init__(self, upstream, store, exchange_timezone="America/New_York"):
+        self.upstream = upstream
+        self.store = store
+        self.exchange_timezone = exchange_timezone
+        self._lock = threading.Lock()
+
+    def get_closes(self, tickers, start_date, end_date):
+        tickers = list(tickers)
+        start = _to_date(start_date)
+        # Today's bar is still moving, so it is never marked as covered. Today is the
+        # exchange's: a server ahead of it would otherwise store a bar still trading.
+        end = min(_to_date(end_date), pd.Timestamp.now(tz=self.exchange_timezone).date())
+
+        segments = defaultdict(list)
+        for ticker in tickers:
+            for segment in _missing_segments(self.store.coverage(ticker), start, end):
+                segments[segment].append(ticker)
+
+        # Fetch outside the lock so concurrent requests do not serialize on upstream
+        # latency; writes merge with whatever is stored, so overlapping fetches are safe
+        restated = {}
+        for (segment_start, segment_end), group in segments.items():
+            fetched = self.upstream.get_closes(group, segment_start, segment_end)
+            with self._lock:
+                for ticker in group:
+                    values = fetched[ticker] if ticker in fetched.columns else None
+                    covered = self.store.coverage(ticker)
+                    if covered is not None and _restated(self.store.read_range(ticker, segment_start, segment_end), values):
+                        low, high = restated.get(ticker, covered)
+                        restated[ticker] = (min(low, segment_start), max(high, segment_end))
+                        continue
+                    has_values = values is not None and values.notna().any()
+                    # An empty answer for a ticker we have never seen is most likely a bad
+                    # symbol, so leave it uncovered instead of caching the miss
+                    if has_values or covered is not None:
+                        self.store.write(ticker, values, segment_start, segment_end)
+
+        # Histories that were rescaled upstream replace the stored ones
+        refetch = defaultdict(list)
+        for ticker, segment in restated.items():
+            refetch[segment].append(ticker)
+        for (segment_start, segment_end), group in refetch.items():
+            fetched = self.upstream.get_closes(group, segment_start, segment_end)
+            with self._lock:
+                for ticker in group:
+                    values = fetched[ticker] if ticker in fetched.columns else None
+                    self.store.write(ticker, values, segment_start, segment_end, replace=True)
+
+        columns = {}
+        for ticker in tickers:
+            series = self.store.read_range(ticker, start, _to_date(end_date))
+            if series is not None:
+                columns[ticker] = series
+
+        if not columns:
+            return pd.DataFrame(columns=tickers, dtype=float)
+        return pd.concat(columns, axis=1).sort_index().reindex(columns=tickers)
+
+    def get_quote(self, ticker):
+        return self.upstream.get_quote(ticker)
+
+
+_provider = None
+_provider_lock = threading.Lock()
+
+
+def build_price_provider():
+    """
+    Builds the provider selected by the environment:
+      PRICE_PROVIDER     'yahoo' (default), 'fixture' or 'synthetic'
+      PRICE_FIXTURE_DIR  directory read by the fixture provider
+      PRICE_STORE_DIR    on-disk store for Yahoo prices ('' disables it)
+      PRICE_STORE_FORMAT 'parquet' (default, one file per ticker) or 'panel' (one
+                         memory-mapped float32 file shared by every worker process)
+      PRICE_EXCHANGE_TZ  time zone whose date decides which bar is still trading
+                         (default America/New_York)
+      SYNTHETIC_SEED, SYNTHETIC_MISSING_RATE, SYNTHETIC_GAP_RATE,
+      SYNTHETIC_LATE_LISTING_RATE, SYNTHETIC_LATENCY
+                         settings of the synthetic provider (all default to 0)
+    """
+    kind = os.environ.get("PRICE_PROVIDER", "yahoo").lower()
+    if kind == "fixture":
+        directory = os.environ.get("PRICE_FIXTURE_DIR", os.path.join(os.path.dirname(__file__), "fixtures"))
+        return FixturePriceProvider(directory)
+    if kind == "synthetic":
+        return CoalescingPriceProvider(SyntheticPriceProvider(
+            seed=int(os.environ.get("SYNTHETIC_SEED", "0")),
+            missing_rate=float(os.environ.get("SYNTHETIC_MISSING_RATE", "0")),
+            gap_rate=float(os.environ.get("SYNTHETIC_GAP_RATE", "0")),
+            late_listing_rate=float(os.environ.get("SYNTHETIC_LATE_LISTING_RATE", "0")),
+            latency=float(os.environ.get("SYNTHETIC_LATENCY", "0"))
+        ))
+    if kind != "yahoo":
+        raise ValueError(f"Unknown PRICE_PROVIDER '{kind}'")
+
+    # Concurrent downloads of the same ticker and range reach Yahoo only once
+    upstream = CoalescingPriceProvider(YahooPriceProvider())
+    store_dir = os.environ.get("PRICE_STORE_DIR", os.path.join(os.path.dirname(__file__), ".price_store"))
+    if not store_dir:
+        return upstream
+    exchange_timezone = os.environ.get("PRICE_EXCHANGE_TZ", "America/New_York")
+    if os.environ.get("PRICE_STORE_FORMAT", "parquet").lower() == "panel":
+        from panel import SharedPricePanel
+        return CachedPriceProvider(upstream, SharedPricePanel(store_dir), exchange_timezone)
+    return CachedPriceProvider(upstream, LocalPriceStore(store_dir), exchange_timezone)
+
+
+def get_price_provider():
+    global _provider
+    with _provider_lock:
+        if _provider is None:
+            _provider = build_price_provider()
+        return _provider
+
+
+def set_price_provider(provider):
+    """Replaces the process-wide provider, e.g. with a fixture provider in tests."""
+    global _provider
+    with _provider_lock:
+        _provider = provider
@@ -0,0 +1,88 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from providers import get_price_provider
+from singleflight import SingleFlight
+
+
+class QuoteService:
+    """
+    Fetches live quotes for many tickers concurrently on a bounded thread pool and
+    keeps them in a short-TTL in-memory cache shared by every request in the process.
+    """
+
+    def __init__(self, max_workers=8, ttl_seconds=15.0):
+        self.ttl_seconds = ttl_seconds
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="quotes")
+        # Batches run on their own pool so a batch never waits behind the fetches it fans out
+        self._batch_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="quote-batches")
+        self._cache = {}
+        self._lock = threading.Lock()
+        # Concurrent misses for the same ticker share one upstream lookup
+        self._in_flight = SingleFlight()
+        self.hits = 0
+        self.misses = 0
+
+    def _cached(self, ticker, now):
+        entry = self._cache.get(ticker)
+        if entry is not None and entry[0] > now:
+            return entry[1]
+        return None
+
+    def _fetch(self, ticker):
+        return self._in_flight.do(ticker, self._fetch_upstream, ticker)
+
+    def _fetch_upstream(self, ticker):
+        try:
+            quote = get_price_provider().get_quote(ticker)
+        except Exception:
+            quote = None
+
+        # Failed lookups are not cached so the next request retries them
+        if quote:
+            with self._lock:
+                self._cache[ticker] = (time.monotonic() + self.ttl_seconds, quote)
+        return quote
+
+    def get_quotes(self, tickers):
+        """Returns {ticker: quote} for every ticker whose quote could be fetched."""
+        now = time.monotonic()
+        quotes = {}
+        pending = []
+
+        with self._lock:
+            for ticker in dict.fromkeys(tickers):
+                quote = self._cached(ticker, now)
+                if quote is not None:
+                    quotes[ticker] = quote
+                    self.hits += 1
+                else:
+                    pending.append(ticker)
+                    self.misses += 1
+
+        for ticker, quote in zip(pending, self._executor.map(self._fetch, pending)):
+            if quote:
+                quotes[ticker] = quote
+
+        # Keep the caller's ticker order
+        return {ticker: quotes[ticker] for ticker in tickers if ticker in quotes}
+
+    def submit(self, tickers):
+        """Starts get_quotes in the background and returns a Future for the result."""
+        return self._batch_executor.submit(self.get_quotes, list(tickers))
+
+    @property
+    def coalesced(self):
+        return self._in_flight.coalesced
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+
+quote_service = QuoteService(
+    max_workers=int(os.environ.get("QUOTE_MAX_WORKERS", "8")),
+    ttl_seconds=float(os.environ.get("QUOTE_TTL_SECONDS", "15"))
+)
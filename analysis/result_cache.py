@@ -0,0 +1,90 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+def state_key(stocks, weights, start_date, benchmark, rebalancing=None):
+    """
+    Normalized cache key for a portfolio: tickers sorted with their weights, the
+    start date, the benchmark and the rebalancing rule (None for daily rebalancing
+    without costs). The end date is deliberately not part of the key, so a request
+    whose end date moved forward finds the state it can extend.
+    """
+    holdings = tuple(sorted((stock, round(float(weight), 10)) for stock, weight in zip(stocks, weights)))
+    rule = tuple(sorted(rebalancing.items())) if rebalancing else None
+    return holdings, start_date, benchmark, rule
+
+
+class ResultCache:
+    """
+    LRU cache of AnalysisState objects with a time-to-live and a memory budget.
+    Entries are evicted least recently used first once their combined nbytes
+    exceeds max_bytes. States are never mutated, so a cached state can be read by
+    several requests at once while another request extends it into a new one.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024, ttl_seconds=3600.0):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.nbytes = 0
+        self.hits = 0
+        self.extensions = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Returns the cached state for key, or None when absent or expired."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, size, state = entry
+            if expires <= now:
+                del self._entries[key]
+                self.nbytes -= size
+                return None
+            self._entries.move_to_end(key)
+            return state
+
+    def put(self, key, state):
+        size = state.nbytes
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.nbytes -= previous[1]
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, size, state)
+            self.nbytes += size
+
+            while self.nbytes > self.max_bytes:
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self.nbytes -= evicted_size
+
+    def record(self, outcome):
+        """Counts a lookup as a 'hit', an 'extension' or a 'miss'."""
+        with self._lock:
+            if outcome == "hit":
+                self.hits += 1
+            elif outcome == "extension":
+                self.extensions += 1
+            else:
+                self.misses += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+result_cache = ResultCache(
+    max_bytes=int(float(os.environ.get("RESULT_CACHE_MAX_MB", "256")) * 1024 * 1024),
+    ttl_seconds=float(os.environ.get("RESULT_CACHE_TTL_SECONDS", "3600"))
+)
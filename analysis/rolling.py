@@ -0,0 +1,156 @@
+import numpy as np
+import pandas as pd
+
+
+def _cumsum0(values):
+    # Cumulative sums with a leading zero row, so any window sum is one subtraction
+    return np.concatenate(([0.0], np.cumsum(values)))
+
+
+def _window_sums(cumulative, window):
+    sums = np.full(len(cumulative) - 1, np.nan)
+    if window < len(cumulative):
+        sums[window - 1:] = cumulative[window:] - cumulative[:-window]
+    return sums
+
+
+class RollingEngine:
+    """
+    Rolling statistics for any number of window lengths from one shared set of
+    cumulative moment arrays. Building the engine is O(n); each window then costs a
+    handful of vectorized subtractions, whatever its length.
+
+    Returns are shifted by their overall mean before accumulating, which keeps the
+    sum-of-squares differences well conditioned on long histories. Series follow the
+    quantstats/pandas conventions: sample (ddof=1) deviations, annualized by
+    sqrt(periods), NaN until a full window is available.
+    """
+
+    def __init__(self, returns, benchmark_returns=None, periods=252):
+        self.index = returns.index
+        self.periods = periods
+        x = returns.to_numpy(dtype=float)
+        self._x_shift = x.mean() if len(x) else 0.0
+        xc = x - self._x_shift
+
+        self._sx = _cumsum0(xc)
+        self._sxx = _cumsum0(xc * xc)
+        self._sneg = _cumsum0(np.minimum(x, 0) ** 2)
+
+        self.has_benchmark = benchmark_returns is not None and not benchmark_returns.empty
+        if self.has_benchmark:
+            # Windows that contain a day without a benchmark return are left as NaN
+            b = benchmark_returns.reindex(self.index).to_numpy(dtype=float)
+            missing = np.isnan(b)
+            b = np.where(missing, 0.0, b)
+            self._b_shift = b[~missing].mean() if (~missing).any() else 0.0
+            bc = np.where(missing, 0.0, b - self._b_shift)
+
+            self._sb = _cumsum0(bc)
+            self._sbb = _cumsum0(bc * bc)
+            self._sxb = _cumsum0(xc * bc)
+            self._smissing = _cumsum0(missing.astype(float))
+
+        self._moments = {}
+
+    @property
+    def nbytes(self):
+        arrays = [value for value in self.__dict__.values() if isinstance(value, np.ndarray)]
+        return sum(array.nbytes for array in arrays)
+
+    def extend(self, returns, benchmark_returns=None):
+        """
+        Returns a new engine covering the existing days plus the returns appended
+        after them, by continuing the cumulative sums instead of rebuilding them.
+        """
+        extended = object.__new__(RollingEngine)
+        extended.__dict__.update(self.__dict__)
+        extended.index = self.index.append(returns.index)
+        extended._moments = {}
+
+        x = returns.to_numpy(dtype=float)
+        xc = x - self._x_shift
+        extended._sx = np.concatenate((self._sx, self._sx[-1] + np.cumsum(xc)))
+        extended._sxx = np.concatenate((self._sxx, self._sxx[-1] + np.cumsum(xc * xc)))
+        extended._sneg = np.concatenate((self._sneg, self._sneg[-1] + np.cumsum(np.minimum(x, 0) ** 2)))
+
+        if self.has_benchmark:
+            if benchmark_returns is None:
+                b = np.full(len(x), np.nan)
+            else:
+                b = benchmark_returns.reindex(returns.index).to_numpy(dtype=float)
+            missing = np.isnan(b)
+            bc = np.where(missing, 0.0, b - self._b_shift)
+            extended._sb = np.concatenate((self._sb, self._sb[-1] + np.cumsum(bc)))
+            extended._sbb = np.concatenate((self._sbb, self._sbb[-1] + np.cumsum(bc * bc)))
+            extended._sxb = np.concatenate((self._sxb, self._sxb[-1] + np.cumsum(xc * bc)))
+            extended._smissing = np.concatenate((self._smissing, self._smissing[-1] + np.cumsum(missing)))
+        return extended
+
+    def moments(self, window):
+        """Window means, variances and (with a benchmark) covariances, cached per window."""
+        if window in self._moments:
+            return self._moments[window]
+
+        sx = _window_sums(self._sx, window)
+        mean_c = sx / window
+        var = np.maximum((_window_sums(self._sxx, window) - sx * mean_c) / (window - 1), 0)
+        moments = {
+            'mean': mean_c + self._x_shift,
+            'var': var,
+            'downside': _window_sums(self._sneg, window) / window
+        }
+
+        if self.has_benchmark:
+            sb = _window_sums(self._sb, window)
+            valid = _window_sums(self._smissing, window) == 0
+            moments['benchmark_var'] = np.where(
+                valid, np.maximum((_window_sums(self._sbb, window) - sb * sb / window) / (window - 1), 0), np.nan)
+            moments['covariance'] = np.where(
+                valid, (_window_sums(self._sxb, window) - sx * sb / window) / (window - 1), np.nan)
+
+        self._moments[window] = moments
+        return moments
+
+    def sharpe(self, window):
+        m = self.moments(window)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return m['mean'] / np.sqrt(m['var']) * np.sqrt(self.periods)
+
+    def sortino(self, window):
+        m = self.moments(window)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            # A window without losses has no downside deviation; report NaN rather than inf
+            return np.where(m['downside'] > 0, m['mean'] / np.sqrt(m['downside']), np.nan) * np.sqrt(self.periods)
+
+    def volatility(self, window):
+        return np.sqrt(self.moments(window)['var']) * np.sqrt(self.periods)
+
+    def beta(self, window):
+        if not self.has_benchmark:
+            return np.full(len(self.index), np.nan)
+        m = self.moments(window)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(m['benchmark_var'] > 0, m['covariance'] / m['benchmark_var'], np.nan)
+
+    def correlation(self, window):
+        if not self.has_benchmark:
+            return np.full(len(self.index), np.nan)
+        m = self.moments(window)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            denominator = np.sqrt(m['var'] * m['benchmark_var'])
+            return np.where(denominator > 0, m['covariance'] / denominator, np.nan)
+
+    def series(self, name, window):
+        """One rolling series as a pandas Series on the returns' index."""
+        return pd.Series(getattr(self, name)(window), index=self.index, name=f"{name}_{window}d")
+
+    def frame(self, windows, names=("sharpe", "sortino", "volatility", "beta", "correlation")):
+        """Every requested series for every window, as columns named '<metric>_<window>d'."""
+        columns = {}
+        for window in windows:
+            for name in names:
+                if name in ("beta", "correlation") and not self.has_benchmark:
+                    continue
+                columns[f"{name}_{window}d"] = getattr(self, name)(window)
+        return pd.DataFrame(columns, index=self.index)
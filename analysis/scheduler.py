@@ -0,0 +1,167 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+from fastapi import HTTPException
+
+
+class _WorkerHTTPError(Exception):
+    # HTTPException cannot be pickled, so process workers send this back instead
+    def __init__(self, status_code, detail):
+        super().__init__(status_code, detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def _call_in_worker(fn, args):
+    try:
+        return fn(*args)
+    except HTTPException as e:
+        raise _WorkerHTTPError(e.status_code, e.detail)
+
+
+class AnalyticsScheduler:
+    """
+    Runs blocking analytics jobs off the event loop on a bounded worker pool.
+
+    At most max_in_flight jobs execute at once; further jobs wait in a queue of at
+    most max_queued entries and are rejected with 503 once it is full or once they
+    have waited longer than queue_timeout seconds. A separate thread pool is exposed
+    through run_io for the blocking network calls a job fans out.
+    """
+
+    def __init__(self, executor="thread", max_workers=None, max_in_flight=None,
+                 max_queued=64, queue_timeout=30.0, io_workers=16):
+        if executor not in ("thread", "process"):
+            raise ValueError(f"Unknown executor '{executor}', expected 'thread' or 'process'")
+
+        self.executor_kind = executor
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_in_flight = max_in_flight or self.max_workers
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.io_workers = io_workers
+
+        self._executor = None
+        self._io_executor = None
+        self._semaphore = None
+        self.in_flight = 0
+        self.queued = 0
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            if self.executor_kind == "process":
+                # spawn avoids forking a process that already runs executor threads
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="analytics")
+        return self._executor
+
+    @property
+    def io_executor(self):
+        if self._io_executor is None:
+            self._io_executor = ThreadPoolExecutor(max_workers=self.io_workers, thread_name_prefix="analytics-io")
+        return self._io_executor
+
+    def run_io(self, fn, *args):
+        """Submits a blocking I/O call to the I/O pool and returns its Future."""
+        return self.io_executor.submit(fn, *args)
+
+    @asynccontextmanager
+    async def _slot(self):
+        # Holds one admission slot for the enclosed block, queueing or rejecting as described above
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+
+        if self._semaphore.locked():
+            if self.queued >= self.max_queued:
+                raise HTTPException(status_code=503, detail="Server is busy, please retry shortly")
+
+            self.queued += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout)
+            except asyncio.TimeoutError:
+                raise HTTPException(status_code=503, detail="Timed out waiting for an analysis slot")
+            finally:
+                self.queued -= 1
+        else:
+            # A free slot is taken without yielding to the event loop
+            await self._semaphore.acquire()
+
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+
+    async def run(self, fn, *args):
+        """Waits for an admission slot, then runs fn(*args) on the worker pool."""
+        async with self._slot():
+            loop = asyncio.get_running_loop()
+            try:
+                return await loop.run_in_executor(self.executor, _call_in_worker, fn, args)
+            except _WorkerHTTPError as e:
+                raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+    async def stream(self, fn, *args):
+        """
+        Waits for an admission slot, then iterates the generator fn(*args) off the
+        event loop and yields each item as soon as it is produced; the slot is held
+        until the generator finishes. Generators cannot be sent to another process,
+        so they run on the worker threads, or on the I/O pool with a process pool.
+        """
+        async with self._slot():
+            executor = self.executor if self.executor_kind == "thread" else self.io_executor
+            loop = asyncio.get_running_loop()
+            items = fn(*args)
+            done = object()
+            try:
+                while True:
+                    item = await loop.run_in_executor(executor, next, items, done)
+                    if item is done:
+                        break
+                    yield item
+            finally:
+                try:
+                    items.close()
+                except ValueError:
+                    pass  # the consumer went away mid-item; the generator finishes that item on its thread
+
+    def shutdown(self):
+        for executor in (self._executor, self._io_executor):
+            if executor is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = None
+        self._io_executor = None
+
+
+def build_scheduler():
+    """
+    Builds the scheduler configured by the environment:
+      ANALYTICS_EXECUTOR       'thread' (default) or 'process'
+      ANALYTICS_WORKERS        pool size (defaults to the CPU count)
+      ANALYTICS_MAX_IN_FLIGHT  concurrently running jobs (defaults to the pool size)
+      ANALYTICS_MAX_QUEUED     jobs allowed to wait for a slot (default 64)
+      ANALYTICS_QUEUE_TIMEOUT  seconds a job may wait before a 503 (default 30)
+    """
+    def _int(name):
+        value = os.environ.get(name)
+        return int(value) if value else None
+
+    return AnalyticsScheduler(
+        executor=os.environ.get("ANALYTICS_EXECUTOR", "thread").lower(),
+        max_workers=_int("ANALYTICS_WORKERS"),
+        max_in_flight=_int("ANALYTICS_MAX_IN_FLIGHT"),
+        max_queued=int(os.environ.get("ANALYTICS_MAX_QUEUED", "64")),
+        queue_timeout=float(os.environ.get("ANALYTICS_QUEUE_TIMEOUT", "30"))
+    )
+
+
+scheduler = build_scheduler()
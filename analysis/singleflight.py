@@ -0,0 +1,76 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+
+
+class SingleFlight:
+    """
+    Thread-side request coalescing: while a call for a key is running, further calls
+    with the same key wait for it and receive its result (or its exception) instead
+    of running again. Nothing is kept once the call finishes.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.coalesced = 0
+
+    def do(self, key, fn, *args):
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            return future.result()
+
+        try:
+            result = fn(*args)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+
+class AsyncSingleFlight:
+    """
+    Event-loop request coalescing: concurrent awaits of do() with the same key share
+    one task. The task is shielded, so a caller that disconnects does not cancel the
+    computation for the others still waiting on it.
+    """
+
+    def __init__(self):
+        self._tasks = {}
+        self.coalesced = 0
+
+    async def do(self, key, fn, *args):
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn(*args))
+            self._tasks[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task):
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        # Mark the outcome as seen even if every caller went away before it finished
+        if not task.cancelled():
+            task.exception()
+
+    def __contains__(self, key):
+        """Whether a call for key is running, so do(key, ...) would join it."""
+        return key in self._tasks
+
+    def __len__(self):
+        return len(self._tasks)
@@ -0,0 +1,129 @@
+"""
+Cold-start helpers: warming the analytics kernels, a pre-fork server mode and the
+startup-time budget.
+
+    python app.py                       one worker
+    WEB_WORKERS=4 python app.py         warm up once, then fork four workers that
+                                        share the listening socket
+"""
+import os
+import signal
+import sys
+import time
+
+import numpy as np
+
+# Seconds from the start of the app import until it can serve, checked at startup
+STARTUP_BUDGET_SECONDS = float(os.environ.get("STARTUP_BUDGET_SECONDS", "2.0"))
+
+timings = {"import_seconds": None, "warmup_seconds": None}
+
+
+def warm_up():
+    """
+    Runs every analytics kernel once on a small synthetic portfolio, so the first
+    real request does not pay for lazy imports (scipy, pandas internals, orjson) and
+    first-call setup. Uses no threads and no network, which keeps it safe to call
+    before forking. Returns the seconds it took.
+    """
+    from correlation import cluster_order, pairwise_correlation, top_pairs, upper_triangle
+    from downsample import downsample_indices
+    from drawdowns import drawdown_episodes, episode_records, worst_episodes
+    from encoding import date_labels, encode_json, series_rows
+    from metrics import risk_metrics
+    from providers import SyntheticPriceProvider
+    from state import AnalysisState
+
+    started = time.perf_counter()
+    stocks = ["WARM0", "WARM1", "WARM2"]
+    provider = SyntheticPriceProvider(history_start="2020-01-01", history_end="2021-12-31")
+    closes = provider.get_closes(stocks + ["WARMIDX"], "2020-01-01", "2021-12-31")
+    returns = closes[stocks].pct_change().dropna()
+    weights = np.full(len(stocks), 1 / len(stocks))
+    portfolio_returns = (returns * weights).sum(axis=1)
+
+    state = AnalysisState(stocks, weights, "2020-01-01", "2021-12-31", closes[stocks], returns,
+                          portfolio_returns, (1 + returns).cumprod(), "WARMIDX", closes["WARMIDX"])
+    risk_metrics(state.portfolio_returns.to_numpy(), state.benchmark_returns.to_numpy())
+    rolling = state.rolling.frame([20, 126])
+
+    drawdown = state.portfolio_drawdown
+    episodes = drawdown_episodes(drawdown.to_numpy(), drawdown.index)
+    dates = date_labels(drawdown.index)
+    episode_records(episodes, worst_episodes(episodes, top_k=5), dates)
+
+    corr = pairwise_correlation(returns.to_numpy())
+    cluster_order(corr)
+    top_pairs(corr, 1)
+
+    keep = downsample_indices([state.portfolio_cum_return.to_numpy(), rolling.iloc[:, 0].to_numpy()], 50)
+    encode_json({"rows": series_rows(dates[keep], {"value": drawdown.to_numpy()[keep]}),
+                 "triangle": upper_triangle(corr)})
+    return time.perf_counter() - started
+
+
+def check_budget():
+    """Prints a warning when import plus warm-up time exceeded STARTUP_BUDGET_SECONDS."""
+    total = sum(value for value in timings.values() if value is not None)
+    if total > STARTUP_BUDGET_SECONDS:
+        print(f"Startup took {total:.2f}s, over the {STARTUP_BUDGET_SECONDS:.2f}s budget "
+              f"(import {timings['import_seconds'] or 0:.2f}s, warm-up {timings['warmup_seconds'] or 0:.2f}s)",
+              file=sys.stderr)
+    return total
+
+
+def serve(app, host="0.0.0.0", port=8000, workers=1, warm=True):
+    """
+    Serves app with uvicorn. With several workers the parent warms up, binds the
+    socket and then forks, so each worker starts with the kernels already imported
+    and warmed instead of re-importing everything in a fresh interpreter. Workers
+    that die are replaced; SIGINT/SIGTERM stop them all.
+    """
+    import uvicorn
+
+    if warm:
+        timings["warmup_seconds"] = warm_up()
+
+    config = uvicorn.Config(app, host=host, port=port)
+    if workers <= 1 or not hasattr(os, "fork"):
+        uvicorn.Server(config).run()
+        return
+
+    sock = config.bind_socket()
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            uvicorn.Server(config).run(sockets=[sock])
+            os._exit(0)
+        return pid
+
+    children = {spawn() for _ in range(workers)}
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    while children:
+        try:
+            pid, _ = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        children.discard(pid)
+        if not stopping:
+            print(f"Worker {pid} exited, starting a replacement", file=sys.stderr)
+            children.add(spawn())
+    sock.close()
@@ -0,0 +1,123 @@
+import numpy as np
+import pandas as pd
+
+from metrics import wealth_and_peak
+from rolling import RollingEngine
+
+
+def benchmark_returns_for(benchmark_prices, portfolio_returns):
+    """Benchmark returns restricted to the portfolio's dates, as analyze_portfolio reports them."""
+    if benchmark_prices is None or benchmark_prices.empty:
+        return None
+
+    benchmark_returns = benchmark_prices.pct_change().dropna()
+
+    # Ensure benchmark returns align with portfolio returns
+    common_index = portfolio_returns.index.intersection(benchmark_returns.index)
+    if len(common_index) > 0:
+        benchmark_returns = benchmark_returns[common_index.sort_values()]
+    return benchmark_returns
+
+
+class AnalysisState:
+    """
+    The full-resolution intermediates behind one portfolio report: daily returns,
+    cumulative wealth and its running peak, drawdowns and rolling moments.
+
+    A state covers [start_date, end_date) and can be extended with the prices of
+    later days; extend() appends to every intermediate instead of recomputing the
+    whole history, and returns a new state so readers of the old one are unaffected.
+    backtest, when given, is the BacktestResult behind portfolio_returns; without
+    one the portfolio is rebalanced to its weights every day.
+    """
+
+    def __init__(self, stocks, weights, start_date, end_date, closes, returns, portfolio_returns,
+                 stock_cum_returns, benchmark, benchmark_prices, backtest=None):
+        self.stocks = list(stocks)
+        self.weights = np.asarray(weights, dtype=float)
+        self.start_date = start_date
+        self.end_date = end_date
+        self.benchmark = benchmark
+
+        self.last_closes = closes.iloc[-1]
+        self.returns = returns
+        self.portfolio_returns = portfolio_returns
+        self.stock_cum_returns = stock_cum_returns
+        self.backtest = backtest
+
+        has_benchmark = benchmark_prices is not None and not benchmark_prices.empty
+        self.last_benchmark_close = benchmark_prices.iloc[-1] if has_benchmark else None
+        self.last_benchmark_date = benchmark_prices.index[-1] if has_benchmark else None
+        self.benchmark_returns = benchmark_returns_for(benchmark_prices, portfolio_returns)
+
+        wealth, peak = wealth_and_peak(portfolio_returns.to_numpy(dtype=float))
+        self._set_wealth(wealth, peak)
+        self.rolling = RollingEngine(portfolio_returns, self.benchmark_returns)
+
+    def _set_wealth(self, wealth, peak):
+        index = self.portfolio_returns.index
+        self.portfolio_cum_return = pd.Series(wealth, index=index)
+        self.peak = peak
+        drawdown = wealth / peak - 1
+        drawdown[~np.isfinite(drawdown)] = 0.0
+        self.portfolio_drawdown = pd.Series(drawdown + 0.0, index=index)
+
+    @property
+    def nbytes(self):
+        """Approximate memory held by the state, used for size-based cache eviction."""
+        frames = (self.returns, self.stock_cum_returns)
+        series = (self.portfolio_returns, self.portfolio_cum_return, self.portfolio_drawdown, self.benchmark_returns)
+        size = sum(frame.memory_usage(index=True).sum() for frame in frames)
+        size += sum(s.memory_usage(index=True) for s in series if s is not None)
+        return int(size + self.peak.nbytes + self.rolling.nbytes)
+
+    def extend(self, new_closes, new_benchmark_prices, end_date):
+        """
+        Returns a copy of this state with the days in new_closes appended. new_closes
+        holds the stock closes after the last covered day, new_benchmark_prices the
+        matching benchmark closes (or None).
+        """
+        extended = object.__new__(AnalysisState)
+        extended.__dict__.update(self.__dict__)
+        extended.end_date = end_date
+
+        # Returns of the new days, continuing from the last known closes
+        new_closes = new_closes[new_closes.index > self.last_closes.name].reindex(columns=self.stocks)
+        joined = pd.concat([self.last_closes.to_frame().T, new_closes])
+        new_returns = joined.pct_change().iloc[1:].dropna()
+        if new_returns.empty:
+            return extended
+
+        if self.backtest is not None:
+            # Continue trading from the drifted weights the backtest ended with
+            extended.backtest = self.backtest.extend(new_returns)
+            new_portfolio_returns = extended.backtest.portfolio_returns.iloc[len(self.portfolio_returns):]
+        else:
+            new_portfolio_returns = (new_returns * self.weights).sum(axis=1)
+        extended.last_closes = joined.iloc[-1]
+        extended.returns = pd.concat([self.returns, new_returns])
+        extended.portfolio_returns = pd.concat([self.portfolio_returns, new_portfolio_returns])
+        extended.stock_cum_returns = pd.concat(
+            [self.stock_cum_returns, self.stock_cum_returns.iloc[-1] * (1 + new_returns).cumprod()])
+
+        # Wealth and running peak carry on from their last values
+        new_wealth = self.portfolio_cum_return.iloc[-1] * np.cumprod(1 + new_portfolio_returns.to_numpy())
+        new_peak = np.maximum(np.maximum.accumulate(new_wealth), self.peak[-1])
+        extended._set_wealth(np.concatenate([self.portfolio_cum_return.to_numpy(), new_wealth]),
+                             np.concatenate([self.peak, new_peak]))
+
+        new_benchmark_returns = None
+        if self.last_benchmark_close is not None and new_benchmark_prices is not None:
+            new_benchmark_prices = new_benchmark_prices.dropna()
+            new_benchmark_prices = new_benchmark_prices[new_benchmark_prices.index > self.last_benchmark_date]
+            if not new_benchmark_prices.empty:
+                prices = pd.concat([pd.Series([self.last_benchmark_close], index=[self.last_benchmark_date]),
+                                    new_benchmark_prices])
+                extended.last_benchmark_close = prices.iloc[-1]
+                extended.last_benchmark_date = prices.index[-1]
+                new_benchmark_returns = prices.pct_change().iloc[1:]
+                new_benchmark_returns = new_benchmark_returns[new_benchmark_returns.index.isin(new_portfolio_returns.index)]
+                extended.benchmark_returns = pd.concat([self.benchmark_returns, new_benchmark_returns])
+
+        extended.rolling = self.rolling.extend(new_portfolio_returns, new_benchmark_returns)
+        return extended
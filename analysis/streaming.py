@@ -0,0 +1,298 @@
+import asyncio
+import os
+import threading
+from datetime import datetime
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+
+from metrics import wealth_and_peak
+
+
+class Tick(NamedTuple):
+    """One live price: a quote source yields these in arrival order."""
+    ticker: str
+    price: float
+    time: str
+
+
+class OnlineMoments:
+    """
+    Running mean, variance and covariance of paired observations (x, y) with
+    Welford's updates. add() and remove() are O(1), so the latest observation can
+    be replaced as often as it changes without revisiting the history.
+    """
+
+    def __init__(self):
+        self.n = 0
+        self.mean_x = 0.0
+        self.mean_y = 0.0
+        self.m2_x = 0.0
+        self.m2_y = 0.0
+        self.c_xy = 0.0
+
+    @classmethod
+    def from_arrays(cls, x, y=None):
+        """Moments of a whole history at once, equal to add() on every pair in turn."""
+        moments = cls()
+        x = np.asarray(x, dtype=float)
+        y = np.zeros_like(x) if y is None else np.asarray(y, dtype=float)
+        if len(x):
+            moments.n = len(x)
+            moments.mean_x, moments.mean_y = float(x.mean()), float(y.mean())
+            dx, dy = x - moments.mean_x, y - moments.mean_y
+            moments.m2_x, moments.m2_y, moments.c_xy = float(dx @ dx), float(dy @ dy), float(dx @ dy)
+        return moments
+
+    def add(self, x, y=0.0):
+        self.n += 1
+        dx = x - self.mean_x
+        dy = y - self.mean_y
+        self.mean_x += dx / self.n
+        self.mean_y += dy / self.n
+        self.m2_x += dx * (x - self.mean_x)
+        self.m2_y += dy * (y - self.mean_y)
+        self.c_xy += dx * (y - self.mean_y)
+
+    def remove(self, x, y=0.0):
+        """Undoes add(x, y) for a pair that was previously added."""
+        if self.n <= 1:
+            self.__init__()
+            return
+        n = self.n - 1
+        mean_x = (self.n * self.mean_x - x) / n
+        mean_y = (self.n * self.mean_y - y) / n
+        self.m2_x -= (x - mean_x) * (x - self.mean_x)
+        self.m2_y -= (y - mean_y) * (y - self.mean_y)
+        self.c_xy -= (x - mean_x) * (y - self.mean_y)
+        self.n, self.mean_x, self.mean_y = n, mean_x, mean_y
+
+    @property
+    def variance_x(self):
+        return self.m2_x / (self.n - 1) if self.n > 1 else np.nan
+
+    @property
+    def variance_y(self):
+        return self.m2_y / (self.n - 1) if self.n > 1 else np.nan
+
+    @property
+    def covariance(self):
+        return self.c_xy / (self.n - 1) if self.n > 1 else np.nan
+
+
+class LivePortfolio:
+    """
+    A portfolio's headline figures kept current from live quotes.
+
+    It starts from the daily history of an AnalysisState and treats the quotes as
+    today's not-yet-closed day: today's return is sum(w_i * (p_i / close_i - 1))
+    against the last daily closes, the same daily rebalancing the history uses.
+    Each quote changes one term of that sum, and today's return then replaces the
+    previous value of today's observation in the running moments, so value,
+    intraday return, drawdown, volatility and beta all update in O(1) per quote.
+    Volatility and beta are the annualized daily figures of analyze_portfolio with
+    today included.
+    """
+
+    FIELDS = ("value", "intraday_return", "drawdown", "max_drawdown", "volatility", "beta")
+
+    def __init__(self, stocks, weights, last_closes, portfolio_returns, benchmark=None, last_benchmark_close=None,
+                 benchmark_returns=None, initial_value=1.0, periods=252):
+        self.stocks = list(stocks)
+        self.benchmark = benchmark
+        self.initial_value = initial_value
+        self.periods = periods
+        self._positions = {stock: i for i, stock in enumerate(self.stocks)}
+        self._weights = np.asarray(weights, dtype=float)
+        self._closes = np.asarray(last_closes, dtype=float)
+        self._prices = self._closes.copy()
+        self._benchmark_close = last_benchmark_close
+        self._benchmark_price = last_benchmark_close
+
+        # Wealth, running peak and worst drawdown carry on from the last daily close
+        history = portfolio_returns.to_numpy(dtype=float)
+        wealth, peak = wealth_and_peak(np.concatenate(([0.0], history)))
+        self._last_wealth = float(wealth[-1])
+        self._peak = float(peak[-1])
+        self._max_drawdown = float((wealth / peak).min()) - 1
+
+        # Volatility over every day; beta over the days that also have a benchmark return
+        self._returns = OnlineMoments.from_arrays(history)
+        self._paired = None
+        if benchmark_returns is not None and not benchmark_returns.empty and last_benchmark_close is not None:
+            aligned = portfolio_returns.loc[benchmark_returns.index]
+            self._paired = OnlineMoments.from_arrays(aligned.to_numpy(dtype=float), benchmark_returns.to_numpy(dtype=float))
+
+        self.today_return = 0.0
+        self._today = None
+        self._today_pair = None
+        self._last = self.snapshot()
+
+    @classmethod
+    def from_state(cls, state, initial_value=1.0):
+        return cls(state.stocks, state.weights, state.last_closes.to_numpy(dtype=float), state.portfolio_returns,
+                   state.benchmark, state.last_benchmark_close, state.benchmark_returns, initial_value)
+
+    @property
+    def tickers(self):
+        """Tickers whose quotes move the figures: the stocks, then the benchmark."""
+        return self.stocks + ([self.benchmark] if self._paired is not None and self.benchmark not in self._positions else [])
+
+    def _record_today(self):
+        # Replace today's observation in the running moments
+        if self._today is not None:
+            self._returns.remove(self._today)
+        self._today = self.today_return
+        self._returns.add(self._today)
+
+        if self._paired is not None and self._benchmark_price != self._benchmark_close:
+            if self._today_pair is not None:
+                self._paired.remove(*self._today_pair)
+            self._today_pair = (self.today_return, self._benchmark_price / self._benchmark_close - 1)
+            self._paired.add(*self._today_pair)
+
+    def snapshot(self):
+        value = self._last_wealth * (1 + self.today_return)
+        self._peak = max(self._peak, value)
+        drawdown = value / self._peak - 1 + 0.0
+        self._max_drawdown = min(self._max_drawdown, drawdown)
+
+        beta = np.nan
+        if self._paired is not None and self._paired.variance_y > 0:
+            beta = self._paired.covariance / self._paired.variance_y
+        return {
+            "value": self.initial_value * value,
+            "intraday_return": self.today_return,
+            "drawdown": drawdown,
+            "max_drawdown": self._max_drawdown,
+            "volatility": float(np.sqrt(self._returns.variance_x * self.periods)),
+            "beta": float(beta)
+        }
+
+    def update(self, ticker, price):
+        """
+        Applies one quote and returns the figures that changed, or {} when the quote
+        does not move the portfolio (unknown ticker, bad or unchanged price).
+        """
+        if not price or not np.isfinite(price) or price <= 0:
+            return {}
+        position = self._positions.get(ticker)
+        moved = False
+        if position is not None and price != self._prices[position]:
+            # One term of today's weighted return changes
+            self.today_return += self._weights[position] * (price - self._prices[position]) / self._closes[position]
+            self._prices[position] = price
+            moved = True
+        if ticker == self.benchmark and self._paired is not None and price != self._benchmark_price:
+            self._benchmark_price = price
+            moved = True
+        if not moved:
+            return {}
+
+        self._record_today()
+        current = self.snapshot()
+        # Only the deltas are sent; NaN (no beta yet) counts as unchanged
+        changes = {field: current[field] for field in self.FIELDS
+                   if current[field] != self._last[field]
+                   and not (np.isnan(current[field]) and np.isnan(self._last[field]))}
+        self._last = current
+        return changes
+
+
+class QuoteSource:
+    """Source of live price ticks for streaming portfolios."""
+
+    def ticks(self, tickers):
+        """Returns an async iterator of Tick values for tickers; it may never end."""
+        raise NotImplementedError
+
+
+class PollingQuoteSource(QuoteSource):
+    """Polls the shared QuoteService and yields a tick for every price that changed."""
+
+    def __init__(self, quote_service, interval=5.0):
+        self.quote_service = quote_service
+        self.interval = interval
+
+    async def ticks(self, tickers):
+        loop = asyncio.get_running_loop()
+        last = {}
+        while True:
+            quotes = await loop.run_in_executor(None, self.quote_service.get_quotes, list(tickers))
+            now = datetime.now().isoformat(timespec="seconds")
+            for ticker, quote in quotes.items():
+                price = quote.get("price")
+                if price and price != last.get(ticker):
+                    last[ticker] = price
+                    yield Tick(ticker, float(price), now)
+            await asyncio.sleep(self.interval)
+
+
+class ReplayQuoteSource(QuoteSource):
+    """
+    Replays recorded ticks, standing in for the live feed in tests and demos. speed
+    scales the recorded gaps between ticks (2.0 replays twice as fast); 0 replays
+    without waiting. The stream ends after the last recorded tick.
+    """
+
+    def __init__(self, ticks, speed=0.0):
+        self._ticks = sorted(ticks, key=lambda tick: pd.Timestamp(tick.time))
+        self.speed = speed
+
+    @classmethod
+    def from_csv(cls, path, speed=0.0):
+        """Reads ticks from a CSV file with 'time', 'ticker' and 'price' columns."""
+        frame = pd.read_csv(path, dtype={"ticker": str, "price": float, "time": str})
+        return cls([Tick(row.ticker, row.price, row.time) for row in frame.itertuples(index=False)], speed)
+
+    async def ticks(self, tickers):
+        wanted = set(tickers)
+        previous = None
+        for tick in self._ticks:
+            if tick.ticker not in wanted:
+                continue
+            stamp = pd.Timestamp(tick.time)
+            delay = (stamp - previous).total_seconds() / self.speed if self.speed and previous is not None else 0.0
+            previous = stamp
+            # Always yield to the event loop so a fast replay cannot starve other clients
+            await asyncio.sleep(max(delay, 0.0))
+            yield tick
+
+
+_source = None
+_source_lock = threading.Lock()
+
+
+def build_quote_source():
+    """
+    Builds the quote source selected by the environment:
+      STREAM_QUOTE_SOURCE  'live' (default, polls the quote service) or 'replay'
+      STREAM_POLL_SECONDS  polling interval of the live source
+      STREAM_REPLAY_FILE   CSV of recorded ticks (time, ticker, price) for replay
+      STREAM_REPLAY_SPEED  replay speed; 0 replays without waiting
+    """
+    kind = os.environ.get("STREAM_QUOTE_SOURCE", "live").lower()
+    if kind == "replay":
+        return ReplayQuoteSource.from_csv(os.environ["STREAM_REPLAY_FILE"],
+                                          speed=float(os.environ.get("STREAM_REPLAY_SPEED", "1")))
+    if kind != "live":
+        raise ValueError(f"Unknown STREAM_QUOTE_SOURCE '{kind}'")
+
+    from quotes import quote_service
+    return PollingQuoteSource(quote_service, interval=float(os.environ.get("STREAM_POLL_SECONDS", "5")))
+
+
+def get_quote_source():
+    global _source
+    with _source_lock:
+        if _source is None:
+            _source = build_quote_source()
+        return _source
+
+
+def set_quote_source(source):
+    """Replaces the process-wide quote source, e.g. with a ReplayQuoteSource in tests."""
+    global _source
+    with _source_lock:
+        _source = source
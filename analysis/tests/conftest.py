@@ -0,0 +1,9 @@
+import os
+import sys
+
+# The service modules are flat siblings of this directory, imported as app.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Offline, deterministic prices and no warm-up when the app starts
+os.environ["PRICE_PROVIDER"] = "synthetic"
+os.environ["APP_WARM_UP"] = "0"
@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+from backtest import backtest, schedule_mask
+from providers import SyntheticPriceProvider
+
+RULES = [
+    ("daily", None, 0.0),
+    ("daily", None, 10.0),
+    ("none", None, 0.0),
+    ("weekly", 0.02, 0.0),
+    ("monthly", None, 5.0),
+    ("quarterly", 0.05, 5.0),
+    ("annual", None, 25.0),
+    ("none", 0.03, 10.0),
+]
+
+
+@pytest.fixture(scope="module")
+def returns():
+    tickers = [f"T{i}" for i in range(8)]
+    closes = SyntheticPriceProvider().get_closes(tickers, "2010-01-01", "2020-01-01")
+    return closes.pct_change().dropna()
+
+
+@pytest.fixture(scope="module")
+def weights():
+    weights = np.linspace(1, 2, 8)
+    return weights / weights.sum()
+
+
+def reference_backtest(returns, weights, schedule, drift_threshold, cost_bps):
+    # One day at a time: rebalance when allowed, pay for the trades, let the holdings drift
+    allowed = schedule_mask(returns.index, schedule, drift_threshold)
+    held = np.zeros(len(weights))
+    value = 1.0
+    daily, turnover = [], []
+    for day, day_returns in enumerate(returns.to_numpy()):
+        if day == 0 or (allowed[day] and (drift_threshold is None or np.abs(held - weights).max() > drift_threshold)):
+            traded = np.abs(weights - held).sum()
+            turnover.append(traded)
+            start_value = value * (1 - cost_bps / 10_000 * traded)
+            held = weights.copy()
+        else:
+            start_value = value
+        grown = held * (1 + day_returns)
+        new_value = start_value * grown.sum()
+        daily.append(new_value / value - 1)
+        value = new_value
+        held = grown / grown.sum()
+    return np.array(daily), np.array(turnover), held
+
+
+@pytest.mark.parametrize("schedule, drift_threshold, cost_bps", RULES)
+def test_matches_day_by_day_loop(returns, weights, schedule, drift_threshold, cost_bps):
+    result = backtest(returns, weights, schedule, drift_threshold, cost_bps)
+    expected, turnover, final_weights = reference_backtest(returns, weights, schedule, drift_threshold, cost_bps)
+
+    np.testing.assert_allclose(result.portfolio_returns.to_numpy(), expected, rtol=0, atol=1e-12)
+    np.testing.assert_allclose(result.turnover, turnover, rtol=0, atol=1e-12)
+    np.testing.assert_allclose(result.final_weights, final_weights, rtol=0, atol=1e-12)
+
+
+@pytest.mark.parametrize("schedule, drift_threshold, cost_bps", RULES)
+def test_extend_matches_full_run(returns, weights, schedule, drift_threshold, cost_bps):
+    full = backtest(returns, weights, schedule, drift_threshold, cost_bps)
+    extended = backtest(returns.iloc[:1500], weights, schedule, drift_threshold, cost_bps).extend(returns.iloc[1500:])
+
+    np.testing.assert_allclose(extended.portfolio_returns.to_numpy(), full.portfolio_returns.to_numpy(), rtol=0, atol=1e-12)
+    assert extended.rebalance_dates.equals(full.rebalance_dates)
+    np.testing.assert_allclose(extended.costs, full.costs, rtol=0, atol=1e-15)
+    np.testing.assert_allclose(extended.final_weights, full.final_weights, rtol=0, atol=1e-12)
+
+
+def test_daily_without_costs_is_the_weighted_sum(returns, weights):
+    result = backtest(returns, weights)
+    assert result.portfolio_returns.equals((returns * weights).sum(axis=1))
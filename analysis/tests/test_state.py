@@ -0,0 +1,73 @@
+import math
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app as service
+from result_cache import result_cache
+
+PORTFOLIO = {
+    "start_date": "2015-01-01",
+    "end_date": "2024-06-01",
+    "stocks": ["MSFT", "AAPL", "GOOG"],
+    "weights": [0.5, 0.3, 0.2],
+    "benchmark": "SPY",
+    "rolling_windows": [20, 252],
+}
+
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(service.app) as client:
+        yield client
+
+
+def assert_same_response(actual, expected, path=""):
+    # Equal structure, with floats equal up to rounding
+    if isinstance(expected, dict):
+        assert set(actual) == set(expected), path
+        for key in expected:
+            assert_same_response(actual[key], expected[key], f"{path}/{key}")
+    elif isinstance(expected, list):
+        assert len(actual) == len(expected), path
+        for i, (a, b) in enumerate(zip(actual, expected)):
+            assert_same_response(a, b, f"{path}[{i}]")
+    elif isinstance(expected, float) and isinstance(actual, float):
+        assert math.isclose(actual, expected, rel_tol=1e-9, abs_tol=1e-9), path
+    else:
+        assert actual == expected, path
+
+
+def analyze(client, body):
+    response = client.post("/analyze_portfolio", json=body)
+    assert response.status_code == 200, response.text
+    report = response.json()
+    report.pop("live_market_data")
+    return report
+
+
+@pytest.mark.parametrize("options", [
+    {},
+    {"response_format": "columnar", "max_points": 300},
+    {"rebalance": "monthly", "drift_threshold": 0.02, "transaction_cost_bps": 10},
+])
+def test_extended_state_matches_fresh_build(client, options):
+    body = {**PORTFOLIO, **options}
+    result_cache.clear()
+    fresh = analyze(client, body)
+
+    # Build the state for an earlier end date, extend it twice (once from a request
+    # listing the same holdings in another order), then serve it from the cache
+    result_cache.clear()
+    analyze(client, {**body, "end_date": "2023-02-15"})
+    analyze(client, {**body, "end_date": "2023-11-03", "stocks": ["GOOG", "MSFT", "AAPL"], "weights": [0.2, 0.5, 0.3]})
+    extensions = result_cache.extensions
+    extended = analyze(client, body)
+    assert result_cache.extensions > extensions
+
+    hits = result_cache.hits
+    cached = analyze(client, body)
+    assert result_cache.hits > hits
+
+    assert_same_response(extended, fresh)
+    assert_same_response(cached, fresh)
@@ -0,0 +1,123 @@
+import json
+import math
+from datetime import date
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+import app as service
+from metrics import risk_metrics
+from streaming import OnlineMoments, ReplayQuoteSource, Tick, set_quote_source
+
+REQUEST = {
+    "start_date": "2015-01-01",
+    "end_date": "2024-06-01",
+    "stocks": ["MSFT", "AAPL", "GOOG"],
+    "weights": [0.5, 0.3, 0.2],
+    "benchmark": "SPY",
+}
+
+# Each price moves once and only down, so today's drawdown only deepens
+MOVES = [("MSFT", 0.98), ("SPY", 0.99), ("AAPL", 0.97), ("GOOG", 0.995), ("SPY", 0.985)]
+
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(service.app) as client:
+        yield client
+
+
+@pytest.fixture(scope="module")
+def history():
+    return service.get_analysis_state(REQUEST["stocks"], REQUEST["weights"], date(2015, 1, 1), date(2024, 6, 1),
+                                      REQUEST["benchmark"])
+
+
+@pytest.fixture
+def replay(history):
+    closes = dict(history.last_closes.items())
+    closes["SPY"] = history.last_benchmark_close
+    ticks = [Tick(ticker, closes[ticker] * move, f"2024-06-03T10:00:{i:02d}")
+             for i, (ticker, move) in enumerate(MOVES)]
+    set_quote_source(ReplayQuoteSource(ticks))
+    yield {ticker: closes[ticker] * move for ticker, move in MOVES}
+    set_quote_source(None)
+
+
+def expected_figures(history, prices):
+    # risk_metrics over the daily history with today's return appended
+    today = sum(weight * (prices[stock] / history.last_closes[stock] - 1)
+                for stock, weight in zip(REQUEST["stocks"], REQUEST["weights"]))
+    benchmark_today = prices["SPY"] / history.last_benchmark_close - 1
+    returns = np.append(history.portfolio_returns.to_numpy(), today)
+    paired = np.append(history.portfolio_returns.loc[history.benchmark_returns.index].to_numpy(), today)
+    benchmark = np.append(history.benchmark_returns.to_numpy(), benchmark_today)
+
+    wealth = np.cumprod(1 + returns)
+    metrics = risk_metrics(returns)
+    return {
+        "volatility": metrics["Volatility"],
+        "beta": risk_metrics(paired, benchmark)["Beta"],
+        "drawdown": wealth[-1] / max(wealth.max(), 1.0) - 1,
+        "max_drawdown": metrics["Max_Drawdown"],
+    }
+
+
+def final_figures(messages):
+    assert messages[0]["type"] == "snapshot"
+    assert messages[-1]["type"] == "end"
+    figures = {field: messages[0][field] for field in ("volatility", "beta", "drawdown", "max_drawdown")}
+    for message in messages[1:-1]:
+        figures.update({field: value for field, value in message["changes"].items() if field in figures})
+    return figures
+
+
+def assert_figures(actual, expected):
+    for field, value in expected.items():
+        assert math.isclose(actual[field], value, rel_tol=1e-9, abs_tol=1e-12), field
+
+
+def test_websocket_stream_matches_risk_metrics(client, history, replay):
+    with client.websocket_connect("/ws/portfolio") as websocket:
+        websocket.send_json(REQUEST)
+        messages = [websocket.receive_json()]
+        while messages[-1]["type"] != "end":
+            messages.append(websocket.receive_json())
+
+    assert [message["seq"] for message in messages[1:-1]] == list(range(1, len(MOVES) + 1))
+    assert_figures(final_figures(messages), expected_figures(history, replay))
+
+
+def test_sse_stream_matches_risk_metrics(client, history, replay):
+    response = client.post("/stream_portfolio", json=REQUEST)
+    assert response.status_code == 200
+
+    messages = []
+    for event in response.text.strip().split("\n\n"):
+        kind, data = event.split("\n")
+        message = json.loads(data[len("data: "):])
+        assert kind == f"event: {message['type']}"
+        messages.append(message)
+    assert_figures(final_figures(messages), expected_figures(history, replay))
+
+
+def test_online_moments_add_and_remove():
+    rng = np.random.default_rng(7)
+    x, y = rng.normal(0, 0.01, 300), rng.normal(0, 0.02, 300)
+
+    moments = OnlineMoments.from_arrays(x[:200], y[:200])
+    for pair in zip(x[200:], y[200:]):
+        moments.add(*pair)
+    assert math.isclose(moments.variance_x, np.var(x, ddof=1), rel_tol=1e-9)
+    assert math.isclose(moments.covariance, np.cov(x, y)[0, 1], rel_tol=1e-9)
+
+    # Removing any earlier pairs leaves the moments of the rest
+    removed = rng.choice(300, 50, replace=False)
+    for i in removed:
+        moments.remove(x[i], y[i])
+    kept = np.setdiff1d(np.arange(300), removed)
+    assert moments.n == len(kept)
+    assert math.isclose(moments.variance_x, np.var(x[kept], ddof=1), rel_tol=1e-9)
+    assert math.isclose(moments.variance_y, np.var(y[kept], ddof=1), rel_tol=1e-9)
+    assert math.isclose(moments.covariance, np.cov(x[kept], y[kept])[0, 1], rel_tol=1e-9)